@@ -1,33 +1,69 @@
+import logging
 import random
+import time
 from IGameInstance import *
+from solver import DIFFICULTIES, Solver, random_move, heuristic_move
+from book import Book
+from search import THINK_TIME, TimedSearch
+from metrics import AI_MOVE_SECONDS
 
+logger = logging.getLogger(__name__)
 
 class ComputerPlayer(IGameInstance):
-    def __init__(self):
-        super().__init__("computer")
+    def __init__(self, difficulty="perfect", size=3, win_length=3,
+                 think_time=THINK_TIME, workers=None):
+        super().__init__("computer", size=size, win_length=win_length)
         self.id = "X"
         self.computer_player = "O"
+        if difficulty not in DIFFICULTIES:
+            raise ValueError(f"Unknown difficulty: {difficulty}")
+        self.difficulty = difficulty
+        # The perfect player loads its precomputed table once at startup;
+        # boards beyond 3x3 are too large to solve, so it plays from an
+        # opening book (built with book.py) where one exists and otherwise
+        # searches for think_time seconds: on a pool of worker processes
+        # (all cores by default), or on the game thread with workers=0
+        self.think_time = think_time
+        self.solver = None
+        self.book = None
+        self.search = None
+        self.pool = None
+        self.search_id = 0  # Bumped on reset so stale pool moves are dropped
+        if difficulty == "perfect":
+            self.book = Book.open(size, win_length)
+            if self.board.is_classic():
+                self.solver = Solver.load_or_build()
+            elif workers == 0:
+                self.search = TimedSearch(size, win_length)
+            else:
+                # Loaded here: multiprocessing is slow to import
+                from parallel_search import SearchPool
+                self.pool = SearchPool(size, win_length, workers)
 
     def send_packet(self, packet):
         return
 
     def initialize(self):
-        print("Initializing game against the computer...")
+        logger.info("Initializing game against the computer...")
         self.current_player = random.choice(
             [self.id, self.computer_player])
-        print(f"{self.current_player} starts!")
+        logger.info("%s starts!", self.current_player)
+        self.notify({"type": "TURN", "player": self.current_player})
 
         if self.current_player == self.computer_player:
             self.make_computer_move()
 
     def reset_game(self):
-        self.board = [" "] * 9  # Clear the board
+        self.search_id += 1
+        if self.pool:
+            self.pool.cancel()  # Stop thinking about the old board
+        self.board = self.new_board()  # Clear the board
         self.current_player = random.choice(
             [self.id, self.computer_player])
         self.game_over = False  # Reset game over flag
-        print("Game has been reset!")
-        if (self.gui_callback):
-            self.gui_callback({"type": "RESET"})  # Notify GUI of the reset
+        logger.info("Game has been reset!")
+        self.notify({"type": "RESET"})  # Notify GUI of the reset
+        self.notify({"type": "TURN", "player": self.current_player})
 
         if self.current_player == self.computer_player:
             self.make_computer_move()
@@ -38,85 +74,114 @@ class ComputerPlayer(IGameInstance):
         if packet_type == PacketType.MOVE.value:
             player = packet.get("player")
             move = packet.get("move")
+            if packet.get("search", self.search_id) != self.search_id:
+                logger.debug("Dropping a move searched before the reset.")
+                return
 
-            if self.board[move] == " ":
-                self.board[move] = player
-                print(f"Move processed: Player {player} to position {move}")
+            if self.board.is_free(move):
+                self.board.play(move, player)
+                logger.debug("Move processed: Player %s to position %s", player, move)
+                self.notify({"type": "CELL", "index": move, "player": player})
 
-                if self.check_win(player):
+                if self.check_win(player, move):
                     result = "You win!" if player == self.id else "Computer wins!"
-                    print(result)
-                    if (self.gui_callback):
-                        self.gui_callback({"type": "END", "result": result})
+                    logger.info(result)
+                    self.notify({"type": "END", "result": result})
                     self.isOver = True
                     return
 
-                if " " not in self.board:
+                if self.board.is_full():
                     result = "The game is a draw!"
-                    print(result)
-                    if (self.gui_callback):
-                        self.gui_callback({"type": "END", "result": result})
+                    logger.info(result)
+                    self.notify({"type": "END", "result": result})
                     self.isOver = True
                     return
 
                 self.current_player = (
                     self.id if player == self.computer_player else self.computer_player
                 )
+                self.notify({"type": "TURN", "player": self.current_player})
 
                 if self.current_player == self.computer_player:
                     self.make_computer_move()
             else:
-                print(f"Invalid move by {player} at position {move} ignored.")
+                logger.warning("Invalid move by %s at position %s ignored.",
+                               player, move)
 
     def play_turn(self, index):
-        if self.board[index] == " ":
+        if self.board.is_free(index):
             self.packet_queue.put(
                 {"type": PacketType.MOVE.value,
                     "player": self.id, "move": index}
             )
         else:
-            print("Invalid move. Try again.")
+            logger.warning("Invalid move. Try again.")
 
     def make_computer_move(self):
-        print("Computer's turn...")
-        move = self.find_best_move()
+        logger.debug("Computer's turn...")
+        if self.pool:
+            move = self.precomputed_move()
+            if move == -1:
+                self.start_search()
+                return
+        else:
+            move = self.find_best_move()
         if move != -1:
             self.packet_queue.put(
                 {"type": PacketType.MOVE.value,
                     "player": self.computer_player, "move": move}
             )
         else:
-            print("No moves available! Game over.")
-
-    def checkIfFree(self):
-        for i in range(9):
-            if self.board[i] == " ":
-                return i
+            logger.info("No moves available! Game over.")
+
+    def start_search(self):
+        # The pool answers on one of its threads; the move goes through
+        # packet_queue like any other, tagged with the search it came from
+        search_id = self.search_id
+        player = self.computer_player
+        started = time.perf_counter()
+
+        def finished(move):
+            AI_MOVE_SECONDS.observe(time.perf_counter() - started,
+                                    self.difficulty)
+            if move == -1:
+                logger.info("No moves available! Game over.")
+                return
+            self.packet_queue.put({"type": PacketType.MOVE.value,
+                                   "player": player, "move": move,
+                                   "search": search_id})
+
+        self.pool.start(self.board.mask(player), self.board.mask(self.id),
+                        self.think_time, finished)
+
+    def precomputed_move(self):
+        # Book or solver table move, or -1 when neither covers the position
+        if self.book:
+            move = self.book.choose(self.board, self.computer_player)
+            if move != -1:
+                return move
+        if self.solver:
+            return self.solver.choose(self.board, self.computer_player)
         return -1
 
     def find_best_move(self):
-        isFree = self.checkIfFree()
-        if (isFree == -1):
-            return isFree
-
-        while (True):
-            r = random.randint(0, 8)
-            if (self.board[r] == ' '):
-                return r
-
-    def check_win(self, player):
-        win_positions = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # Rows
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # Columns
-            [0, 4, 8], [2, 4, 6],             # Diagonals
-        ]
-        for positions in win_positions:
-            if all(self.board[pos] == player for pos in positions):
-                return True
-        return False
-
-    def run_game(self):
-        while self.running:
-            if not self.packet_queue.empty():
-                packet = self.packet_queue.get()
-                self.process_packet(packet)
+        with AI_MOVE_SECONDS.time(self.difficulty):
+            move = self.precomputed_move()
+            if move != -1:
+                return move
+            if self.search:
+                move = self.search.choose(self.board, self.computer_player,
+                                          self.think_time)
+                logger.debug("Searched to depth %d, %d nodes in %.2fs",
+                             self.search.stats["depth"],
+                             self.search.stats["nodes"],
+                             self.search.stats["seconds"])
+                return move
+            if self.difficulty == "random":
+                return random_move(self.board, self.computer_player)
+            return heuristic_move(self.board, self.computer_player)
+
+    def stop(self):
+        if self.pool:
+            self.pool.close()
+        super().stop()
@@ -1,5 +1,15 @@
-import json
+import logging
+import socket
+import time
 from threading import Thread
+from codec import FrameDecoder
+from heartbeat import PING, threaded_reaper
+from metrics import PACKETS_RECEIVED, PACKETS_REJECTED
+from validate import FLOOD_LIMIT, TokenBucket, admit
+
+logger = logging.getLogger(__name__)
+
+RECV_SIZE = 16384  # Bytes per read; bounds how many packets one burst holds
 
 
 class EventHandler:
@@ -7,27 +17,64 @@ class EventHandler:
         self.connection = connection  # The socket connection
         self.game_instance = game_instance  # Reference to the IGameInstance
         self.running = True
+        self.bucket = None  # Limits a server's peer, not what servers send
+        if game_instance.limit_peer:
+            self.bucket = TokenBucket(now=time.monotonic())
+        self.last_seen = time.monotonic()
+        self.reaper = None  # Shared wheel that notices a silent peer
+        if game_instance.idle_timeout:
+            self.reaper = threaded_reaper(game_instance.idle_timeout,
+                                          game_instance.ping_timeout)
 
     def receive_packets(self):
-        buffer = ""
+        decoder = FrameDecoder()  # Handles JSON lines and binary frames
+        if self.reaper is not None:
+            self.reaper.watch(self)
         while self.running:
             try:
-                data = self.connection.recv(
-                    1024).decode()  # Read incoming data
-                if data:
-                    buffer += data
-                    while "\n" in buffer:
-                        packet_data, buffer = buffer.split("\n", 1)
-                        try:
-                            packet = json.loads(packet_data)
-                            self.game_instance.packet_queue.put(packet)
-                        except json.JSONDecodeError as e:
-                            print(f"Error decoding packet: {e}")
+                # Read straight into the decoder's buffer, no per-read copies
+                count = self.connection.recv_into(
+                    decoder.writable()[:RECV_SIZE])
+                if count == 0:
+                    raise ConnectionResetError("Peer closed the connection")
+                packets = self.admit(decoder.commit(count))
+                if packets:
+                    self.game_instance.put_packets(packets)
             except (ConnectionResetError, OSError):
-                print("Connection lost.")
+                logger.warning("Connection lost.")
                 self.connection = None
+                if self.running:  # Not a shutdown we asked for
+                    self.game_instance.connection_lost()
                 self.running = False
                 break
+        if self.reaper is not None:
+            self.reaper.unwatch(self)
+
+    def admit(self, packets):
+        # Drop malformed packets, and a limited peer's excess, before they
+        # reach the game thread
+        now = self.last_seen = time.monotonic()
+        admitted = []
+        for packet in packets:
+            reason = admit(packet, self.bucket, now)
+            if reason:
+                PACKETS_REJECTED.inc(reason)
+                continue
+            PACKETS_RECEIVED.inc(packet["type"])
+            admitted.append(packet)
+        if self.bucket is not None and self.bucket.dropped > FLOOD_LIMIT:
+            logger.warning("Peer is flooding, disconnecting.")
+            self.connection.shutdown(socket.SHUT_RDWR)
+            raise ConnectionResetError("Peer flooded us")
+        return admitted
+
+    def ping(self):
+        # Runs on the heartbeat thread, like a send from the GUI
+        self.game_instance.send_packet(PING)
+
+    def reap(self):
+        logger.warning("Peer stopped answering, disconnecting.")
+        self.stop_reading()
 
     def start(self):
         thread = Thread(target=self.receive_packets)
@@ -35,3 +82,12 @@ class EventHandler:
 
     def stop(self):
         self.running = False
+        self.stop_reading()
+
+    def stop_reading(self):
+        if self.connection:
+            try:
+                # Unblock the recv() in receive_packets
+                self.connection.shutdown(socket.SHUT_RDWR)
+            except OSError:
+                pass
@@ -1,30 +1,52 @@
+import logging
+import time
 from abc import ABC, abstractmethod
-from queue import Queue
-from enum import Enum
-import socket
-import json
+from queue import Empty, Queue
+from bitboard import BitBoard
+from packets import PacketType
+from threading import Thread
+from codec import JSON, encode_packet
+from writer import OutboundWriter
+from EventHandler import EventHandler
+from heartbeat import IDLE_TIMEOUT, PING_TIMEOUT
+from metrics import PACKETS_SENT, PROCESS_SECONDS, QUEUE_DEPTH, SEND_SECONDS
 
+logger = logging.getLogger(__name__)
 
-class PacketType(Enum):
-    PLAYER_TURN = "PLAYER_TURN"
-    GAME_STATE = "GAME_STATE"
-    GAME_WIN = "GAME_WIN"
-    ACKNOWLEDGE = "ACKNOWLEDGE"
-    MOVE = "MOVE"
-    RESET = "RESET"  # New reset packet type
+
+# Sentinel pushed by stop() to wake a dispatcher blocked on an empty queue
+STOP_PACKET = object()
+DRAIN_LIMIT = 64  # Queued entries handled per wake-up before a flush
+
+
+class ConnectionEvent:
+    # Queued by network threads so a connection is swapped on the dispatch
+    # thread, in order with the packets around it. None means it was lost
+    def __init__(self, connection=None):
+        self.connection = connection
 
 
 class IGameInstance(ABC):
-    def __init__(self, role, host="localhost", port=11341):
+    limit_peer = False  # Rate limit and shape-check packets from the peer
+
+    def __init__(self, role, host="localhost", port=11341, size=3, win_length=3):
         self.role = role  # "server" or "client"
         self.host = host
         self.port = port
-        self.board = [" "] * 9  # Shared game board
+        self.size = size  # Board is size x size
+        self.win_length = win_length  # Stones in a row needed to win
+        self.board = BitBoard(size, win_length)  # Shared game board
         self.packet_queue = Queue()  # Queue for processing packets
         self.running = True
         self.current_player = None  # Tracks whose turn it is
-        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        self.socket = None  # Created by roles that actually connect
         self.connection = None
+        self.codec = JSON  # Wire format negotiated with the peer
+        self.writer = None  # Batches outbound packets for the connection
+        self.event_handler = None  # Reader for a connection we set up ourselves
+        self.idle_timeout = IDLE_TIMEOUT  # PING a silent peer; 0 never does
+        self.ping_timeout = PING_TIMEOUT  # ...and drop it if it doesn't answer
+        self.dispatching = False  # Inside a process_packet cycle
         self.gui_callback = None  # Optional callback for GUI updates
         self.id = None
         self.isOver = False
@@ -32,40 +54,140 @@ class IGameInstance(ABC):
     def set_gui_callback(self, callback):
         self.gui_callback = callback
 
+    def notify(self, update):
+        # Post a state-change event (CELL, BOARD, TURN, END, RESET,
+        # RECONNECTING, DISCONNECTED) to the GUI; called from the game thread
+        if self.gui_callback:
+            self.gui_callback(update)
+
+    def connection_lost(self):
+        # Called from the receive thread when the peer goes away
+        self.connection = None
+        self.notify({"type": "DISCONNECTED"})
+
+    def connection_changed(self, connection):
+        pass  # Only roles that can reconnect queue ConnectionEvents
+
+    def watch_connection(self, connection):
+        # Start reading a connection opened after initialize()
+        self.event_handler = EventHandler(connection, self)
+        Thread(target=self.event_handler.receive_packets, daemon=True).start()
+
+    def drop_connection(self):
+        if self.writer:
+            self.writer.close(timeout=0)  # Nobody left to send it to
+        self.writer = None
+        self.connection = None
+
     @abstractmethod
     def initialize(self):
         pass
 
+    def set_connection(self, connection):
+        self.connection = connection
+        self.codec = JSON  # Every connection starts out speaking JSON
+        self.writer = OutboundWriter(connection)
+
     def send_packet(self, packet):
 
         try:
-            # Append newline as a delimiter
-            message = json.dumps(packet) + "\n"
-            self.connection.sendall(message.encode())
+            data = encode_packet(packet, self.codec)
+            PACKETS_SENT.inc(packet.get("type"))
+            if self.writer is None:
+                start = time.perf_counter()
+                self.connection.sendall(data)
+                SEND_SECONDS.observe(time.perf_counter() - start)
+                return
+            self.writer.enqueue(data)
+            if not self.dispatching:
+                # Sent from outside the game loop (e.g. the GUI); don't wait
+                self.writer.flush()
         except Exception as e:
-            print(f"Error sending packet: {e}")
+            logger.error("Error sending packet: %s", e)
+
+    def flush(self):
+        # Everything one dispatch cycle produced goes out as one write
+        if self.writer:
+            self.writer.flush()
 
     @abstractmethod
     def process_packet(self, packet):
         pass
 
     def run(self):
+        # Block until a packet arrives instead of spinning on empty(), then
+        # take what queued up meanwhile without waiting to be woken again
         while self.running:
-            if not self.packet_queue.empty():
-                packet = self.packet_queue.get()
-                self.process_packet(packet)
-
-    def check_win(self, player):
-        win_positions = [
-            [0, 1, 2], [3, 4, 5], [6, 7, 8],  # Rows
-            [0, 3, 6], [1, 4, 7], [2, 5, 8],  # Columns
-            [0, 4, 8], [2, 4, 6]              # Diagonals
-        ]
-        for positions in win_positions:
-            # Check if all positions are occupied by the same player and not " "
-            if all(self.board[pos] == player for pos in positions) and player != " ":
-                return True
-        return False
+            packet = self.packet_queue.get()
+            QUEUE_DEPTH.set(self.packet_queue.qsize())
+            self.dispatching = True
+            try:
+                handled = 0
+                while packet is not STOP_PACKET:
+                    self.handle_queued(packet)
+                    handled += 1
+                    if handled == DRAIN_LIMIT:
+                        break  # Let the replies so far go out
+                    try:
+                        packet = self.packet_queue.get_nowait()
+                    except Empty:
+                        break
+            finally:
+                self.dispatching = False
+                self.flush()
+            if packet is STOP_PACKET:
+                break
+
+    def handle_queued(self, packet):
+        if isinstance(packet, ConnectionEvent):
+            self.connection_changed(packet.connection)
+        elif type(packet) is list:
+            # A burst queued in one go by put_packets
+            for item in packet:
+                self.dispatch(item)
+        else:
+            self.dispatch(packet)
+
+    def dispatch(self, packet):
+        start = time.perf_counter()
+        self.process_packet(packet)
+        PROCESS_SECONDS.observe(time.perf_counter() - start, packet.get("type"))
+
+    def put_packets(self, packets):
+        # One queue operation (and one wakeup) per received burst
+        self.packet_queue.put(packets[0] if len(packets) == 1 else packets)
+
+    def run_game(self):
+        self.run()
+
+    def clear_packets(self):
+        # Drop pending packets but keep stop requests and connection changes
+        with self.packet_queue.mutex:
+            kept = [item for item in self.packet_queue.queue
+                    if item is STOP_PACKET or isinstance(item, ConnectionEvent)]
+            self.packet_queue.queue.clear()
+            self.packet_queue.queue.extend(kept)
+
+    def new_board(self):
+        return BitBoard(self.size, self.win_length)
+
+    def configure(self, size, win_length):
+        self.size = size
+        self.win_length = win_length
+        self.board = self.new_board()
+
+    def config_packet(self):
+        return {"type": PacketType.CONFIG.value,
+                "size": self.size, "win_length": self.win_length}
+
+    def check_win(self, player, last_move=None):
+        # With the last move only the lines through it need checking
+        return self.board.has_won(player, last_move)
 
     def stop(self):
         self.running = False
+        if self.writer:
+            self.writer.close()
+        if self.event_handler:
+            self.event_handler.stop()
+        self.packet_queue.put(STOP_PACKET)  # Wake up the dispatcher
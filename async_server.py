@@ -0,0 +1,810 @@
+import argparse
+import asyncio
+import logging
+import os
+import time
+import log
+import metrics
+from server import Server
+from IGameInstance import *
+from codec import FrameDecoder, choose_codec, choose_features
+from fanout import DROP_AFTER, HIGH_WATER, LOW_WATER, Fanout
+from heartbeat import IDLE_TIMEOUT, PING, PING_TIMEOUT, PONG, IdleReaper
+from metrics import (PACKETS_RECEIVED, PACKETS_REJECTED, PACKETS_SENT,
+                     PROCESS_SECONDS)
+from lobby import FIFO, MATCH_MODES, RATING, Lobby
+from movelog import END, MOVE, TURN, MoveLog, next_room, recover
+from replays import (DRAW, FLUSH_INTERVAL, O_LEFT, O_WON, X_LEFT, X_WON,
+                     ReplayWriter)
+from session import (RESUME_TIMEOUT, UNNUMBERED, Session, load_key,
+                     resume_packet, seat_token)
+from validate import (BURST, FLOOD_LIMIT, MALFORMED, RATE, TokenBucket,
+                      admit, rating_error)
+from writer import MAX_QUEUED_BYTES, WriteStats
+
+logger = logging.getLogger(__name__)
+
+MAX_NAME = 32  # Longest HELLO name kept for the replays
+JOIN_GRACE = 0.1  # Seconds a silent new connection waits before the lobby
+
+
+class Room(Server):
+    # One match between two remote players, driven by the Server rules
+    def __init__(self, room_id, size=3, win_length=3):
+        super().__init__(size=size, win_length=win_length)
+        self.room_id = room_id
+        self.players = {}  # Symbol -> PlayerProtocol
+        self.spectators = Fanout()
+        self.replays = None  # ReplayWriter that finished matches go to
+        self.first = None
+        self.started = 0.0
+        self.cells = []  # Accepted moves, their players and times
+        self.movers = []
+        self.times = []
+
+    def recycle(self, room_id):
+        # Reuse a finished room for a new match instead of building another
+        self.room_id = room_id
+        self.board = self.new_board()
+        self.current_player = None
+        self.isOver = False
+        self.seq = 0
+        self.players = {}
+
+    def initialize(self):
+        for symbol, player in self.players.items():
+            # Numbering starts here; the token brings the player back to
+            # this seat if its connection drops
+            player.send(resume_packet(player.session.token, 0))
+            player.send({"type": PacketType.WELCOME.value,
+                         "player": symbol, "room": self.room_id})
+            player.send(self.config_packet())
+        self.decide_first_player()
+
+    def send_packet(self, packet):
+        for player in self.players.values():
+            player.send(packet)
+
+    def log_event(self, kind, cell=0, player=None):
+        super().log_event(kind, cell, player)
+        if self.replays is None:
+            return
+        if kind == TURN:
+            self.first = player
+            self.started = time.time()
+            self.cells, self.movers, self.times = [], [], []
+        elif kind == MOVE:
+            self.cells.append(cell)
+            self.movers.append(player)
+            self.times.append(time.time())
+
+    def save_replay(self, result):
+        if self.replays is None or self.first is None:
+            return
+        first, self.first = self.first, None
+        try:
+            self.replays.append(self.players["X"].name,
+                                self.players["O"].name, first, result,
+                                self.cells, self.movers, self.times,
+                                self.started)
+        except OSError as e:
+            # Analytics only; the match itself is already over
+            logger.error("Could not save replay of room %s: %s",
+                         self.room_id, e)
+
+    def broadcast(self, packet):
+        # Nobody reads our own queue, so only the players get it
+        self.send_packet(packet)
+
+    def publish_move(self, move, player, result):
+        # Players negotiate delta updates separately; build each form once
+        packets = {}
+
+        def build(delta):
+            if delta not in packets:
+                packets[delta] = self.move_packets(move, player, result, delta)
+            return packets[delta]
+
+        for p in self.players.values():
+            for packet in build(p.delta):
+                p.send(packet)
+        if self.spectators:
+            self.spectators.publish(build)
+        if result:
+            self.save_replay((X_WON if player == "X" else O_WON)
+                             if self.check_win(player, move) else DRAW)
+
+    def handle_packet(self, player, packet):
+        if packet.get("type") == PacketType.SYNC.value:
+            player.send(self.snapshot_packet())
+            return
+        if packet.get("type") != PacketType.MOVE.value or self.isOver:
+            return
+        # Players may only move for themselves
+        packet["player"] = player.symbol
+        self.process_packet(packet)
+
+    def close(self, leaver):
+        if not self.isOver:
+            self.isOver = True
+            self.log_event(END)
+            result = {"type": PacketType.GAME_WIN.value,
+                      "result": f"Player {leaver.symbol} left the game."}
+            for player in self.players.values():
+                if player is not leaver:
+                    player.send(result)
+            self.spectators.publish(lambda delta: [result])
+            self.save_replay(X_LEFT if leaver.symbol == "X" else O_LEFT)
+        for player in self.players.values():
+            player.room = None
+            if player is not leaver:
+                player.close()
+        self.players = {}
+        # Spectators stay connected and may WATCH another room
+        for spectator in self.spectators:
+            spectator.room = None
+        self.spectators = Fanout()
+
+
+class PlayerProtocol(asyncio.BufferedProtocol):
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.pending = []  # Packets produced in the current loop iteration
+        self.decoder = FrameDecoder()
+        self.codec = JSON
+        self.delta = False
+        self.room = None
+        self.symbol = None
+        self.rating = None
+        self.name = None  # Recorded with replays; the HELLO name or address
+        self.bucket = server.new_bucket()
+        self.last_seen = time.monotonic()
+        self.session = None  # Numbers and keeps what the seat was sent
+        self.joining = None  # Timer that puts a silent connection in the lobby
+        self.away = None  # Timer that gives up the seat after a lost connection
+
+    def connection_made(self, transport):
+        self.transport = transport
+        peer = transport.get_extra_info("peername")
+        self.name = peer[0] if peer else "?"
+        self.server.watch_idle(self)
+        self.server.join(self)
+
+    def get_buffer(self, sizehint):
+        # The loop reads straight into the decoder's buffer
+        return self.decoder.writable()
+
+    def buffer_updated(self, nbytes):
+        now = self.last_seen = time.monotonic()
+        for packet in self.decoder.commit(nbytes):
+            reason = admit(packet, self.bucket, now)
+            if reason:
+                PACKETS_REJECTED.inc(reason)
+                if self.server.flooding(self):
+                    return
+                continue
+            packet_type = packet["type"]
+            PACKETS_RECEIVED.inc(packet_type)
+            if packet_type == PacketType.PING.value:
+                self.send(PONG)
+                continue
+            if packet_type == PacketType.PONG.value:
+                continue  # Arriving was the point
+            if packet_type == PacketType.RESUME.value:
+                self.server.resume(self, packet.get("token"),
+                                   packet.get("seq"))
+                continue
+            if packet_type == PacketType.HELLO.value:
+                # Codecs are per connection, so negotiate before any room
+                answer_hello(self, packet)
+                rating = packet.get("rating")
+                if rating is not None:
+                    reason = rating_error(rating)
+                    if reason:
+                        PACKETS_REJECTED.inc(reason)  # Matched as unrated
+                    else:
+                        self.rating = rating
+                name = packet.get("name")
+                if type(name) is str and 0 < len(name) <= MAX_NAME:
+                    self.name = name
+                self.server.ready(self)
+                continue
+            if self.room is None:
+                if self.server.lobby.mode == FIFO:
+                    self.server.ready(self)  # Not a returning player, then
+                continue  # Still waiting for an opponent
+            start = time.perf_counter()
+            try:
+                self.room.handle_packet(self, packet)
+            except (ValueError, TypeError, IndexError) as e:
+                logger.warning("Dropping bad packet in room %s: %s",
+                               self.room.room_id, e)
+            PROCESS_SECONDS.observe(time.perf_counter() - start, packet_type)
+
+    def send(self, packet):
+        # Kept for replay even while nobody is connected to the seat
+        if self.session is not None and packet["type"] not in UNNUMBERED:
+            self.session.record(packet)
+        self.write(packet)
+
+    def write(self, packet):
+        if self.transport is None or self.transport.is_closing():
+            return
+        self.pending.append(encode_packet(packet, self.codec))
+        PACKETS_SENT.inc(packet.get("type"))
+        if len(self.pending) == 1:
+            # Runs after the current callback, so one write per cycle
+            asyncio.get_running_loop().call_soon(self.flush)
+
+    def flush(self):
+        if (not self.pending or self.transport is None
+                or self.transport.is_closing()):
+            self.pending = []
+            return
+        data = b"".join(self.pending)
+        self.server.write_stats.record_batch(len(self.pending), len(data))
+        self.pending = []
+        self.transport.write(data)
+        if self.transport.get_write_buffer_size() > MAX_QUEUED_BYTES:
+            # The peer stopped reading; don't let it hold memory hostage
+            logger.warning("Peer is too far behind, disconnecting.")
+            self.server.write_stats.dropped_peers += 1
+            self.transport.abort()
+
+    def close(self):
+        if self.transport is None:
+            return  # A seat nobody came back to
+        self.flush()
+        self.transport.close()
+
+    def ping(self):
+        self.send(PING)
+
+    def reap(self):
+        logger.warning("Peer stopped answering, disconnecting.")
+        self.transport.abort()
+
+    def connection_lost(self, exc):
+        self.server.unwatch_idle(self)
+        self.server.leave(self)
+
+
+class SpectatorProtocol(asyncio.BufferedProtocol):
+    # Read-only connection: optional HELLO, then WATCH a room. Writes go
+    # straight to the transport; its buffer limits mark a lagging spectator
+    def __init__(self, server):
+        self.server = server
+        self.transport = None
+        self.decoder = FrameDecoder(4096)
+        self.codec = JSON
+        self.delta = False
+        self.room = None
+        self.lagging = False
+        self.lagging_since = 0.0
+        self.bucket = server.new_bucket()
+        self.last_seen = time.monotonic()
+
+    def connection_made(self, transport):
+        self.transport = transport
+        transport.set_write_buffer_limits(HIGH_WATER, LOW_WATER)
+        self.server.spectators.add(self)
+        self.server.watch_idle(self)
+
+    def get_buffer(self, sizehint):
+        return self.decoder.writable(1024)
+
+    def buffer_updated(self, nbytes):
+        now = self.last_seen = time.monotonic()
+        for packet in self.decoder.commit(nbytes):
+            reason = admit(packet, self.bucket, now)
+            if reason:
+                PACKETS_REJECTED.inc(reason)
+                if self.server.flooding(self):
+                    return
+                continue
+            packet_type = packet["type"]
+            PACKETS_RECEIVED.inc(packet_type)
+            if packet_type == PacketType.HELLO.value:
+                room = self.room
+                self.server.unwatch(self)  # Its fan-out group may change
+                answer_hello(self, packet)
+                if room is not None:
+                    self.server.watch(self, room.room_id)
+            elif packet_type == PacketType.WATCH.value:
+                self.server.watch(self, packet.get("room"))
+            elif packet_type == PacketType.PING.value:
+                self.send(PONG)
+            # Spectators can't play; anything else is ignored
+
+    def send(self, packet):
+        if not self.transport.is_closing():
+            self.write(encode_packet(packet, self.codec))
+            PACKETS_SENT.inc(packet.get("type"))
+
+    def write(self, data):
+        self.transport.write(data)
+        self.server.spectator_bytes += len(data)
+
+    def pause_writing(self):
+        # Skip live updates until the socket drains
+        self.lagging = True
+        self.lagging_since = time.monotonic()
+        self.server.spectators_lagged += 1
+
+    def resume_writing(self):
+        self.lagging = False
+        if self.room is not None:
+            self.send(self.room.snapshot_packet())  # Catch up in one go
+
+    def ping(self):
+        self.send(PING)
+
+    def reap(self):
+        logger.warning("Spectator stopped answering, disconnecting.")
+        self.transport.abort()
+
+    def connection_lost(self, exc):
+        self.server.unwatch_idle(self)
+        self.server.unwatch(self)
+        self.server.spectators.discard(self)
+
+
+def answer_hello(connection, packet):
+    # Answer in the current format, then switch to the agreed one
+    codec = choose_codec(packet.get("codecs"))
+    features = choose_features(packet.get("features"))
+    connection.send({"type": PacketType.HELLO.value, "codec": codec,
+                     "features": features})
+    connection.codec = codec
+    connection.delta = "delta" in features
+
+
+class AsyncGameServer:
+    # Accepts any number of clients and pairs them into rooms on one loop
+    def __init__(self, host="localhost", port=12345, size=3, win_length=3,
+                 match_mode=FIFO, reuse_port=False, sock=None, log_path=None,
+                 spectator_port=None, replays_path=None, rate=RATE,
+                 burst=BURST, idle_timeout=IDLE_TIMEOUT,
+                 ping_timeout=PING_TIMEOUT, resume_timeout=RESUME_TIMEOUT):
+        self.host = host
+        self.port = port
+        self.spectator_port = spectator_port  # Separate read-only listener
+        self.reuse_port = reuse_port  # Several processes share the port
+        self.sock = sock  # Listening socket inherited from a parent process
+        self.size = size
+        self.win_length = win_length
+        self.lobby = Lobby(match_mode)  # Players waiting for an opponent
+        self.rooms = {}
+        self.free_rooms = []  # Finished rooms kept for reuse
+        self.next_room_id = 0
+        self.matches_started = 0
+        self.matches_finished = 0
+        self.connections = set()
+        self.write_stats = WriteStats()
+        self.rate = rate  # Packets per second per connection; 0 for no limit
+        self.burst = burst
+        self.flooders_dropped = 0
+        self.reaper = None  # Pings idle connections and drops silent ones
+        if idle_timeout:
+            self.reaper = IdleReaper(idle_timeout, ping_timeout,
+                                     time.monotonic())
+        self.resume_timeout = resume_timeout  # Seconds a left seat is held
+        self.sessions = {}  # Token -> the player holding that seat
+        self.resumed = 0
+        self.spectators = set()
+        self.spectator_bytes = 0
+        self.spectators_lagged = 0
+        self.spectators_dropped = 0
+        self.server = None
+        self.spectator_server = None
+        self.log = None
+        self.token_key = None  # Makes seat tokens that outlive a restart
+        self.recovered = {}  # Room id -> MatchState of unfinished matches
+        if log_path:
+            self.open_log(log_path)
+        self.replays = None
+        if replays_path:
+            self.replays = ReplayWriter(replays_path, size, win_length)
+
+    def open_log(self, path):
+        if os.path.exists(path):
+            _, _, self.recovered = recover(path)
+            # New matches never reuse an id, or its seat tokens
+            self.next_room_id = next_room(path)
+            if self.recovered:
+                logger.info("Recovered %d unfinished matches from %s",
+                            len(self.recovered), path)
+        self.log = MoveLog(path, self.size, self.win_length)
+        self.token_key = load_key(path + ".key")
+
+    def restore_matches(self):
+        # Reopens the recovered matches with empty seats; their players
+        # come back with the tokens they were given before the restart
+        loop = asyncio.get_running_loop()
+        for room_id, state in self.recovered.items():
+            if state.current_player is None or not self.resume_timeout:
+                self.log.append(END, room_id)  # Nobody can pick it up
+                continue
+            room = Room(room_id, self.size, self.win_length)
+            room.log = self.log
+            room.replays = self.replays
+            room.board = state.board(self.size, self.win_length)
+            room.current_player = state.current_player
+            room.seq = state.moves
+            for symbol in ("X", "O"):
+                seat = PlayerProtocol(self)
+                seat.room, seat.symbol = room, symbol
+                seat.session = Session(token=self.new_token(room_id, symbol))
+                seat.away = loop.call_later(self.resume_timeout,
+                                            self.abandon, seat)
+                room.players[symbol] = seat
+                self.sessions[seat.session.token] = seat
+            self.rooms[room_id] = room
+        if self.recovered:
+            logger.info("Holding %d recovered matches for %ss.",
+                        len(self.rooms), self.resume_timeout)
+        self.recovered = {}
+
+    def new_bucket(self):
+        if not self.rate:
+            return None
+        return TokenBucket(self.rate, self.burst, time.monotonic())
+
+    def flooding(self, connection):
+        # Cuts off a connection that keeps sending past its rate limit
+        bucket = connection.bucket
+        if bucket is None or bucket.dropped <= FLOOD_LIMIT:
+            return False
+        if not connection.transport.is_closing():
+            logger.warning("Peer is flooding, disconnecting.")
+            self.flooders_dropped += 1
+            connection.transport.abort()
+        return True
+
+    def watch_idle(self, connection):
+        if self.reaper is not None:
+            self.reaper.watch(connection)
+
+    def unwatch_idle(self, connection):
+        if self.reaper is not None:
+            self.reaper.unwatch(connection)
+
+    async def reap_idle(self):
+        # One wheel for every connection; a reaped player's room is closed
+        # and freed by leave() like any other lost connection
+        while True:
+            await asyncio.sleep(self.reaper.wheel.tick)
+            self.reaper.advance(time.monotonic())
+
+    def join(self, player):
+        self.connections.add(player)
+        if self.lobby.mode == FIFO:
+            # A returning player's RESUME must come before any pairing, so
+            # the lobby waits for the first packet (or a moment of silence)
+            player.joining = asyncio.get_running_loop().call_later(
+                JOIN_GRACE, self.ready, player)
+        # Rated matches wait for the rating in the player's HELLO
+
+    def ready(self, player):
+        if player.joining is not None:
+            player.joining.cancel()
+            player.joining = None
+        if (player.room is not None or player in self.lobby
+                or player not in self.connections):
+            return
+        pair = self.lobby.enqueue(player, player.rating)
+        if pair:
+            self.start_match(*pair)
+
+    def match_expired(self):
+        for pair in self.lobby.expire():
+            self.start_match(*pair)
+
+    def start_match(self, first, second):
+        if self.free_rooms:
+            room = self.free_rooms.pop()
+            room.recycle(self.next_room_id)
+        else:
+            room = Room(self.next_room_id, self.size, self.win_length)
+            room.log = self.log
+            room.replays = self.replays
+        self.next_room_id += 1
+        first.symbol, second.symbol = "X", "O"
+        for p in (first, second):
+            p.room = room
+            room.players[p.symbol] = p
+            p.session = Session(token=self.new_token(room.room_id, p.symbol))
+            self.sessions[p.session.token] = p
+        self.rooms[room.room_id] = room
+        self.matches_started += 1
+        room.initialize()
+
+    def new_token(self, room_id, symbol):
+        if self.token_key is None:
+            return None  # Session() picks a random one
+        return seat_token(self.token_key, room_id, symbol)
+
+    def leave(self, player):
+        self.connections.discard(player)
+        self.lobby.remove(player)
+        if player.joining is not None:
+            player.joining.cancel()
+            player.joining = None
+        room = player.room
+        if room is None:
+            return
+        if not room.isOver and self.resume_timeout:
+            # Hold the seat; the player may come back with its token
+            logger.info("Player %s left room %s, holding the seat.",
+                        player.symbol, room.room_id)
+            player.away = asyncio.get_running_loop().call_later(
+                self.resume_timeout, self.abandon, player)
+            return
+        self.abandon(player)
+
+    def abandon(self, player):
+        # Ends the player's match for good: the opponent wins, the seats'
+        # sessions expire and the room goes back to the pool
+        room = player.room
+        if room is None:
+            return
+        if room.isOver:
+            self.matches_finished += 1
+        for seat in room.players.values():
+            if seat.away is not None:
+                seat.away.cancel()
+                seat.away = None
+            if seat.session is not None:
+                self.sessions.pop(seat.session.token, None)
+                seat.session = None
+        room.close(player)
+        del self.rooms[room.room_id]
+        self.free_rooms.append(room)
+
+    def resume(self, player, token, seen):
+        # Puts a reconnected player back in its seat and replays what it
+        # missed, or the whole state if that's no longer kept
+        held = self.sessions.get(token) if type(token) is str else None
+        if held is None or held is player or player.room is not None:
+            if player.room is None and self.lobby.mode == FIFO:
+                self.ready(player)  # Expired or unknown: a new player
+            return
+        room = held.room
+        if held.away is not None:
+            held.away.cancel()
+            held.away = None
+        if player.joining is not None:
+            player.joining.cancel()
+            player.joining = None
+        self.lobby.remove(player)
+        player.room, player.symbol = room, held.symbol
+        player.name, player.rating = held.name, held.rating
+        player.session = held.session
+        room.players[held.symbol] = player
+        self.sessions[token] = player
+        held.room = held.session = None
+        if held.transport is not None and not held.transport.is_closing():
+            held.transport.abort()  # Half open; the client has given up on it
+        self.resumed += 1
+        # A seat restored after a restart never sent the client anything
+        missed = (player.session.missed(seen)
+                  if type(seen) is int and held.transport is not None
+                  else None)
+        if missed is None:
+            player.session = Session(token=token)
+            player.send(resume_packet(token, 0))
+            player.send({"type": PacketType.WELCOME.value,
+                         "player": player.symbol, "room": room.room_id})
+            player.send(room.config_packet())
+            player.send(room.snapshot_packet())
+            logger.info("Player %s is back in room %s, resynced.",
+                        player.symbol, room.room_id)
+            return
+        player.write(resume_packet(token, seen))
+        for packet in missed:
+            player.write(packet)
+        logger.info("Player %s is back in room %s, replayed %d packets.",
+                    player.symbol, room.room_id, len(missed))
+
+    def watch(self, spectator, room_id=None):
+        # Without a room id, join the most watched (then newest) match
+        self.unwatch(spectator)
+        if room_id is None:
+            room = max(self.rooms.values(), default=None,
+                       key=lambda r: (len(r.spectators), r.room_id))
+        elif type(room_id) is int:
+            room = self.rooms.get(room_id)
+        else:
+            PACKETS_REJECTED.inc(MALFORMED)  # A list id would not even hash
+            room = None
+        spectator.send({"type": PacketType.WATCH.value,
+                        "room": room.room_id if room else None})
+        if room is None:
+            return
+        spectator.room = room
+        room.spectators.add(spectator)
+        spectator.send(room.config_packet())
+        spectator.send(room.snapshot_packet())
+
+    def unwatch(self, spectator):
+        if spectator.room is not None:
+            spectator.room.spectators.remove(spectator)
+            spectator.room = None
+
+    async def drop_lagging_spectators(self, interval=1.0):
+        while True:
+            await asyncio.sleep(interval)
+            cutoff = time.monotonic() - DROP_AFTER
+            for spectator in list(self.spectators):
+                if spectator.lagging and spectator.lagging_since < cutoff:
+                    logger.warning("Spectator is too far behind, "
+                                   "disconnecting.")
+                    self.spectators_dropped += 1
+                    spectator.transport.abort()
+
+    async def start(self):
+        loop = asyncio.get_running_loop()
+        if self.log is not None:
+            self.restore_matches()
+        if self.sock is not None:
+            self.server = await loop.create_server(
+                lambda: PlayerProtocol(self), sock=self.sock, backlog=4096)
+        else:
+            self.server = await loop.create_server(
+                lambda: PlayerProtocol(self), self.host, self.port,
+                backlog=4096, reuse_port=self.reuse_port or None)
+        logger.info("Multi-match server listening on %s:%s",
+                    self.host, self.port)
+        if self.reaper is not None:
+            loop.create_task(self.reap_idle())
+        if self.spectator_port:
+            self.spectator_server = await loop.create_server(
+                lambda: SpectatorProtocol(self), self.host,
+                self.spectator_port, backlog=4096)
+            loop.create_task(self.drop_lagging_spectators())
+            logger.info("Spectators welcome on %s:%s",
+                        self.host, self.spectator_port)
+
+    async def serve_forever(self, stats_interval=0, report=None,
+                            metrics_file=None):
+        await self.start()
+        if metrics_file:
+            asyncio.get_running_loop().create_task(
+                self.dump_metrics(metrics_file, stats_interval or 5))
+        if stats_interval:
+            asyncio.get_running_loop().create_task(
+                self.report_stats(stats_interval, report))
+        if self.lobby.mode == RATING:
+            asyncio.get_running_loop().create_task(self.expire_waiting())
+        if self.replays:
+            asyncio.get_running_loop().create_task(self.flush_replays())
+        async with self.server:
+            await self.server.serve_forever()
+
+    def stats(self):
+        self.write_stats.set_queued(sum(
+            player.transport.get_write_buffer_size()
+            for player in self.connections))
+        return dict({"connections": len(self.connections),
+                     "rooms": len(self.rooms),
+                     "free_rooms": len(self.free_rooms),
+                     "matches_started": self.matches_started,
+                     "matches_finished": self.matches_finished,
+                     "spectators": len(self.spectators),
+                     "spectator_bytes": self.spectator_bytes,
+                     "spectators_lagged": self.spectators_lagged,
+                     "spectators_dropped": self.spectators_dropped,
+                     "flooders_dropped": self.flooders_dropped,
+                     "resumed": self.resumed,
+                     "idle_reaped": (self.reaper.reaped
+                                     if self.reaper is not None else 0)},
+                    **self.lobby.stats(), **self.write_stats.as_dict())
+
+    async def report_stats(self, interval, report=None):
+        while True:
+            await asyncio.sleep(interval)
+            if report:
+                report(self.stats())
+            else:
+                logger.info("Stats: %s", self.stats())
+
+    async def dump_metrics(self, path, interval):
+        while True:
+            await asyncio.sleep(interval)
+            metrics.dump(path)
+
+    async def flush_replays(self):
+        # Matches also go out when more finish, but not on a quiet server
+        while True:
+            await asyncio.sleep(FLUSH_INTERVAL)
+            try:
+                self.replays.flush()
+            except OSError as e:
+                logger.error("Could not write replays: %s", e)
+
+    async def expire_waiting(self, interval=0.5):
+        while True:
+            await asyncio.sleep(interval)
+            self.match_expired()
+
+
+def run(host="localhost", port=12345, size=3, win_length=3, stats_interval=0,
+        match_mode=FIFO, log_path=None, metrics_port=None, metrics_file=None,
+        spectator_port=None, replays_path=None, rate=RATE, burst=BURST,
+        idle_timeout=IDLE_TIMEOUT, ping_timeout=PING_TIMEOUT,
+        resume_timeout=RESUME_TIMEOUT):
+    game_server = AsyncGameServer(host, port, size, win_length, match_mode,
+                                  log_path=log_path,
+                                  spectator_port=spectator_port,
+                                  replays_path=replays_path, rate=rate,
+                                  burst=burst, idle_timeout=idle_timeout,
+                                  ping_timeout=ping_timeout,
+                                  resume_timeout=resume_timeout)
+    if metrics_port:
+        metrics.serve(metrics_port, host)
+    try:
+        asyncio.run(game_server.serve_forever(stats_interval,
+                                              metrics_file=metrics_file))
+    except KeyboardInterrupt:
+        logger.info("Server stopped.")
+    finally:
+        if game_server.log:
+            game_server.log.close()
+        if game_server.replays:
+            game_server.replays.close()
+        if metrics_file:
+            metrics.dump(metrics_file)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Multi-match game server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=3)
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="Print server stats every N seconds")
+    parser.add_argument("--match", choices=MATCH_MODES, default=FIFO,
+                        help="Pair players in arrival order or by the rating "
+                             "they send in HELLO")
+    parser.add_argument("--log", metavar="FILE",
+                        help="Record moves to an append-only log and "
+                             "recover unfinished matches from it")
+    parser.add_argument("--log-level", default=None,
+                        help="DEBUG, INFO, WARNING or ERROR (default INFO)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Serve Prometheus metrics on this port")
+    parser.add_argument("--metrics-file", default=None,
+                        help="Write Prometheus metrics to this file every "
+                             "stats interval (or 5s) and at exit")
+    parser.add_argument("--spectator-port", type=int, default=None,
+                        help="Let read-only spectators WATCH matches on "
+                             "this port")
+    parser.add_argument("--replays", metavar="DIR", default=None,
+                        help="Store finished matches here for replays.py")
+    parser.add_argument("--rate", type=float, default=RATE,
+                        help="Packets per second a connection may send "
+                             "(0 for no limit)")
+    parser.add_argument("--burst", type=int, default=BURST,
+                        help="Packets a connection may send at once")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="PING a connection silent for this many seconds "
+                             "(0 never does)")
+    parser.add_argument("--ping-timeout", type=float, default=PING_TIMEOUT,
+                        help="Drop a pinged connection that doesn't answer "
+                             "within this many seconds")
+    parser.add_argument("--resume-timeout", type=float,
+                        default=RESUME_TIMEOUT,
+                        help="Hold a disconnected player's seat this many "
+                             "seconds for a RESUME (0 ends the match at once)")
+    args = parser.parse_args()
+    log.setup(args.log_level)
+    run(args.host, args.port, args.size, args.win_length, args.stats_interval,
+        args.match, args.log, args.metrics_port, args.metrics_file,
+        args.spectator_port, args.replays, args.rate, args.burst,
+        args.idle_timeout, args.ping_timeout, args.resume_timeout)
+
+
+if __name__ == "__main__":
+    main()
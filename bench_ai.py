@@ -0,0 +1,55 @@
+# Moves/sec for each ComputerPlayer difficulty on random mid-game positions.
+# Usage: python bench_ai.py [--positions N]
+import argparse
+import os
+import random
+import tempfile
+import time
+from bitboard import BitBoard, WINNING, FULL_MASK
+from solver import Solver, random_move, heuristic_move, legal_moves
+
+
+def random_positions(count):
+    positions = []
+    while len(positions) < count:
+        me = opp = 0
+        for _ in range(random.randint(0, 7)):
+            me, opp = opp, me | 1 << random.choice(legal_moves(me, opp))
+            if WINNING[opp]:
+                break
+        if not WINNING[opp] and me | opp != FULL_MASK:
+            positions.append((me, opp))
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--positions", type=int, default=100000)
+    args = parser.parse_args()
+
+    path = os.path.join(tempfile.mkdtemp(), "solver_table.bin")
+    start = time.perf_counter()
+    solver = Solver()
+    solver.build()
+    print(f"Table build: {(time.perf_counter() - start) * 1e3:.1f}ms "
+          f"({len(solver.table)} canonical positions)")
+    solver.save(path)
+    start = time.perf_counter()
+    solver = Solver.load_or_build(path)
+    print(f"Table load:  {(time.perf_counter() - start) * 1e3:.1f}ms")
+
+    # Strategies see the position from X's side
+    positions = [BitBoard(3, 3, me, opp)
+                 for me, opp in random_positions(args.positions)]
+    levels = [("random", random_move), ("heuristic", heuristic_move),
+              ("perfect", solver.choose)]
+    for name, strategy in levels:
+        start = time.perf_counter()
+        for board in positions:
+            strategy(board, "X")
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {len(positions) / elapsed:12,.0f} moves/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,100 @@
+# Microbenchmark: list board vs BitBoard for win checks and move application,
+# plus incremental vs full-board win detection on a large N x N board.
+# Usage: python bench_board.py [--games N] [--size N] [--win-length K]
+import argparse
+import random
+import time
+from bitboard import BitBoard
+
+
+def list_check_win(board, player):
+    # The check_win every game instance used before BitBoard
+    win_positions = [
+        [0, 1, 2], [3, 4, 5], [6, 7, 8],  # Rows
+        [0, 3, 6], [1, 4, 7], [2, 5, 8],  # Columns
+        [0, 4, 8], [2, 4, 6]              # Diagonals
+    ]
+    for positions in win_positions:
+        if all(board[pos] == player for pos in positions) and player != " ":
+            return True
+    return False
+
+
+def play_list(games):
+    for moves in games:
+        board = [" "] * 9
+        player = "X"
+        for move in moves:
+            if board[move] == " ":
+                board[move] = player
+                if list_check_win(board, player) or " " not in board:
+                    break
+                player = "O" if player == "X" else "X"
+
+
+def play_bitboard(games):
+    for moves in games:
+        board = BitBoard()
+        player = "X"
+        for move in moves:
+            if board.is_free(move):
+                board.play(move, player)
+                if board.has_won(player) or board.is_full():
+                    break
+                player = "O" if player == "X" else "X"
+
+
+def time_it(function, *args):
+    start = time.perf_counter()
+    function(*args)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--size", type=int, default=15)
+    parser.add_argument("--win-length", type=int, default=5)
+    args = parser.parse_args()
+
+    games = [random.sample(range(9), 9) for _ in range(args.games)]
+    boards = [[random.choice(" XO") for _ in range(9)]
+              for _ in range(args.games)]
+    bitboards = [BitBoard.from_list(cells) for cells in boards]
+
+    checks = len(boards) * 2
+    list_time = time_it(lambda: [list_check_win(b, p)
+                                 for b in boards for p in "XO"])
+    bit_time = time_it(lambda: [b.has_won(p)
+                                for b in bitboards for p in "XO"])
+    print(f"check_win   list {checks / list_time:12,.0f}/s   "
+          f"bitboard {checks / bit_time:12,.0f}/s   "
+          f"x{list_time / bit_time:.1f}")
+
+    list_time = time_it(play_list, games)
+    bit_time = time_it(play_bitboard, games)
+    print(f"full games  list {len(games) / list_time:12,.0f}/s   "
+          f"bitboard {len(games) / bit_time:12,.0f}/s   "
+          f"x{list_time / bit_time:.1f}")
+
+    # Half-filled large board: scan every stone vs only the last move's lines
+    cells = args.size * args.size
+    board = BitBoard(args.size, args.win_length)
+    stones = random.sample(range(cells), cells // 2)
+    for i, move in enumerate(stones):
+        board.play(move, "XO"[i % 2])
+    last_moves = [m for i, m in enumerate(stones) if i % 2 == 0][:1000]
+    rounds = max(1, args.games // 1000)
+    full_time = time_it(lambda: [board.has_won("X")
+                                 for _ in range(rounds) for m in last_moves])
+    last_time = time_it(lambda: [board.has_won("X", m)
+                                 for _ in range(rounds) for m in last_moves])
+    checks = rounds * len(last_moves)
+    print(f"{args.size}x{args.size} k={args.win_length}  "
+          f"full scan {checks / full_time:12,.0f}/s   "
+          f"last move {checks / last_time:12,.0f}/s   "
+          f"x{full_time / last_time:.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,70 @@
+# Builds an opening book, then compares cold start and move time for the
+# perfect player with and without it on random positions the book covers.
+# Usage: python bench_book.py [--size 4] [--win-length 4] [--plies 2]
+import argparse
+import os
+import random
+import tempfile
+import time
+from bitboard import BitBoard
+from book import Book, build, write_book
+from solver import heuristic_move
+
+
+def random_positions(size, win_length, count, max_stones):
+    positions = []
+    while len(positions) < count:
+        board = BitBoard(size, win_length)
+        player = "X"
+        for _ in range(random.randint(0, max_stones)):
+            move = random.choice(board.legal_moves())
+            board.play(move, player)
+            if board.has_won(player, move) or board.is_full():
+                break
+            player = "O" if player == "X" else "X"
+        else:
+            positions.append((board, player))
+    return positions
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument("--plies", type=int, default=2)
+    parser.add_argument("--endgame", type=int, default=6)
+    parser.add_argument("--positions", type=int, default=20000)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    args = parser.parse_args()
+    size, win_length = args.size, args.win_length or args.size
+
+    path = os.path.join(tempfile.mkdtemp(), "book.bin")
+    start = time.perf_counter()
+    records, solved, total = build(size, win_length, args.plies, args.endgame,
+                                   args.workers)
+    write_book(path, size, win_length, records)
+    print(f"Build: {time.perf_counter() - start:.1f}s on {args.workers} "
+          f"workers, {solved}/{total} openings solved, {len(records):,} "
+          f"positions, {os.path.getsize(path):,} bytes")
+
+    start = time.perf_counter()
+    book = Book.open(size, win_length, path)
+    print(f"Open:  {(time.perf_counter() - start) * 1e3:.2f}ms")
+
+    positions = random_positions(size, win_length, args.positions,
+                                 size * size - 1)
+    covered = [(board, player) for board, player in positions
+               if book.choose(board, player) != -1]
+    print(f"Coverage: {len(covered) / len(positions):.1%} of random positions")
+    for name, strategy in (("book", book.choose), ("heuristic", heuristic_move)):
+        start = time.perf_counter()
+        for board, player in covered:
+            strategy(board, player)
+        elapsed = time.perf_counter() - start
+        print(f"{name:>10}: {len(covered) / elapsed:12,.0f} moves/sec")
+    book.close()
+    os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,50 @@
+# Bytes per packet and encode/decode throughput for the JSON and binary codecs.
+# Usage: python bench_codec.py [--rounds N]
+import argparse
+import time
+from packets import PacketType
+from codec import BINARY, JSON, FrameDecoder, encode_packet
+
+
+def sample_packets():
+    board = [" ", "X", "O", "X", " ", "O", " ", " ", "X"]
+    large = ["X" if i % 3 == 0 else "O" if i % 3 == 1 else " "
+             for i in range(15 * 15)]
+    return [
+        ("MOVE", {"type": PacketType.MOVE.value, "player": "X", "move": 4}),
+        ("PLAYER_TURN", {"type": PacketType.PLAYER_TURN.value, "player": "O"}),
+        ("GAME_STATE 3x3", {"type": PacketType.GAME_STATE.value, "board": board}),
+        ("GAME_STATE 15x15", {"type": PacketType.GAME_STATE.value, "board": large}),
+        ("GAME_WIN", {"type": PacketType.GAME_WIN.value,
+                      "result": "Player X wins!"}),
+    ]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--rounds", type=int, default=20000)
+    args = parser.parse_args()
+
+    print(f"{'packet':>18} {'codec':>9} {'bytes':>6} "
+          f"{'encode/s':>12} {'decode/s':>12}")
+    for name, packet in sample_packets():
+        for codec in (JSON, BINARY):
+            start = time.perf_counter()
+            for _ in range(args.rounds):
+                data = encode_packet(packet, codec)
+            encode_rate = args.rounds / (time.perf_counter() - start)
+
+            decoder = FrameDecoder()
+            stream = data * args.rounds
+            start = time.perf_counter()
+            # Feed in socket-sized chunks, as EventHandler does
+            for offset in range(0, len(stream), 4096):
+                decoder.feed(stream[offset:offset + 4096])
+            decode_rate = args.rounds / (time.perf_counter() - start)
+
+            print(f"{name:>18} {codec:>9} {len(data):>6} "
+                  f"{encode_rate:12,.0f} {decode_rate:12,.0f}")
+
+
+if __name__ == "__main__":
+    main()
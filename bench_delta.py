@@ -0,0 +1,68 @@
+# Bytes and send calls per move for full GAME_STATE updates vs DELTA updates.
+# Usage: python bench_delta.py [--games N] [--size N] [--win-length K]
+import argparse
+import contextlib
+import io
+import random
+import time
+from server import Server
+from packets import PacketType
+from codec import BINARY, JSON
+
+
+class CountingConnection:
+    # Stands in for the peer socket and records what the server sends
+    def __init__(self):
+        self.sends = 0
+        self.bytes = 0
+
+    def sendall(self, data):
+        self.sends += 1
+        self.bytes += len(data)
+
+
+def play(games, size, win_length, codec, delta):
+    server = Server(size=size, win_length=win_length)
+    server.connection = CountingConnection()
+    server.codec = codec
+    server.delta = delta
+    moves = 0
+    start = time.perf_counter()
+    with contextlib.redirect_stdout(io.StringIO()):
+        for _ in range(games):
+            server.board = server.new_board()
+            server.isOver = False
+            server.current_player = "X"
+            cells = random.sample(range(size * size), size * size)
+            for cell in cells:
+                if server.isOver:
+                    break
+                server.process_packet({"type": PacketType.MOVE.value,
+                                       "player": server.current_player,
+                                       "move": cell})
+                moves += 1
+    elapsed = time.perf_counter() - start
+    connection = server.connection
+    return connection.bytes / moves, connection.sends / moves, moves / elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=2000)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=None)
+    args = parser.parse_args()
+    win_length = args.win_length or args.size
+
+    print(f"{args.size}x{args.size}, {win_length} in a row, {args.games} games")
+    for codec in (JSON, BINARY):
+        for delta in (False, True):
+            per_move, sends, rate = play(args.games, args.size, win_length,
+                                         codec, delta)
+            mode = "delta" if delta else "full"
+            print(f"{codec:>9} {mode:>6}: {per_move:8.1f} bytes/move  "
+                  f"{sends:4.2f} sends/move  {rate:10,.0f} moves/sec")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,62 @@
+# Cost of pushing one move to N spectators: encoding the update once per
+# group (Fanout) against encoding it again for every spectator.
+# Usage: python bench_fanout.py [--spectators 1000,10000] [--moves N]
+import argparse
+import time
+from codec import BINARY, JSON, encode_packet
+from fanout import Fanout
+from server import Server
+
+
+class NullSpectator:
+    # Stands in for SpectatorProtocol; counts what it would have written
+    def __init__(self, codec, delta):
+        self.codec = codec
+        self.delta = delta
+        self.lagging = False
+        self.written = 0
+
+    def write(self, data):
+        self.written += len(data)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--spectators", default="100,1000,10000")
+    parser.add_argument("--moves", type=int, default=20)
+    args = parser.parse_args()
+
+    server = Server(size=3, win_length=3)
+    server.current_player = "O"
+    server.board.play(4, "X")
+
+    def build(delta):
+        return server.move_packets(4, "X", None, delta)
+
+    for count in (int(n) for n in args.spectators.split(",")):
+        # A realistic mix of wire formats
+        spectators = [NullSpectator((JSON, BINARY)[i % 2], i % 3 == 0)
+                      for i in range(count)]
+        fanout = Fanout()
+        for spectator in spectators:
+            fanout.add(spectator)
+
+        start = time.perf_counter()
+        for _ in range(args.moves):
+            fanout.publish(build)
+        shared = (time.perf_counter() - start) / args.moves
+
+        start = time.perf_counter()
+        for _ in range(args.moves):
+            for spectator in spectators:
+                for packet in build(spectator.delta):
+                    spectator.write(encode_packet(packet, spectator.codec))
+        each = (time.perf_counter() - start) / args.moves
+
+        print(f"{count:6} spectators: encode once {shared * 1e3:8.2f}ms/move, "
+              f"per spectator {each * 1e3:8.2f}ms/move "
+              f"({each / shared:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
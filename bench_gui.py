@@ -0,0 +1,91 @@
+# Move-to-screen latency and idle CPU of the event-driven GUI.
+# Drives a ComputerPlayer game from a background thread and times each event
+# from the moment it is posted until Tk has applied and drawn it.
+# Needs a display; on a headless box run it under xvfb-run.
+# Usage: python bench_gui.py [--games N] [--idle SECONDS]
+import argparse
+import contextlib
+import io
+import os
+import sys
+import time
+from threading import Thread
+from gui import TicTacToeGUI
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+class TimedGUI(TicTacToeGUI):
+    def __init__(self, root):
+        super().__init__(root)
+        self.latencies = []
+
+    def update_gui(self, update):
+        update["posted"] = time.perf_counter()
+        super().update_gui(update)
+
+    def apply_event(self, update):
+        super().apply_event(update)
+        if "posted" in update:
+            self.root.update_idletasks()  # Count the redraw, not just the config
+            self.latencies.append(time.perf_counter() - update["posted"])
+
+    def show_endgame_modal(self, message):
+        pass  # A modal would wait for a click
+
+
+def play(app, games):
+    game = app.game_instance
+    for _ in range(games):
+        while not game.isOver:
+            if game.current_player == game.id:
+                moves = game.board.legal_moves()
+                if moves:
+                    game.play_turn(moves[0])
+            time.sleep(0.001)
+        game.reset_game()
+        game.isOver = False
+    app.root.after(0, app.root.quit)
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--games", type=int, default=50)
+    parser.add_argument("--idle", type=float, default=2.0)
+    parser.add_argument("--difficulty", default="heuristic")
+    args = parser.parse_args()
+
+    import tkinter as tk
+    try:
+        root = tk.Tk()
+    except tk.TclError:
+        print("bench_gui.py needs a display, e.g. xvfb-run python bench_gui.py")
+        sys.exit(1)
+
+    app = TimedGUI(root)
+    with contextlib.redirect_stdout(io.StringIO()):
+        app.initialize_game_window("computer", difficulty=args.difficulty)
+        Thread(target=play, args=(app, args.games), daemon=True).start()
+        root.mainloop()
+
+    latencies = app.latencies
+    print(f"{len(latencies)} events over {args.games} games")
+    print(f"move-to-screen p50 {percentile(latencies, 0.5) * 1000:.2f} ms  "
+          f"p99 {percentile(latencies, 0.99) * 1000:.2f} ms  "
+          f"max {max(latencies) * 1000:.2f} ms")
+
+    # With nothing happening the Tk loop should sleep rather than poll
+    cpu = os.times()
+    root.after(int(args.idle * 1000), root.quit)
+    root.mainloop()
+    busy = (os.times().user - cpu.user) + (os.times().system - cpu.system)
+    print(f"idle CPU {busy / args.idle:.2%} over {args.idle:.1f}s")
+    app.running = False
+    root.destroy()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,71 @@
+# Cost of idle detection with the timer wheel: watching a connection, what
+# a packet pays (a timestamp), and advancing the wheel while every
+# connection is rescheduled, pinged and finally reaped.
+# Usage: python bench_heartbeat.py [--connections 100000]
+import argparse
+import logging
+import time
+from heartbeat import IdleReaper
+
+
+class Connection:
+    __slots__ = ("last_seen", "pings", "reaped")
+
+    def __init__(self, now):
+        self.last_seen = now
+        self.pings = 0
+        self.reaped = False
+
+    def ping(self):
+        self.pings += 1
+
+    def reap(self):
+        self.reaped = True
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--connections", type=int, default=100000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    count = args.connections
+
+    # Simulated clock: 30s idle timeout, 15s to answer, 0.5s ticks
+    reaper = IdleReaper(30.0, 15.0, now=0.0)
+    connections = [Connection(0.0) for _ in range(count)]
+
+    start = time.perf_counter()
+    for connection in connections:
+        reaper.watch(connection)
+    watch = (time.perf_counter() - start) / count * 1e9
+
+    # Half the connections send a packet at 20s, so their first deadline
+    # only reschedules them
+    start = time.perf_counter()
+    for connection in connections[::2]:
+        connection.last_seen = 20.0
+    packet = (time.perf_counter() - start) / (count // 2) * 1e9
+
+    timings = []
+    now = 0.0
+    while now < 120.0:
+        now += reaper.wheel.tick
+        start = time.perf_counter()
+        reaper.advance(now)
+        timings.append(time.perf_counter() - start)
+    busy = sorted(timings)
+
+    pinged = sum(1 for c in connections if c.pings)
+    reaped = sum(1 for c in connections if c.reaped)
+    print(f"Connections                {count:10d}")
+    print(f"Watch                      {watch:10.0f}ns per connection")
+    print(f"Packet (last_seen)         {packet:10.0f}ns per packet")
+    print(f"Advance, idle tick         {busy[0] * 1e6:10.1f}us")
+    print(f"Advance, busiest tick      {busy[-1] * 1e3:10.1f}ms")
+    print(f"Advance, total over 120s   {sum(timings) * 1e3:10.1f}ms "
+          f"({sum(timings) / count * 1e9:.0f}ns per connection)")
+    print(f"Pinged {pinged}, reaped {reaped}, still watched {len(reaper)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,77 @@
+# Matchmaking cost per arrival as the waiting pool grows.
+# Usage: python bench_lobby.py [--ops N] [--sizes 100,1000,10000,50000]
+import argparse
+import random
+import time
+from lobby import FIFO, RATING, RATING_WINDOW, Lobby
+
+
+class LinearLobby:
+    # A plain list scanned for the closest rating, as a baseline
+    def __init__(self):
+        self.waiting = []  # (player, rating)
+
+    def __len__(self):
+        return len(self.waiting)
+
+    def enqueue(self, player, rating):
+        best = None
+        for i, (other, other_rating) in enumerate(self.waiting):
+            gap = abs(other_rating - rating)
+            if gap <= RATING_WINDOW and (best is None or gap < best[0]):
+                best = (gap, i)
+        if best is not None:
+            opponent, _ = self.waiting.pop(best[1])
+            return opponent, player
+        self.waiting.append((player, rating))
+        return None
+
+    def remove(self, player):
+        for i, (other, _) in enumerate(self.waiting):
+            if other is player:
+                del self.waiting[i]
+                return
+
+
+def ratings(count):
+    # Spread far enough apart that most arrivals have to wait
+    return [random.randrange(0, count * RATING_WINDOW) for _ in range(count)]
+
+
+def measure(lobby, size, ops, mode):
+    rated = mode == RATING
+    players = list(range(size))
+    for player, rating in zip(players, ratings(size)):
+        lobby.enqueue(player, rating if rated else None)
+    next_player = size
+    arrivals = ratings(ops)
+    start = time.perf_counter()
+    for rating in arrivals:
+        # Someone leaves and someone new arrives, so the pool stays put
+        lobby.remove(players[random.randrange(len(players))])
+        lobby.enqueue(next_player, rating if rated else None)
+        players.append(next_player)
+        next_player += 1
+    return (time.perf_counter() - start) / ops
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--ops", type=int, default=20000)
+    parser.add_argument("--sizes", default="100,1000,10000,50000")
+    args = parser.parse_args()
+
+    for size in map(int, args.sizes.split(",")):
+        cases = [("fifo", Lobby(FIFO), FIFO),
+                 ("rating", Lobby(RATING), RATING),
+                 ("linear scan", LinearLobby(), RATING)]
+        line = [f"{size:>7} waiting:"]
+        for name, lobby, mode in cases:
+            ops = args.ops if name != "linear scan" else max(100, args.ops // 20)
+            per_op = measure(lobby, size, ops, mode)
+            line.append(f"{name} {per_op * 1e6:8.2f} us/op")
+        print("  ".join(line))
+
+
+if __name__ == "__main__":
+    main()
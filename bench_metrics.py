@@ -0,0 +1,50 @@
+# Per-call cost of the logging and metrics added to the packet path: a
+# filtered-out logger.debug against the print it replaced, and one counter
+# increment or histogram observation.
+# Usage: python bench_metrics.py [--calls N]
+import argparse
+import io
+import logging
+import time
+from contextlib import redirect_stdout
+import log
+from metrics import Counter, Histogram
+
+logger = logging.getLogger("bench")
+
+
+def per_call(function, calls):
+    start = time.perf_counter()
+    for i in range(calls):
+        function(i)
+    return (time.perf_counter() - start) / calls * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--calls", type=int, default=1000000)
+    args = parser.parse_args()
+    log.setup("INFO")
+    packet = {"type": "move", "cell": 4}
+    counter = Counter("bench_total", "Benchmark counter", "type")
+    histogram = Histogram("bench_seconds", "Benchmark histogram", "type")
+
+    with redirect_stdout(io.StringIO()):
+        printed = per_call(lambda i: print(f"Received packet: {packet}"),
+                           args.calls)
+    results = [
+        ("print (to a buffer)", printed),
+        ("logger.debug, filtered",
+         per_call(lambda i: logger.debug("Received packet: %s", packet),
+                  args.calls)),
+        ("Counter.inc", per_call(lambda i: counter.inc("move"), args.calls)),
+        ("Histogram.observe",
+         per_call(lambda i: histogram.observe(0.0002, "move"), args.calls)),
+        ("empty call", per_call(lambda i: None, args.calls)),
+    ]
+    for name, ns in results:
+        print(f"{name:24} {ns:8.1f} ns/call")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,69 @@
+# Match throughput of prefork.py as the worker count grows.
+# Runs the supervisor and several load_generator processes on this machine,
+# so give it a box with cores to spare for the clients too.
+# Usage: python bench_prefork.py [--workers 1,2,4,8] [--matches N]
+import argparse
+import os
+import re
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+
+def measure(workers, port, matches, clients, concurrency):
+    server = subprocess.Popen(
+        [sys.executable, os.path.join(HERE, "prefork.py"), "--workers",
+         str(workers), "--port", str(port)],
+        stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    time.sleep(1.0 + 0.2 * workers)  # Let every worker bind
+    try:
+        start = time.perf_counter()
+        generators = [subprocess.Popen(
+            [sys.executable, os.path.join(HERE, "load_generator.py"),
+             "--port", str(port), "--matches", str(matches // clients),
+             "--concurrency", str(concurrency)],
+            stdout=subprocess.PIPE, text=True) for _ in range(clients)]
+        completed = 0
+        for generator in generators:
+            output, _ = generator.communicate()
+            found = re.search(r"Matches completed: (\d+)", output)
+            completed += int(found.group(1)) if found else 0
+        elapsed = time.perf_counter() - start
+    finally:
+        server.terminate()
+        server.wait()
+    return completed, elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--workers", default=None,
+                        help="Comma separated worker counts")
+    parser.add_argument("--matches", type=int, default=4000)
+    parser.add_argument("--clients", type=int, default=None,
+                        help="Load generator processes (default: cores / 2)")
+    parser.add_argument("--concurrency", type=int, default=200)
+    parser.add_argument("--port", type=int, default=12400)
+    args = parser.parse_args()
+
+    cores = os.cpu_count()
+    counts = ([int(n) for n in args.workers.split(",")] if args.workers else
+              [n for n in (1, 2, 4, 8, 16, 32) if n <= max(1, cores // 2)])
+    clients = args.clients or max(1, cores // 2)
+    print(f"{cores} cores, {clients} load generator processes")
+
+    baseline = None
+    for i, workers in enumerate(counts):
+        completed, elapsed = measure(workers, args.port + i, args.matches,
+                                     clients, args.concurrency)
+        rate = completed / elapsed
+        baseline = baseline or rate / workers
+        print(f"{workers:3} workers: {completed} matches in {elapsed:6.2f}s "
+              f"{rate:9,.1f} matches/sec  "
+              f"scaling {rate / (baseline * workers):.0%} of linear")
+
+
+if __name__ == "__main__":
+    main()
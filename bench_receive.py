@@ -0,0 +1,88 @@
+# Floods a socketpair and measures the EventHandler receive path.
+# Usage: python bench_receive.py [--packets N]
+import argparse
+import json
+import logging
+import socket
+import time
+import tracemalloc
+from threading import Thread
+from EventHandler import EventHandler
+from packets import PacketType
+from codec import BINARY, JSON, encode_packet
+
+
+class Sink:
+    # Minimal game instance that only counts what it is handed
+    limit_peer = False  # Measure the receive path, not the rate limit
+    idle_timeout = None  # ...nor the idle reaper
+
+    def __init__(self, expected):
+        self.expected = expected
+        self.count = 0
+
+    def put_packets(self, packets):
+        self.count += len(packets)
+
+    def connection_lost(self):
+        pass  # The flood ends with EOF on purpose
+
+
+class LegacyEventHandler(EventHandler):
+    # The str-concatenating receive loop EventHandler used to have
+    def receive_packets(self):
+        buffer = ""
+        while self.running:
+            data = self.connection.recv(1024).decode()
+            if not data:
+                break
+            buffer += data
+            while "\n" in buffer:
+                packet_data, buffer = buffer.split("\n", 1)
+                json.loads(packet_data)
+                self.game_instance.count += 1
+
+
+def flood(handler_class, codec, count, trace):
+    reader, writer = socket.socketpair()
+    sink = Sink(count)
+    handler = handler_class(reader, sink)
+    packet = {"type": PacketType.MOVE.value, "player": "X", "move": 4}
+    stream = encode_packet(packet, codec) * count
+
+    if trace:
+        tracemalloc.start()
+    thread = Thread(target=handler.receive_packets)
+    start = time.perf_counter()
+    thread.start()
+    writer.sendall(stream)
+    writer.close()  # EOF ends the receive loop
+    thread.join()
+    elapsed = time.perf_counter() - start
+    peak = 0
+    if trace:
+        peak = tracemalloc.get_traced_memory()[1]
+        tracemalloc.stop()
+    reader.close()
+    assert sink.count == count, (sink.count, count)
+    return count / elapsed, peak
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=100000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)  # Every flood ends in "Connection lost"
+
+    cases = [("legacy str split", LegacyEventHandler, JSON),
+             ("recv_into json", EventHandler, JSON),
+             ("recv_into binary", EventHandler, BINARY)]
+    for name, handler_class, codec in cases:
+        rate, _ = flood(handler_class, codec, args.packets, False)
+        _, peak = flood(handler_class, codec, args.packets, True)
+        print(f"{name:>18}: {rate:12,.0f} packets/sec   "
+              f"peak {peak / 1024:8.1f} KiB allocated")
+
+
+if __name__ == "__main__":
+    main()
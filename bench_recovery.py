@@ -0,0 +1,94 @@
+# Writes a move log with a million moves spread over many concurrent matches,
+# then times how long recovery takes to rebuild the unfinished ones.
+# Usage: python bench_recovery.py [--moves N] [--matches N] [--out FILE]
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from bitboard import BitBoard
+from movelog import END, MOVE, TURN, MoveLog, recover
+
+
+def write_log(path, moves, matches, size, win_length):
+    # Round-robin over `matches` live rooms; a finished room is replaced
+    # by a new one so the in-flight count stays put
+    if os.path.exists(path):
+        os.remove(path)
+    log = MoveLog(path, size, win_length)
+    rooms = {}
+    next_room = 0
+    for _ in range(matches):
+        rooms[next_room] = (BitBoard(size, win_length), "X")
+        log.append(TURN, next_room, player="X")
+        next_room += 1
+    written = 0
+    start = time.perf_counter()
+    while written < moves:
+        for room in list(rooms):
+            board, player = rooms[room]
+            cell = random.choice(board.legal_moves())
+            board.play(cell, player)
+            log.append(MOVE, room, cell, player)
+            written += 1
+            if board.has_won(player, cell) or board.is_full():
+                log.append(END, room)
+                del rooms[room]
+                rooms[next_room] = (BitBoard(size, win_length), "X")
+                log.append(TURN, next_room, player="X")
+                next_room += 1
+            else:
+                rooms[room] = (board, "O" if player == "X" else "X")
+            if written == moves:
+                break
+    log.close()
+    return time.perf_counter() - start, rooms
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--moves", type=int, default=1000000)
+    parser.add_argument("--matches", type=int, default=10000,
+                        help="Matches in flight at any time")
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument("--out", default=None,
+                        help="Log file to write (and delete afterwards); "
+                             "a temporary directory by default")
+    args = parser.parse_args()
+    win_length = args.win_length or args.size
+
+    directory = None
+    path = args.out
+    if path is None:
+        directory = tempfile.mkdtemp(prefix="movelog-")
+        path = os.path.join(directory, "moves.log")
+    try:
+        elapsed, live = write_log(path, args.moves, args.matches, args.size,
+                                  win_length)
+        print(f"Logged {args.moves:,} moves in {elapsed:.2f}s "
+              f"({args.moves / elapsed:,.0f} moves/sec), "
+              f"{os.path.getsize(path):,} bytes")
+
+        start = time.perf_counter()
+        _, _, matches = recover(path)
+        elapsed = time.perf_counter() - start
+        print(f"Recovered {len(matches):,} unfinished matches in "
+              f"{elapsed * 1000:.1f} ms")
+
+        # Check the rebuilt boards against what was actually played
+        for room, (board, player) in live.items():
+            state = matches[room]
+            assert (state.x, state.o) == (board.x, board.o), room
+            assert state.current_player == player, room
+        assert len(matches) == len(live)
+    finally:
+        if directory is not None:
+            shutil.rmtree(directory)
+        elif os.path.exists(path):
+            os.remove(path)
+
+
+if __name__ == "__main__":
+    main()
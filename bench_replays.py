@@ -0,0 +1,96 @@
+# Write rate, index build time and query latency of a replay store filled
+# with random finished 3x3 matches, with and without the indexes.
+# Usage: python bench_replays.py [--matches 1000000] [--players 10000]
+import argparse
+import os
+import random
+import shutil
+import tempfile
+import time
+from bitboard import BitBoard
+from replays import (DRAW, O_WON, X_WON, Replays, ReplayWriter,
+                     build_indexes, index_path, INDEXES)
+
+
+def random_match():
+    board = BitBoard(3, 3)
+    player = random.choice("XO")
+    first = player
+    cells, players = [], []
+    for cell in random.sample(range(9), 9):
+        board.play(cell, player)
+        cells.append(cell)
+        players.append(player)
+        if board.has_won(player, cell):
+            return first, X_WON if player == "X" else O_WON, cells, players
+        player = "O" if player == "X" else "X"
+    return first, DRAW, cells, players
+
+
+def timed(label, function):
+    start = time.perf_counter()
+    result = function()
+    print(f"  {label:<40} {(time.perf_counter() - start) * 1e3:9.1f}ms  "
+          f"{len(result):>10,} matches")
+
+
+def queries(replays, players):
+    timed("--player", lambda: replays.select(player=players[0]))
+    timed("--result draw", lambda: replays.select(result="draw"))
+    timed("--opening 4,0", lambda: replays.select(opening=[4, 0]))
+    timed("--opening 4,0,8,2 (past the index)",
+          lambda: replays.select(opening=[4, 0, 8, 2]))
+    timed("--player --result x",
+          lambda: replays.select(player=players[1], result="x"))
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--matches", type=int, default=1000000)
+    parser.add_argument("--players", type=int, default=10000)
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    players = [f"player{i}" for i in range(args.players)]
+    pool = [random_match() for _ in range(10000)]
+    path = tempfile.mkdtemp(prefix="replays-")
+    try:
+        writer = ReplayWriter(path)
+        start = time.perf_counter()
+        now = time.time()
+        for _ in range(args.matches):
+            first, result, cells, movers = random.choice(pool)
+            x, o = random.sample(players, 2)
+            writer.append(x, o, first, result, cells, movers,
+                          [now + ply * 0.5 for ply in range(len(cells))], now)
+        writer.close()
+        elapsed = time.perf_counter() - start
+        size = sum(os.path.getsize(os.path.join(path, name))
+                   for name in os.listdir(path))
+        print(f"Wrote {args.matches:,} matches in {elapsed:.1f}s "
+              f"({args.matches / elapsed:,.0f}/sec, {size / 2**20:.0f} MiB, "
+              f"{size / args.matches:.0f} bytes/match)")
+
+        replays = Replays(path)
+        print("Without indexes:")
+        queries(replays, players)
+        replays.close()
+
+        start = time.perf_counter()
+        build_indexes(path)
+        size = sum(os.path.getsize(index_path(path, name))
+                   for name in INDEXES)
+        print(f"Built indexes in {time.perf_counter() - start:.1f}s "
+              f"({size / 2**20:.0f} MiB)")
+
+        replays = Replays(path)
+        print("With indexes:")
+        queries(replays, players)
+        replays.close()
+    finally:
+        shutil.rmtree(path)
+
+
+if __name__ == "__main__":
+    main()
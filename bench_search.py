@@ -0,0 +1,92 @@
+# Depth reached and nodes/sec of the time-budgeted search, per board and
+# per-move budget, over random mid-game positions. --workers N runs the
+# same positions on a SearchPool to compare the depth it reaches.
+# Usage: python bench_search.py [--boards 7x4,9x5,15x5] [--budgets 0.1,0.5,1]
+import argparse
+import random
+import threading
+import time
+from bitboard import BitBoard
+from parallel_search import SearchPool
+from search import TimedSearch
+
+
+def random_positions(size, win_length, count):
+    positions = []
+    while len(positions) < count:
+        board = BitBoard(size, win_length)
+        player = "X"
+        # Keep the stones together, as real games do
+        move = (size // 2) * size + size // 2
+        for _ in range(random.randint(2, size * size // 3)):
+            board.play(move, player)
+            if board.has_won(player, move) or board.is_full():
+                break
+            player = "O" if player == "X" else "X"
+            row, col = divmod(move, size)
+            near = [r * size + c
+                    for r in range(max(0, row - 2), min(size, row + 3))
+                    for c in range(max(0, col - 2), min(size, col + 3))
+                    if board.is_free(r * size + c)]
+            move = random.choice(near or board.legal_moves())
+        else:
+            positions.append((board, player))
+    return positions
+
+
+def pool_search(pool, board, player, budget):
+    done = threading.Event()
+    opponent = "O" if player == "X" else "X"
+    pool.start(board.mask(player), board.mask(opponent), budget,
+               lambda move: done.set())
+    done.wait()
+    return pool.stats["depth"], pool.stats["nodes"]
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--boards", default="7x4,9x5,15x5",
+                        help="Comma separated SIZExWIN_LENGTH")
+    parser.add_argument("--budgets", default="0.1,0.5,1",
+                        help="Comma separated seconds per move")
+    parser.add_argument("--positions", type=int, default=10)
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Search on a pool of N processes instead")
+    args = parser.parse_args()
+    random.seed(args.seed)
+
+    for spec in args.boards.split(","):
+        size, win_length = (int(n) for n in spec.split("x"))
+        positions = random_positions(size, win_length, args.positions)
+        pool = (SearchPool(size, win_length, args.workers) if args.workers
+                else None)
+        for budget in (float(b) for b in args.budgets.split(",")):
+            search = TimedSearch(size, win_length)
+            depths, nodes, seconds = [], 0, 0.0
+            start = time.perf_counter()
+            for board, player in positions:
+                if pool:
+                    moved = time.perf_counter()
+                    depth, searched = pool_search(pool, board, player,
+                                                  budget)
+                    depths.append(depth)
+                    nodes += searched
+                    seconds += time.perf_counter() - moved
+                    continue
+                search.choose(board, player, budget)
+                depths.append(search.stats["depth"])
+                nodes += search.stats["nodes"]
+                seconds += search.stats["seconds"]
+            wall = (time.perf_counter() - start) / len(positions)
+            print(f"{size:2}x{size:<2} k={win_length} budget {budget:4.2f}s: "
+                  f"depth avg {sum(depths) / len(depths):4.1f} "
+                  f"(min {min(depths)}, max {max(depths)}), "
+                  f"{nodes / seconds:9,.0f} nodes/sec, "
+                  f"{wall:.2f}s per move")
+        if pool:
+            pool.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,56 @@
+# Cold start cost per entry point: wall time of fresh interpreters that
+# import what each role needs (median of --runs), against the bare
+# interpreter and against importing every role up front.
+# Usage: python bench_startup.py [--runs 20] [--importtime ROLE]
+import argparse
+import os
+import statistics
+import subprocess
+import sys
+import time
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+CASES = [
+    ("interpreter", "pass"),
+    ("every role up front", "import server, client, ComputerPlayer"),
+    ("server", "import main; main.load('server')"),
+    ("client", "import main; main.load('client')"),
+    ("computer (random, offline)",
+     "import main; main.load('computer')('random').stop()"),
+    ("multi", "import main; main.load('multi')"),
+]
+
+
+def run(code):
+    start = time.perf_counter()
+    subprocess.run([sys.executable, "-c", code], cwd=HERE, check=True)
+    return time.perf_counter() - start
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--runs", type=int, default=20)
+    parser.add_argument("--importtime", metavar="ROLE", default=None,
+                        help="Show the slowest imports of one role instead")
+    args = parser.parse_args()
+
+    if args.importtime:
+        result = subprocess.run(
+            [sys.executable, "-X", "importtime", "-c",
+             f"import main; main.load({args.importtime!r})"],
+            cwd=HERE, capture_output=True, text=True, check=True)
+        rows = [line.split("|") for line in result.stderr.splitlines()[1:]]
+        rows.sort(key=lambda row: int(row[1]), reverse=True)
+        for own, total, name in rows[:15]:
+            print(f"{int(total) / 1e3:8.1f}ms {name.rstrip()}")
+        return
+
+    for label, code in CASES:
+        times = [run(code) for _ in range(args.runs)]
+        print(f"{label:<28} {statistics.median(times) * 1e3:7.1f}ms "
+              f"(min {min(times) * 1e3:.1f}ms)")
+
+
+if __name__ == "__main__":
+    main()
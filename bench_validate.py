@@ -0,0 +1,84 @@
+# Cost of the validation stage: the wire check and token bucket per packet,
+# the move rules per MOVE, and what a rejected packet costs, next to a full
+# Server.process_packet for a valid move.
+# Usage: python bench_validate.py [--packets 200000]
+import argparse
+import logging
+import time
+from server import Server
+from validate import TokenBucket, admit, move_error
+
+
+def per_packet(function, count):
+    start = time.perf_counter()
+    function(count)
+    return (time.perf_counter() - start) / count * 1e9
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--packets", type=int, default=200000)
+    args = parser.parse_args()
+    logging.disable(logging.WARNING)
+    count = args.packets
+
+    move = {"type": "MOVE", "player": "X", "move": 4}
+    server = Server(size=3, win_length=3)
+    server.current_player = "X"
+    board = server.board
+
+    def baseline(n):
+        for _ in range(n):
+            pass
+
+    def admit_valid(n):
+        bucket = TokenBucket(rate=1e12, burst=10 ** 9)
+        for i in range(n):
+            admit(move, bucket, i)
+
+    def rules_valid(n):
+        for _ in range(n):
+            move_error(move, board, "X", False)
+
+    def process_valid(n):
+        # Two moves per fresh board, so every move is legal
+        for _ in range(n // 2):
+            server.board = server.new_board()
+            server.current_player = "X"
+            server.process_packet({"type": "MOVE", "player": "X", "move": 4})
+            server.process_packet({"type": "MOVE", "player": "O", "move": 0})
+
+    def rejected(packet):
+        def run(n):
+            server.board = server.new_board()
+            server.current_player = "O"
+            for _ in range(n):
+                server.process_packet(packet)
+        return run
+
+    def rate_limited(n):
+        bucket = TokenBucket(rate=1, burst=1)
+        for _ in range(n):
+            admit(move, bucket, 0.0)
+
+    loop = per_packet(baseline, count)
+    valid = per_packet(process_valid, count) - loop
+    checks = (per_packet(admit_valid, count) + per_packet(rules_valid, count)
+              - 2 * loop)
+    print(f"Valid move through process_packet {valid:8.0f}ns")
+    print(f"  of which validation             {checks:8.0f}ns "
+          f"({checks / valid:.1%})")
+    for label, run in [
+            ("  admit (bucket + shape)", admit_valid),
+            ("  move rules", rules_valid),
+            ("Rejected: out of turn", rejected(move)),
+            ("Rejected: off the board",
+             rejected({"type": "MOVE", "player": "O", "move": 99})),
+            ("Rejected: malformed",
+             rejected({"type": "MOVE", "player": "O", "move": "4"})),
+            ("Rejected: rate limited", rate_limited)]:
+        print(f"{label:<34}{per_packet(run, count) - loop:8.0f}ns")
+
+
+if __name__ == "__main__":
+    main()
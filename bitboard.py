@@ -0,0 +1,163 @@
+import math
+from functools import lru_cache
+
+SIZE = 9  # Cells on the classic 3x3 board
+FULL_MASK = (1 << SIZE) - 1
+
+WIN_MASKS = [
+    sum(1 << pos for pos in positions) for positions in [
+        [0, 1, 2], [3, 4, 5], [6, 7, 8],  # Rows
+        [0, 3, 6], [1, 4, 7], [2, 5, 8],  # Columns
+        [0, 4, 8], [2, 4, 6],             # Diagonals
+    ]
+]
+
+# WINNING[mask] tells whether a 3x3 mask contains a full line
+WINNING = [any(mask & win == win for win in WIN_MASKS)
+           for mask in range(1 << SIZE)]
+
+DIRECTIONS = [(0, 1), (1, 0), (1, 1), (1, -1)]
+
+
+@lru_cache(maxsize=None)
+def line_masks(size, win_length):
+    # Every run of win_length cells along a row, column or diagonal
+    lines = []
+    for row in range(size):
+        for col in range(size):
+            for dr, dc in DIRECTIONS:
+                end_row = row + dr * (win_length - 1)
+                end_col = col + dc * (win_length - 1)
+                if 0 <= end_row < size and 0 <= end_col < size:
+                    lines.append(sum(1 << (row + dr * i) * size + col + dc * i
+                                     for i in range(win_length)))
+    return tuple(lines)
+
+
+@lru_cache(maxsize=None)
+def lines_through(size, win_length):
+    # lines_through(...)[cell] holds the line masks that include cell
+    lines = line_masks(size, win_length)
+    return tuple(tuple(line for line in lines if line >> cell & 1)
+                 for cell in range(size * size))
+
+
+class BitBoard:
+    # Board state as one bit mask per player; cell index = row * size + col
+    __slots__ = ("x", "o", "size", "win_length")
+
+    def __init__(self, size=3, win_length=None, x=0, o=0):
+        self.size = size
+        self.win_length = win_length or size
+        self.x = x
+        self.o = o
+
+    @classmethod
+    def from_list(cls, cells, win_length=None):
+        # Build from the [" ", "X", "O", ...] wire format
+        x = o = 0
+        for index, cell in enumerate(cells):
+            if cell == "X":
+                x |= 1 << index
+            elif cell == "O":
+                o |= 1 << index
+        return cls(math.isqrt(len(cells)), win_length, x, o)
+
+    def to_list(self):
+        return [self[index] for index in range(self.size * self.size)]
+
+    def copy(self):
+        return BitBoard(self.size, self.win_length, self.x, self.o)
+
+    def is_classic(self):
+        return self.size == 3 and self.win_length == 3
+
+    def full_mask(self):
+        return (1 << self.size * self.size) - 1
+
+    def occupied(self):
+        return self.x | self.o
+
+    def mask(self, player):
+        return self.x if player == "X" else self.o
+
+    def is_free(self, index):
+        return (0 <= index < self.size * self.size
+                and not (self.x | self.o) >> index & 1)
+
+    def play(self, index, player):
+        if player == "X":
+            self.x |= 1 << index
+        else:
+            self.o |= 1 << index
+
+    def wins_at(self, index, mask):
+        # Only walks the four lines through index, so it costs O(K)
+        if self.is_classic():
+            return WINNING[mask]
+        size, needed = self.size, self.win_length
+        row, col = divmod(index, size)
+        for dr, dc in DIRECTIONS:
+            count = 1
+            for sign in (1, -1):
+                r, c = row + dr * sign, col + dc * sign
+                while (count < needed and 0 <= r < size and 0 <= c < size
+                       and mask >> (r * size + c) & 1):
+                    count += 1
+                    r += dr * sign
+                    c += dc * sign
+            if count >= needed:
+                return True
+        return False
+
+    def has_won(self, player, last_move=None):
+        mask = self.mask(player)
+        if self.is_classic():
+            return WINNING[mask]
+        if last_move is not None:
+            return self.wins_at(last_move, mask)
+        # No hint about the last move: scan every stone of the player
+        while mask:
+            low = mask & -mask
+            if self.wins_at(low.bit_length() - 1, self.mask(player)):
+                return True
+            mask ^= low
+        return False
+
+    def is_full(self):
+        return self.x | self.o == self.full_mask()
+
+    def legal_moves(self):
+        moves = []
+        free = self.full_mask() & ~(self.x | self.o)
+        while free:
+            low = free & -free
+            moves.append(low.bit_length() - 1)
+            free ^= low
+        return moves
+
+    # List-style access so GUI code can keep treating the board as cells
+    def __getitem__(self, index):
+        if self.x >> index & 1:
+            return "X"
+        if self.o >> index & 1:
+            return "O"
+        return " "
+
+    def __iter__(self):
+        return iter(self.to_list())
+
+    def __len__(self):
+        return self.size * self.size
+
+    def __contains__(self, cell):
+        return cell in self.to_list()
+
+    def __eq__(self, other):
+        if isinstance(other, BitBoard):
+            return (self.size == other.size and self.x == other.x
+                    and self.o == other.o)
+        return self.to_list() == other
+
+    def __repr__(self):
+        return repr(self.to_list())
@@ -0,0 +1,375 @@
+# Precomputed moves for boards the 3x3 solver table doesn't cover: an
+# opening book and an endgame tablebase in one memory-mapped file. Positions
+# are keyed by a 64-bit hash of their canonical (symmetry-reduced) form and
+# stored in an open-addressing hash table, so opening the file parses only
+# the header and a lookup is one hash plus a probe or two.
+# Build: python book.py --size 4 --win-length 4 --plies 3 --endgame 8
+import argparse
+import logging
+import mmap
+import os
+import struct
+import time
+from bitboard import lines_through
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TTTB"
+VERSION = 1
+HEADER = struct.Struct("<4sBBBxQ")  # Magic, version, size, win length, slots
+RECORD = struct.Struct("<QhH")  # Key hash, value, best move (canonical)
+
+EMPTY = 0  # Key hash of an unused slot
+LOAD_FACTOR = 0.5  # Keeps probe runs short
+NODE_LIMIT = 2000000  # Nodes a builder spends on one position before skipping it
+MASK64 = (1 << 64) - 1
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+def book_path(size, win_length):
+    return os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                        f"book_{size}x{size}_{win_length}.bin")
+
+
+def key_hash(key):
+    # Fold wide keys to 64 bits, then mix (the splitmix64 finaliser) so
+    # neighbouring positions land in different slots
+    h = 0
+    while key:
+        h ^= key & MASK64
+        key >>= 64
+    h = (h ^ h >> 30) * 0xbf58476d1ce4e5b9 & MASK64
+    h = (h ^ h >> 27) * 0x94d049bb133111eb & MASK64
+    h ^= h >> 31
+    return h or 1  # 0 marks an empty slot
+
+
+class Symmetry:
+    # The 8 rotations and reflections of a size x size board, applied to a
+    # mask one byte at a time through lookup tables
+    def __init__(self, size):
+        self.size = size
+        self.cells = size * size
+        n = size - 1
+        maps = [
+            lambda r, c: (r, c), lambda r, c: (c, n - r),
+            lambda r, c: (n - r, n - c), lambda r, c: (n - c, r),
+            lambda r, c: (r, n - c), lambda r, c: (n - r, c),
+            lambda r, c: (c, r), lambda r, c: (n - c, n - r),
+        ]
+        self.permutations = [
+            [row * size + col for row, col in
+             (m(*divmod(cell, size)) for cell in range(self.cells))]
+            for m in maps]
+        self.inverse = [[perm.index(cell) for cell in range(self.cells)]
+                        for perm in self.permutations]
+        self.tables = [[self.chunk_table(perm, first)
+                        for first in range(0, self.cells, 8)]
+                       for perm in self.permutations]
+
+    def chunk_table(self, perm, first):
+        # table[bits] moves the 8 cells from first on, given as bits
+        table = [0] * 256
+        for bits in range(1, 256):
+            low = bits & -bits
+            cell = first + low.bit_length() - 1
+            if cell < self.cells:
+                table[bits] = table[bits ^ low] | 1 << perm[cell]
+            else:
+                table[bits] = table[bits ^ low]
+        return table
+
+    def apply(self, t, mask):
+        result = 0
+        for table in self.tables[t]:
+            if not mask:
+                break
+            result |= table[mask & 255]
+            mask >>= 8
+        return result
+
+    def canonical(self, me, opp):
+        # Smallest key among the 8 symmetric images, plus the transform used
+        best_key, best_t = None, 0
+        for t in range(8):
+            key = self.apply(t, me) | self.apply(t, opp) << self.cells
+            if best_key is None or key < best_key:
+                best_key, best_t = key, t
+        return best_key, best_t
+
+
+class SearchAborted(Exception):
+    pass
+
+
+class ExactSearch:
+    # Negamax with alpha-beta over canonical positions, like the 3x3 Solver
+    # but for any board; gives up once a search passes node_limit
+    def __init__(self, size, win_length, node_limit=NODE_LIMIT):
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        self.full = (1 << self.cells) - 1
+        self.node_limit = node_limit
+        self.nodes = 0
+        self.symmetry = Symmetry(size)
+        self.lines = lines_through(size, win_length)
+        center = (size - 1) / 2
+        self.order = sorted(range(self.cells), key=lambda cell: (
+            abs(cell // size - center) + abs(cell % size - center)))
+        self.tt = {}  # Canonical key -> (flag, value, canonical move)
+
+    def wins(self, cell, mask):
+        for line in self.lines[cell]:
+            if mask & line == line:
+                return True
+        return False
+
+    def solve(self, me, opp):
+        # Exact (value, move) for the player to move, or None past the limit
+        self.nodes = 0
+        try:
+            return self.negamax(me, opp, -self.cells - 2, self.cells + 2)
+        except SearchAborted:
+            return None
+
+    def negamax(self, me, opp, alpha, beta):
+        # me is to move and opp's last stone did not win
+        self.nodes += 1
+        if self.nodes > self.node_limit:
+            raise SearchAborted
+        occupied = me | opp
+        if occupied == self.full:
+            return 0, -1
+        key, t = self.symmetry.canonical(me, opp)
+        perm, inverse = self.symmetry.permutations[t], self.symmetry.inverse[t]
+
+        original_alpha = alpha
+        hint = -1
+        entry = self.tt.get(key)
+        if entry is not None:
+            flag, value, move = entry
+            hint = inverse[move]
+            if flag == EXACT:
+                return value, hint
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, hint
+
+        stones = occupied.bit_count()
+        moves = [cell for cell in self.order if not occupied >> cell & 1]
+        for cell in moves:
+            if self.wins(cell, me | 1 << cell):
+                # Winning now is the best score there is, whatever the window
+                value = self.cells - stones
+                self.tt[key] = (EXACT, value, perm[cell])
+                return value, cell
+        threats = [cell for cell in moves if self.wins(cell, opp | 1 << cell)]
+        if threats:
+            # Anything but a block loses at once
+            moves = threats[:1]
+        elif hint >= 0:
+            moves.remove(hint)
+            moves.insert(0, hint)
+
+        best_value, best_move = -self.cells - 2, -1
+        for cell in moves:
+            value = -self.negamax(opp, me | 1 << cell, -beta, -alpha)[0]
+            if value > best_value:
+                best_value, best_move = value, cell
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt[key] = (flag, best_value, perm[best_move])
+        return best_value, best_move
+
+    def exact_entries(self, keep):
+        # Canonical key -> (value, move) for settled positions keep(stones)
+        # accepts
+        return {key: (value, move)
+                for key, (flag, value, move) in self.tt.items()
+                if flag == EXACT and keep(key.bit_count())}
+
+
+class Book:
+    # Read-only view of a book file; nothing is parsed until a lookup
+    def __init__(self, path):
+        self.path = path
+        with open(path, "rb") as f:
+            self.map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        try:
+            magic, version, self.size, self.win_length, self.slots = (
+                HEADER.unpack_from(self.map))
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} book")
+            if len(self.map) != HEADER.size + self.slots * RECORD.size:
+                raise ValueError(f"{path} is truncated")
+        except (ValueError, struct.error):
+            self.map.close()
+            raise
+        self.mask = self.slots - 1
+        self.symmetry = Symmetry(self.size)
+
+    @classmethod
+    def open(cls, size, win_length, path=None):
+        # The book for this board if one has been built, else None
+        path = path or book_path(size, win_length)
+        try:
+            book = cls(path)
+        except (OSError, ValueError, struct.error):
+            return None
+        if (book.size, book.win_length) != (size, win_length):
+            logger.warning("%s is for %dx%d boards with %d in a row",
+                           path, book.size, book.size, book.win_length)
+            book.close()
+            return None
+        return book
+
+    def lookup(self, me, opp):
+        # (value, move) for the player to move, or None if not covered
+        key, t = self.symmetry.canonical(me, opp)
+        h = key_hash(key)
+        slot = h & self.mask
+        while True:
+            stored, value, move = RECORD.unpack_from(
+                self.map, HEADER.size + slot * RECORD.size)
+            if stored == h:
+                return value, self.symmetry.inverse[t][move]
+            if stored == EMPTY:
+                return None
+            slot = (slot + 1) & self.mask
+
+    def choose(self, board, player):
+        entry = self.lookup(board.mask(player),
+                            board.mask("O" if player == "X" else "X"))
+        if entry is None or not board.is_free(entry[1]):
+            return -1
+        return entry[1]
+
+    def close(self):
+        self.map.close()
+
+
+def write_book(path, size, win_length, records):
+    # records: canonical key -> (value, canonical move)
+    slots = 1
+    while slots * LOAD_FACTOR < len(records):
+        slots *= 2
+    table = bytearray(slots * RECORD.size)
+    for key, (value, move) in records.items():
+        h = key_hash(key)
+        slot = h & slots - 1
+        while RECORD.unpack_from(table, slot * RECORD.size)[0] != EMPTY:
+            slot = (slot + 1) & slots - 1
+        RECORD.pack_into(table, slot * RECORD.size, h, value, move)
+    temporary = f"{path}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(HEADER.pack(MAGIC, VERSION, size, win_length, slots))
+        f.write(table)
+    os.replace(temporary, path)
+
+
+def opening_levels(search, plies):
+    # Distinct canonical positions after 0..plies stones, games still open
+    levels = [[(0, 0)]]
+    seen = {0}
+    for _ in range(plies):
+        level = []
+        for me, opp in levels[-1]:
+            occupied = me | opp
+            if occupied == search.full:
+                continue
+            for cell in range(search.cells):
+                if occupied >> cell & 1 or search.wins(cell, me | 1 << cell):
+                    continue
+                child = (opp, me | 1 << cell)
+                key, _ = search.symmetry.canonical(*child)
+                if key not in seen:
+                    seen.add(key)
+                    level.append(child)
+        levels.append(level)
+    return levels
+
+
+def solve_roots(task):
+    # Runs in a worker process; returns the exact entries worth keeping
+    size, win_length, roots, plies, endgame, node_limit = task
+    search = ExactSearch(size, win_length, node_limit)
+    solved = sum(search.solve(me, opp) is not None for me, opp in roots)
+    cells = size * size
+    records = search.exact_entries(
+        lambda stones: stones <= plies or cells - stones <= endgame)
+    return solved, len(roots), records
+
+
+def build(size, win_length, plies, endgame, workers=None,
+          node_limit=NODE_LIMIT):
+    # Solves the deepest opening positions across a process pool, keeping
+    # every settled position near the root (book) or near the end
+    # (tablebase), then settles the shallower openings from those results
+    from multiprocessing import Pool  # Only building needs it
+    search = ExactSearch(size, win_length, node_limit)
+    levels = opening_levels(search, plies)
+    frontier = levels[-1]
+    workers = workers or os.cpu_count()
+    step = max(1, len(frontier) // (workers * 4))
+    tasks = [(size, win_length, frontier[i:i + step], plies, endgame,
+              node_limit) for i in range(0, len(frontier), step)]
+    records = {}
+    solved = total = 0
+    with Pool(workers) as pool:
+        for done, count, found in pool.imap_unordered(solve_roots, tasks):
+            solved += done
+            total += count
+            records.update(found)
+
+    search.tt = {key: (EXACT, value, move)
+                 for key, (value, move) in records.items()}
+    for level in reversed(levels[:-1]):
+        for me, opp in level:
+            total += 1
+            solved += search.solve(me, opp) is not None
+    records.update(search.exact_entries(
+        lambda stones: stones <= plies or search.cells - stones <= endgame))
+    return records, solved, total
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Build an opening book")
+    parser.add_argument("--size", type=int, default=4)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument("--plies", type=int, default=3,
+                        help="Cover every opening up to this many stones")
+    parser.add_argument("--endgame", type=int, default=6,
+                        help="Also keep solved positions with this many or "
+                             "fewer empty cells")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--node-limit", type=int, default=NODE_LIMIT,
+                        help="Skip an opening that takes more nodes")
+    parser.add_argument("--out", default=None)
+    args = parser.parse_args()
+    win_length = args.win_length or args.size
+    out = args.out or book_path(args.size, win_length)
+
+    start = time.perf_counter()
+    records, solved, total = build(args.size, win_length, args.plies,
+                                   args.endgame, args.workers, args.node_limit)
+    write_book(out, args.size, win_length, records)
+    print(f"Solved {solved}/{total} openings, {len(records):,} positions "
+          f"in {time.perf_counter() - start:.1f}s -> {out} "
+          f"({os.path.getsize(out):,} bytes)")
+
+
+if __name__ == "__main__":
+    main()
@@ -1,56 +1,162 @@
+import logging
 import socket
 import json
+import time
 from threading import Thread
 from IGameInstance import *
+from codec import hello_packet
+from heartbeat import PONG
+from session import UNNUMBERED, backoff_delays, resume_packet
+
+logger = logging.getLogger(__name__)
 
 
 class Client(IGameInstance):
     def __init__(self, host="localhost", port="12345"):
         super().__init__("client", host, port)
         self.id = "X"
+        self.seq = 0  # Last state update applied, for DELTA gap detection
+        self.token = None  # Session token from the server, for resuming
+        self.received = 0  # Numbered packets received in this session
 
     def initialize(self):
-        print("Connecting to server...")
+        logger.info("Connecting to server...")
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
         self.socket.connect((self.host, self.port))
-        self.connection = self.socket
-        print("Connected to server.")
+        self.set_connection(self.socket)
+        logger.info("Connected to server.")
+        # Offer faster wire formats; servers that ignore this keep JSON
+        self.send_packet(hello_packet())
+
+    def connection_lost(self):
+        self.packet_queue.put(ConnectionEvent())
+
+    def connection_changed(self, connection):
+        if connection is None:
+            self.drop_connection()
+            if self.token is None:
+                # The server can't resume us; give up as before
+                self.notify({"type": "DISCONNECTED"})
+                return
+            logger.warning("Connection lost, reconnecting...")
+            self.notify({"type": "RECONNECTING"})
+            Thread(target=self.reconnect, daemon=True).start()
+            return
+        self.socket = connection
+        self.set_connection(connection)
+        # RESUME goes first so the server knows we're not a new client
+        self.send_packet(resume_packet(self.token, self.received))
+        self.send_packet(hello_packet())
+        self.watch_connection(connection)
+        logger.info("Reconnected to server.")
+
+    def reconnect(self):
+        for delay in backoff_delays():
+            time.sleep(delay)
+            if not self.running:
+                return
+            try:
+                connection = socket.create_connection(
+                    (self.host, self.port), timeout=5)
+            except OSError:
+                continue
+            connection.settimeout(None)
+            self.packet_queue.put(ConnectionEvent(connection))
+            return
+        logger.error("Could not reconnect to the server.")
+        self.notify({"type": "DISCONNECTED"})
 
     def process_packet(self, packet):
         packet_type = packet.get("type")
+        if packet_type not in UNNUMBERED:
+            self.received += 1
 
-        if packet_type == PacketType.PLAYER_TURN.value:
+        if packet_type == PacketType.RESUME.value:
+            # Either a fresh session or a resumed one; numbered packets
+            # continue from here
+            self.token = packet.get("token")
+            self.received = packet.get("seq", 0)
+            self.notify({"type": "TURN", "player": self.current_player})
+
+        elif packet_type == PacketType.PLAYER_TURN.value:
             self.current_player = packet.get("player")
-            print(f"It's {self.current_player}'s turn!")
+            logger.debug("It's %s's turn!", self.current_player)
+            self.notify({"type": "TURN", "player": self.current_player})
 
         elif packet_type == PacketType.GAME_STATE.value:
-            self.board = packet.get("board")
-            print("Updated board:", self.board)
+            self.board = BitBoard.from_list(
+                packet.get("board"), self.win_length)
+            logger.debug("Updated board: %s", self.board)
+            self.notify({"type": "BOARD"})
+
+        elif packet_type == PacketType.DELTA.value:
+            self.apply_delta(packet)
+
+        elif packet_type == PacketType.SNAPSHOT.value:
+            self.board = BitBoard.from_list(
+                packet.get("board"), self.win_length)
+            self.current_player = packet.get("player")
+            self.seq = packet.get("seq")
+            logger.info("Resynced board: %s", self.board)
+            self.notify({"type": "BOARD"})
+            self.notify({"type": "TURN", "player": self.current_player})
+
+        elif packet_type == PacketType.HELLO.value:
+            self.codec = packet.get("codec", JSON)
+            logger.info("Using %s wire format, features: %s",
+                        self.codec, packet.get("features", []))
+
+        elif packet_type == PacketType.WELCOME.value:
+            # Multi-match servers tell us which symbol we play
+            self.id = packet.get("player")
+            logger.info("Joined room %s as %s.", packet.get("room"), self.id)
+
+        elif packet_type == PacketType.CONFIG.value:
+            self.configure(packet.get("size"), packet.get("win_length"))
+            logger.info("Playing %dx%d, %d in a row.",
+                        self.size, self.size, self.win_length)
+            self.notify({"type": "BOARD"})
 
         elif packet_type == PacketType.RESET.value:
-            print("Game reset requested by the server.")
+            logger.info("Game reset requested by the server.")
             self.reset_game()  # Call the reset logic
         elif packet_type == PacketType.GAME_WIN.value:
             result = packet.get("result")
-            self.gui_callback(
-                {"type": "END", "result": result})
+            self.notify({"type": "END", "result": result})
+        elif packet_type == PacketType.PING.value:
+            self.send_packet(PONG)
+
+    def apply_delta(self, packet):
+        seq = packet.get("seq")
+        if seq != self.seq + 1:
+            # Missed an update; ask for a full snapshot instead of guessing
+            logger.warning("Missed state updates (%s -> %s), resyncing.",
+                           self.seq, seq)
+            self.send_packet({"type": PacketType.SYNC.value})
+            return
+        self.seq = seq
+        self.board.play(packet.get("cell"), packet.get("player"))
+        self.current_player = packet.get("next")
+        self.notify({"type": "CELL", "index": packet.get("cell"),
+                     "player": packet.get("player")})
+        if packet.get("result"):
+            self.isOver = True
+            self.notify({"type": "END", "result": packet["result"]})
+        else:
+            self.notify({"type": "TURN", "player": self.current_player})
 
     def reset_game(self):
-        self.board = [" "] * 9  # Clear the board
+        self.board = self.new_board()  # Clear the board
         self.current_player = None  # Reset the current player
-        self.packet_queue.queue.clear()  # Clear any pending packets
+        self.clear_packets()  # Clear any pending packets
         self.isOver = False  # Reset game over flag
+        self.notify({"type": "RESET"})
 
     def play_turn(self, index):
-        if self.board[index] == " ":
+        if self.board.is_free(index):
             # Send the MOVE packet to the server
             self.send_packet(
                 {"type": PacketType.MOVE.value, "player": self.id, "move": index}
             )
         else:
-            print("Invalid move. This spot is already taken.")
-
-    def run_game(self):
-        while self.running:
-            if not self.packet_queue.empty():
-                packet = self.packet_queue.get()
-                self.process_packet(packet)
+            logger.warning("Invalid move. This spot is already taken.")
@@ -0,0 +1,332 @@
+import json
+import logging
+import math
+import struct
+from packets import PacketType
+
+logger = logging.getLogger(__name__)
+
+# Codecs in order of preference; peers agree on one with a HELLO exchange
+BINARY = "binary/1"
+JSON = "json"
+SUPPORTED_CODECS = [BINARY, JSON]
+
+# Optional protocol features, also agreed on in HELLO
+SUPPORTED_FEATURES = ["delta"]
+
+# Binary frames start with a byte no JSON line can start with, so a
+# decoder can accept both formats on the same stream
+BINARY_MAGIC = 0xB1
+HEADER = struct.Struct("!BBH")  # Magic/version, opcode, payload length
+MAX_PAYLOAD = 0xFFFF
+MAX_LINE = MAX_PAYLOAD  # Longest JSON line kept; longer ones are skipped
+
+# Fixed-width opcodes follow PacketType order; append new types at the end
+OPCODES = {packet_type.value: opcode
+           for opcode, packet_type in enumerate(PacketType)}
+PACKET_TYPES = {opcode: value for value, opcode in OPCODES.items()}
+GENERIC = 0xFF  # JSON payload for packets without a packed layout
+SCAN = json.JSONDecoder().scan_once  # Decodes one JSON value at an offset
+
+MOVE = struct.Struct("!cH")
+WELCOME = struct.Struct("!cI")
+CONFIG = struct.Struct("!BB")
+DELTA = struct.Struct("!IHcc")
+SNAPSHOT = struct.Struct("!Ic")
+NOBODY = b"-"  # Stands in for a missing player
+
+
+def _player_byte(player):
+    return player.encode() if player else NOBODY
+
+
+def _player_str(byte):
+    return None if byte == NOBODY else byte.decode()
+
+
+def _unpack_move(payload):
+    player, move = MOVE.unpack(payload)
+    return {"player": player.decode(), "move": move}
+
+
+def _unpack_welcome(payload):
+    player, room = WELCOME.unpack(payload)
+    return {"player": player.decode(), "room": room}
+
+
+def _unpack_config(payload):
+    size, win_length = CONFIG.unpack(payload)
+    return {"size": size, "win_length": win_length}
+
+
+# Translation tables keep board packing out of per-cell Python loops
+X_BITS = str.maketrans("XO ", "100")
+O_BITS = str.maketrans("XO ", "010")
+X_CELLS = bytes.maketrans(b"01", b"\0X")
+O_CELLS = bytes.maketrans(b"01", b"\0O")
+
+
+def _pack_delta(packet):
+    result = packet["result"]
+    return DELTA.pack(packet["seq"], packet["cell"], packet["player"].encode(),
+                      _player_byte(packet["next"])) + (result or "").encode()
+
+
+def _unpack_delta(payload):
+    seq, cell, player, next_player = DELTA.unpack_from(payload)
+    result = payload[DELTA.size:].decode()
+    return {"seq": seq, "cell": cell, "player": player.decode(),
+            "next": _player_str(next_player), "result": result or None}
+
+
+def _pack_snapshot(packet):
+    return (SNAPSHOT.pack(packet["seq"], _player_byte(packet["player"]))
+            + _pack_board(packet["board"]))
+
+
+def _unpack_snapshot(payload):
+    seq, player = SNAPSHOT.unpack_from(payload)
+    return {"seq": seq, "player": _player_str(player),
+            "board": _unpack_board(payload[SNAPSHOT.size:])}
+
+
+def _pack_board(cells):
+    # Size byte, then the X and O masks as little-endian bitmaps
+    size = math.isqrt(len(cells))
+    text = "".join(cells)[::-1]  # Cell 0 becomes the lowest bit
+    x = int(text.translate(X_BITS) or "0", 2)
+    o = int(text.translate(O_BITS) or "0", 2)
+    width = (len(cells) + 7) // 8
+    return bytes([size]) + x.to_bytes(width, "little") + o.to_bytes(width, "little")
+
+
+def _unpack_board(payload):
+    size = payload[0]
+    cells = size * size
+    width = (cells + 7) // 8
+    x = int.from_bytes(payload[1:1 + width], "little")
+    o = int.from_bytes(payload[1 + width:1 + 2 * width], "little")
+    # One byte per cell, highest cell first; X and O never overlap
+    x_cells = format(x, "b").zfill(cells).encode().translate(X_CELLS)
+    o_cells = format(o, "b").zfill(cells).encode().translate(O_CELLS)
+    merged = int.from_bytes(x_cells, "big") | int.from_bytes(o_cells, "big")
+    return list(merged.to_bytes(cells, "big").replace(b"\0", b" ")
+                .decode()[::-1])
+
+
+# Packet type -> (fields, pack, unpack) for types with a packed layout
+LAYOUTS = {
+    PacketType.MOVE.value: (
+        {"player", "move"},
+        lambda p: MOVE.pack(p["player"].encode(), p["move"]),
+        _unpack_move),
+    PacketType.PLAYER_TURN.value: (
+        {"player"},
+        lambda p: p["player"].encode(),
+        lambda b: {"player": b.decode()}),
+    PacketType.GAME_STATE.value: (
+        {"board"},
+        lambda p: _pack_board(p["board"]),
+        lambda b: {"board": _unpack_board(b)}),
+    PacketType.GAME_WIN.value: (
+        {"result"},
+        lambda p: p["result"].encode(),
+        lambda b: {"result": b.decode()}),
+    PacketType.RESET.value: (
+        set(),
+        lambda p: b"",
+        lambda b: {}),
+    PacketType.WELCOME.value: (
+        {"player", "room"},
+        lambda p: WELCOME.pack(p["player"].encode(), p["room"]),
+        _unpack_welcome),
+    PacketType.CONFIG.value: (
+        {"size", "win_length"},
+        lambda p: CONFIG.pack(p["size"], p["win_length"]),
+        _unpack_config),
+    PacketType.DELTA.value: (
+        {"seq", "cell", "player", "next", "result"},
+        _pack_delta,
+        _unpack_delta),
+    PacketType.SNAPSHOT.value: (
+        {"seq", "player", "board"},
+        _pack_snapshot,
+        _unpack_snapshot),
+    PacketType.SYNC.value: (
+        set(),
+        lambda p: b"",
+        lambda b: {}),
+}
+
+
+def encode_json(packet):
+    return (json.dumps(packet) + "\n").encode()
+
+
+def encode_binary(packet):
+    packet_type = packet.get("type")
+    layout = LAYOUTS.get(packet_type)
+    opcode, payload = GENERIC, None
+    if layout is not None and packet.keys() - {"type"} == layout[0]:
+        try:
+            opcode, payload = OPCODES[packet_type], layout[1](packet)
+        except (TypeError, ValueError, AttributeError, OverflowError,
+                struct.error):
+            opcode = GENERIC  # Unusual field values travel as JSON
+    if opcode == GENERIC:
+        payload = json.dumps(packet).encode()
+    if len(payload) > MAX_PAYLOAD:
+        return encode_json(packet)  # Too big for a frame; JSON still works
+    return HEADER.pack(BINARY_MAGIC, opcode, len(payload)) + payload
+
+
+def encode_packet(packet, codec=JSON):
+    if codec == BINARY:
+        return encode_binary(packet)
+    return encode_json(packet)
+
+
+def decode_binary(opcode, payload):
+    if opcode == GENERIC:
+        return json.loads(payload)
+    packet_type = PACKET_TYPES[opcode]
+    packet = LAYOUTS[packet_type][2](payload)
+    packet["type"] = packet_type
+    return packet
+
+
+def choose_codec(offered):
+    # Pick our most preferred codec the peer also speaks
+    for codec in SUPPORTED_CODECS:
+        if codec in (offered or []):
+            return codec
+    return JSON
+
+
+def choose_features(offered):
+    return [feature for feature in SUPPORTED_FEATURES
+            if feature in (offered or [])]
+
+
+def hello_packet(codecs=SUPPORTED_CODECS, features=SUPPORTED_FEATURES,
+                 rating=None, name=None):
+    packet = {"type": PacketType.HELLO.value, "codecs": codecs,
+              "features": features}
+    if rating is not None:
+        packet["rating"] = rating  # Used by rated matchmaking
+    if name is not None:
+        packet["name"] = name  # Identifies the player in stored replays
+    return packet
+
+
+class FrameDecoder:
+    # Splits a byte stream into packets, JSON lines and binary frames alike.
+    # Data lands in a preallocated buffer (recv_into/get_buffer friendly)
+    # and only an incomplete tail is ever moved, so bursts stay linear.
+    def __init__(self, capacity=65536):
+        self.buffer = bytearray(capacity)
+        self.view = memoryview(self.buffer)
+        self.start = 0  # First byte not yet decoded
+        self.end = 0  # End of received data
+        self.scanned = 0  # Where to resume looking for a newline
+        self.skipping = False  # Discarding an overlong line up to its end
+
+    def writable(self, min_free=4096):
+        # Free space after the received data, compacting or growing first
+        if self.start == self.end:
+            self.start = self.end = self.scanned = 0
+        if len(self.buffer) - self.end < min_free:
+            pending = bytes(self.view[self.start:self.end])  # Partial frame
+            if len(pending) + min_free > len(self.buffer) // 2:
+                self.buffer = bytearray(
+                    max(len(self.buffer) * 2, len(pending) + min_free))
+                self.view = memoryview(self.buffer)
+            self.buffer[:len(pending)] = pending
+            self.scanned -= self.start
+            self.start, self.end = 0, len(pending)
+        return self.view[self.end:]
+
+    def commit(self, count):
+        # count bytes were written into writable(); decode what completed
+        self.end += count
+        return self.decode()
+
+    def feed(self, data):
+        self.writable(len(data))[:len(data)] = data
+        return self.commit(len(data))
+
+    def decode(self):
+        packets = []
+        buffer = self.buffer
+        batch_start = batch_end = None  # Run of complete JSON lines
+        while self.start < self.end:
+            if self.skipping:
+                index = buffer.find(b"\n", self.start, self.end)
+                if index < 0:
+                    self.start = self.scanned = self.end
+                    break
+                self.skipping = False
+                self.start = self.scanned = index + 1
+                continue
+            if buffer[self.start] == BINARY_MAGIC:
+                if self.end - self.start < HEADER.size:
+                    break
+                _, opcode, length = HEADER.unpack_from(buffer, self.start)
+                frame_end = self.start + HEADER.size + length
+                if frame_end > self.end:
+                    break
+                if batch_start is not None:
+                    self.decode_lines(batch_start, batch_end, packets)
+                    batch_start = None
+                try:
+                    packets.append(decode_binary(
+                        opcode, bytes(self.view[self.start + HEADER.size:frame_end])))
+                except (KeyError, ValueError, IndexError, OverflowError,
+                        struct.error) as e:
+                    logger.warning("Error decoding frame: %s", e)
+                self.start = self.scanned = frame_end
+            else:
+                index = buffer.find(b"\n", max(self.start, self.scanned), self.end)
+                if index < 0:
+                    if self.end - self.start > MAX_LINE:
+                        # No packet is this long; don't buffer it forever
+                        logger.warning("Skipping a line over %d bytes",
+                                       MAX_LINE)
+                        self.skipping = True
+                        self.start = self.end
+                    self.scanned = self.end  # Don't rescan this next time
+                    break
+                if batch_start is None:
+                    batch_start = self.start
+                batch_end = index
+                self.start = self.scanned = index + 1
+        if batch_start is not None:
+            self.decode_lines(batch_start, batch_end, packets)
+        return packets
+
+    def decode_lines(self, start, end, packets):
+        lines = self.buffer[start:end]
+        # Each line on its own through the C scanner, which skips the
+        # per-call overhead of json.loads. A line only counts if its value
+        # ends where the line does, so broken lines can't merge with or
+        # split into their neighbours
+        try:
+            batch = []
+            for line in lines.decode().split("\n"):
+                packet, stop = SCAN(line, 0)
+                if stop != len(line):
+                    raise ValueError("Extra data after a packet")
+                batch.append(packet)
+        except (ValueError, StopIteration):
+            batch = None  # Includes UnicodeDecodeError
+        if batch is not None:
+            packets.extend(batch)
+            return
+        # Blank or padded lines, or broken ones to find and skip
+        for line in lines.split(b"\n"):
+            if not line.strip():
+                continue
+            try:
+                packets.append(json.loads(line))
+            except ValueError as e:
+                logger.warning("Error decoding packet: %s", e)
@@ -0,0 +1,56 @@
+# Sends one match's updates to any number of read-only spectators. Each
+# update is encoded once per (codec, delta) form in use, and the same bytes
+# go to every spectator wanting that form. A spectator whose socket backs up
+# past HIGH_WATER is skipped until it drains, then sent one snapshot to
+# catch up; one that stays backed up for DROP_AFTER seconds is dropped.
+from codec import encode_packet
+from metrics import PACKETS_SENT
+
+HIGH_WATER = 64 * 1024  # Unsent bytes before a spectator counts as lagging
+LOW_WATER = 16 * 1024  # ...and when it has caught up again
+DROP_AFTER = 10.0  # Seconds a spectator may lag before it is disconnected
+
+
+class Fanout:
+    def __init__(self):
+        self.groups = {}  # (codec, delta) -> set of spectators
+        self.count = 0
+
+    def add(self, spectator):
+        key = (spectator.codec, spectator.delta)
+        self.groups.setdefault(key, set()).add(spectator)
+        self.count += 1
+
+    def remove(self, spectator):
+        key = (spectator.codec, spectator.delta)
+        group = self.groups.get(key)
+        if group is None or spectator not in group:
+            return
+        group.discard(spectator)
+        if not group:
+            del self.groups[key]
+        self.count -= 1
+
+    def __len__(self):
+        return self.count
+
+    def __iter__(self):
+        return iter([spectator for group in self.groups.values()
+                     for spectator in group])
+
+    def publish(self, build):
+        # build(delta) returns the packets for one form of the update;
+        # returns the number of spectators written to
+        written = 0
+        for (codec, delta), group in self.groups.items():
+            packets = build(delta)
+            data = b"".join(encode_packet(packet, codec) for packet in packets)
+            sent = 0
+            for spectator in group:
+                if not spectator.lagging:
+                    spectator.write(data)
+                    sent += 1
+            for packet in packets:
+                PACKETS_SENT.inc(packet.get("type"), sent)
+            written += sent
+        return written
@@ -1,10 +1,15 @@
+import logging
 import tkinter as tk
 from tkinter import messagebox
-from threading import Thread
-from server import Server
-from client import Client
-from ComputerPlayer import ComputerPlayer
-from EventHandler import EventHandler
+from queue import Queue, Empty
+from threading import Thread, Lock
+from solver import DIFFICULTIES
+import log
+import metrics
+
+logger = logging.getLogger(__name__)
+
+GAME_EVENT = "<<GameEvent>>"  # Posted by the game thread to wake the Tk loop
 
 
 class TicTacToeGUI:
@@ -15,11 +20,20 @@ class TicTacToeGUI:
         self.event_handler = None
         self.running = True
         self.turn_label = None  # Label for displaying the current player's turn
-        self.buttons = []  # Button references for the 3x3 board
+        self.buttons = []  # Button references for the board cells
+        self.grid_frame = None
         self.reset_button = None  # Reset button reference
         self.ip_entry = None
         self.port_entry = None
-
+        self.difficulty = None
+        self.size_entry = None
+        self.win_length_entry = None
+        self.events = Queue()  # Game events waiting for the Tk thread
+        self.wakeup_lock = Lock()
+        self.wakeup_pending = False
+        self.cells = []  # Text currently shown on each button
+
+        self.root.bind(GAME_EVENT, self.drain_events)
         self.create_role_selection_window()
 
     def create_role_selection_window(self):
@@ -40,6 +54,24 @@ class TicTacToeGUI:
         self.port_entry.pack(pady=5)
         self.port_entry.insert(0, "12345")  # Default Port
 
+        # Board size and stones in a row needed to win (server/computer)
+        tk.Label(self.root, text="Board size / Win length:",
+                 font=("Arial", 12)).pack()
+        board_frame = tk.Frame(self.root)
+        board_frame.pack(pady=5)
+        self.size_entry = tk.Entry(board_frame, font=("Arial", 12), width=5)
+        self.size_entry.pack(side=tk.LEFT, padx=5)
+        self.size_entry.insert(0, "3")
+        self.win_length_entry = tk.Entry(
+            board_frame, font=("Arial", 12), width=5)
+        self.win_length_entry.pack(side=tk.LEFT, padx=5)
+        self.win_length_entry.insert(0, "3")
+
+        # Computer difficulty
+        tk.Label(self.root, text="Difficulty:", font=("Arial", 12)).pack()
+        self.difficulty = tk.StringVar(self.root, value="perfect")
+        tk.OptionMenu(self.root, self.difficulty, *DIFFICULTIES).pack(pady=5)
+
         # Role selection buttons
         roles = [
             ("Server", self.start_server),
@@ -65,13 +97,30 @@ class TicTacToeGUI:
             return None, None
         return ip, port
 
+    def get_board_config(self):
+        try:
+            size = int(self.size_entry.get())
+            win_length = int(self.win_length_entry.get())
+        except ValueError:
+            size = win_length = 0
+        if size < 3 or not 3 <= win_length <= size:
+            messagebox.showerror(
+                "Invalid Board",
+                "Board size must be at least 3 and win length between 3 and the size.")
+            return None, None
+        return size, win_length
+
     def start_server(self):
         ip, port = self.get_ip_and_port()
         if ip is None or port is None:
             return  # Invalid IP or port
+        size, win_length = self.get_board_config()
+        if size is None:
+            return
 
         self.cleanup_window()
-        self.initialize_game_window("server", ip, port)
+        self.initialize_game_window("server", ip, port, size=size,
+                                    win_length=win_length)
 
     def start_client(self):
         ip, port = self.get_ip_and_port()
@@ -82,18 +131,28 @@ class TicTacToeGUI:
         self.initialize_game_window("client", ip, port)
 
     def start_computer(self):
+        difficulty = self.difficulty.get()
+        size, win_length = self.get_board_config()
+        if size is None:
+            return
         self.cleanup_window()
-        self.initialize_game_window("computer")
+        self.initialize_game_window("computer", difficulty=difficulty,
+                                    size=size, win_length=win_length)
 
-    def initialize_game_window(self, role, ip=None, port=None):
+    def initialize_game_window(self, role, ip=None, port=None, difficulty="perfect",
+                               size=3, win_length=3):
         self.cleanup_window()
         self.root.title(f"Tic Tac Toe - {role.capitalize()} Mode")
 
-        # Create the game board
-        self.create_game_board()
+        # Create the game board (clients resize it once the server's CONFIG arrives)
+        self.create_game_board(size)
 
+        # Only the chosen role's modules are loaded
         if role == "server":
-            self.game_instance = Server(host=ip, port=port)
+            from server import Server
+            from EventHandler import EventHandler
+            self.game_instance = Server(host=ip, port=port, size=size,
+                                        win_length=win_length)
             self.game_instance.set_gui_callback(
                 self.update_gui)  # Set the GUI callback
             self.game_instance.initialize()
@@ -102,6 +161,8 @@ class TicTacToeGUI:
             Thread(target=self.event_handler.receive_packets, daemon=True).start()
 
         elif role == "client":
+            from client import Client
+            from EventHandler import EventHandler
             self.game_instance = Client(host=ip, port=port)
             self.game_instance.set_gui_callback(
                 self.update_gui)  # Set the GUI callback
@@ -111,38 +172,28 @@ class TicTacToeGUI:
             Thread(target=self.event_handler.receive_packets, daemon=True).start()
 
         elif role == "computer":
-            self.game_instance = ComputerPlayer()
+            from ComputerPlayer import ComputerPlayer
+            self.game_instance = ComputerPlayer(difficulty, size, win_length)
             self.game_instance.set_gui_callback(
                 self.update_gui)  # Set the GUI callback
             self.game_instance.initialize()
 
+        # Draw whatever state initialize() produced, then follow the events
+        self.apply_event({"type": "BOARD"})
+        self.apply_event({"type": "TURN",
+                          "player": self.game_instance.current_player})
+
         # Start the game instance logic
         Thread(target=self.game_instance.run_game, daemon=True).start()
 
-        # Start polling for GUI updates
-        self.refresh_gui()
-
-    def create_game_board(self):
+    def create_game_board(self, size=3):
         self.turn_label = tk.Label(
             self.root, text="Waiting for turn...", font=("Arial", 16))
         self.turn_label.pack(pady=10)
 
-        grid_frame = tk.Frame(self.root)
-        grid_frame.pack(pady=20)
-
-        for row in range(3):
-            for col in range(3):
-                index = row * 3 + col
-                button = tk.Button(
-                    grid_frame,
-                    text=" ",
-                    font=("Arial", 24),
-                    width=5,
-                    height=2,
-                    command=lambda i=index: self.make_move(i),
-                )
-                button.grid(row=row, column=col)
-                self.buttons.append(button)
+        self.grid_frame = tk.Frame(self.root)
+        self.grid_frame.pack(pady=20)
+        self.build_grid(size)
 
         self.reset_button = tk.Button(
             self.root,
@@ -156,63 +207,105 @@ class TicTacToeGUI:
         tk.Button(self.root, text="Close", command=self.close_game,
                   font=("Arial", 14)).pack(pady=10)
 
+    def build_grid(self, size):
+        for button in self.buttons:
+            button.destroy()
+        self.buttons = []
+        self.cells = [" "] * (size * size)
+
+        # Shrink the cells so large boards still fit on screen
+        font_size = max(8, 24 * 3 // size)
+        width = max(2, 5 * 3 // size)
+        for row in range(size):
+            for col in range(size):
+                index = row * size + col
+                button = tk.Button(
+                    self.grid_frame,
+                    text=" ",
+                    font=("Arial", font_size),
+                    width=width,
+                    height=1 if size > 3 else 2,
+                    command=lambda i=index: self.make_move(i),
+                )
+                button.grid(row=row, column=col)
+                self.buttons.append(button)
+
     def make_move(self, index):
-        print("Click registered")
+        logger.debug("Click registered")
         if self.game_instance.current_player == self.game_instance.id:  # Check if it's the player's turn
             self.game_instance.play_turn(index)
         else:
             messagebox.showerror("Invalid Move", "It's not your turn!")
 
-    def check_connection(self):
-        if isinstance(self.game_instance, (Server, Client)):
-            return self.game_instance.connection is not None
-        return True  # For computer mode, no connection is used
-
     def handle_disconnection(self):
         messagebox.showerror(
             "Connection Lost", "The connection was closed unexpectedly.")
         self.close_game()  # Gracefully close the game
 
-    def refresh_gui(self):
-        # Check if the connection is still active
-        if not self.check_connection():
-            self.handle_disconnection()
-            return
-
-        # Update the board buttons
-        for i, value in enumerate(self.game_instance.board):
-            self.buttons[i].config(text=value)
-
-        # Update the turn label
-        self.turn_label.config(
-            text=f"It's {self.game_instance.current_player}'s turn!")
-
-        # Enable or disable the reset button based on the game state
-        if not self.game_instance.running:
-            self.reset_button.config(state=tk.NORMAL)
-
-        if self.running:
-            self.root.after(100, self.refresh_gui)  # Schedule the next refresh
-
     def update_gui(self, update):
-        if update["type"] == "END":
-            self.root.after(
-                0, lambda: self.show_endgame_modal(update["result"]))
+        # Called from the game and network threads: queue the event and
+        # wake the Tk loop once for however many events pile up meanwhile
+        self.events.put(update)
+        with self.wakeup_lock:
+            if self.wakeup_pending:
+                return
+            self.wakeup_pending = True
+        try:
+            self.root.event_generate(GAME_EVENT, when="tail")
+        except (RuntimeError, tk.TclError):
+            pass  # Window already closed
+
+    def drain_events(self, _event=None):
+        with self.wakeup_lock:
+            self.wakeup_pending = False
+        while self.running:
+            try:
+                update = self.events.get_nowait()
+            except Empty:
+                return
+            self.apply_event(update)
+
+    def apply_event(self, update):
+        # Redraw only the widgets the event touches
+        kind = update["type"]
+        if kind == "CELL":
+            self.set_cell(update["index"], update["player"])
+        elif kind == "BOARD":
+            board = self.game_instance.board
+            # Rebuild the grid if the server picked a different board size
+            if len(board) != len(self.buttons):
+                self.build_grid(board.size)
+            for i, value in enumerate(board):
+                self.set_cell(i, value)
+        elif kind == "TURN":
+            if update["player"]:
+                self.turn_label.config(text=f"It's {update['player']}'s turn!")
+        elif kind == "END":
             self.reset_button.config(state=tk.NORMAL)
-        elif update["type"] == "RESET":
+            self.show_endgame_modal(update["result"])
+        elif kind == "RESET":
             self.reset_gui()
+        elif kind == "RECONNECTING":
+            self.turn_label.config(text="Connection lost, reconnecting...")
+        elif kind == "DISCONNECTED":
+            self.handle_disconnection()
+
+    def set_cell(self, index, value):
+        if self.cells[index] != value:
+            self.cells[index] = value
+            self.buttons[index].config(text=value)
 
     def show_endgame_modal(self, message):
         messagebox.showinfo("Game Over", message)
 
     def reset_gui(self):
-        for button in self.buttons:
-            button.config(text=" ")  # Clear button text
+        for i in range(len(self.buttons)):
+            self.set_cell(i, " ")  # Clear button text
         self.turn_label.config(text="Waiting for turn...")
         self.reset_button.config(state=tk.DISABLED)  # Disable the reset button
 
     def reset_game(self):
-        if isinstance(self.game_instance, Server) or isinstance(self.game_instance, ComputerPlayer):
+        if self.game_instance.role in ("server", "computer"):
             self.game_instance.reset_game()
         else:
             messagebox.showerror(
@@ -227,7 +320,13 @@ class TicTacToeGUI:
         self.root.destroy()
 
 
-if __name__ == "__main__":
+def main():
     root = tk.Tk()
-    app = TicTacToeGUI(root)
+    TicTacToeGUI(root)
     root.mainloop()
+
+
+if __name__ == "__main__":
+    log.setup()
+    metrics.serve_from_env()
+    main()
@@ -0,0 +1,155 @@
+# Finds peers that went away without closing their connection. A connection
+# idle for idle_timeout seconds is sent a PING; one that still says nothing
+# within ping_timeout is reaped. Deadlines live in one hashed timer wheel
+# per process rather than a thread or a timer per connection, and a packet
+# arriving only stores a timestamp: the wheel looks at it when the deadline
+# comes round and reschedules the connection from there.
+import logging
+import threading
+import time
+from metrics import CONNECTIONS_REAPED
+from packets import PacketType
+
+logger = logging.getLogger(__name__)
+
+IDLE_TIMEOUT = 30.0  # Seconds without a packet before a connection is pinged
+PING_TIMEOUT = 15.0  # Seconds it then has to answer before it is reaped
+TICK = 0.5  # Wheel resolution in seconds
+SLOTS = 512  # Ticks per turn of the wheel
+
+PING = {"type": PacketType.PING.value}
+PONG = {"type": PacketType.PONG.value}
+
+
+class Timer:
+    __slots__ = ("callback", "rounds", "cancelled")
+
+    def __init__(self, callback, rounds):
+        self.callback = callback
+        self.rounds = rounds  # Turns of the wheel left before it fires
+        self.cancelled = False
+
+    def cancel(self):
+        self.cancelled = True  # Dropped when the wheel next reaches it
+
+
+class TimerWheel:
+    # Slot i holds the timers due when the wheel turns to it. Scheduling and
+    # cancelling are O(1); advancing costs one step per tick passed plus the
+    # timers in the slots it visits
+    def __init__(self, tick=TICK, slots=SLOTS, now=0.0):
+        self.tick = tick
+        self.slots = [[] for _ in range(slots)]
+        self.current = 0
+        self.time = now  # When the wheel last turned
+        self.count = 0  # Timers scheduled and not yet fired or dropped
+
+    def schedule(self, delay, callback):
+        # callback(now) runs within one tick after delay seconds
+        ticks = max(1, -int(-delay // self.tick))  # Round up
+        timer = Timer(callback, (ticks - 1) // len(self.slots))
+        self.slots[(self.current + ticks) % len(self.slots)].append(timer)
+        self.count += 1
+        return timer
+
+    def advance(self, now):
+        while self.time + self.tick <= now:
+            self.time += self.tick
+            self.current = (self.current + 1) % len(self.slots)
+            slot = self.slots[self.current]
+            if not slot:
+                continue
+            due = []
+            waiting = []
+            for timer in slot:
+                if timer.cancelled:
+                    self.count -= 1
+                elif timer.rounds:
+                    timer.rounds -= 1
+                    waiting.append(timer)
+                else:
+                    self.count -= 1
+                    due.append(timer)
+            self.slots[self.current] = waiting
+            for timer in due:
+                try:
+                    timer.callback(now)
+                except Exception as e:
+                    logger.error("Timer callback failed: %s", e)
+
+
+class IdleReaper:
+    # Watches connections with a last_seen time (updated on every packet),
+    # a ping() method and a reap() method
+    def __init__(self, idle_timeout=IDLE_TIMEOUT, ping_timeout=PING_TIMEOUT,
+                 now=0.0, tick=TICK):
+        self.idle_timeout = idle_timeout
+        self.ping_timeout = ping_timeout
+        self.wheel = TimerWheel(tick, now=now)
+        self.lock = threading.RLock()  # Callers may be on other threads
+        self.timers = {}  # Connection -> its pending Timer
+        self.pinged = {}  # Connection -> when it was pinged
+        self.reaped = 0
+
+    def __len__(self):
+        return len(self.timers)
+
+    def watch(self, connection):
+        with self.lock:
+            self.schedule(connection, self.idle_timeout)
+
+    def unwatch(self, connection):
+        with self.lock:
+            timer = self.timers.pop(connection, None)
+            if timer is not None:
+                timer.cancel()
+            self.pinged.pop(connection, None)
+
+    def schedule(self, connection, delay):
+        self.timers[connection] = self.wheel.schedule(
+            delay, lambda now: self.check(connection, now))
+
+    def advance(self, now):
+        with self.lock:
+            self.wheel.advance(now)
+
+    def check(self, connection, now):
+        pinged = self.pinged.pop(connection, None)
+        if pinged is not None and connection.last_seen < pinged:
+            # Silent since the PING: the peer is gone
+            del self.timers[connection]
+            self.reaped += 1
+            CONNECTIONS_REAPED.inc()
+            connection.reap()
+            return
+        idle = now - connection.last_seen
+        if idle < self.idle_timeout:
+            self.schedule(connection, self.idle_timeout - idle)
+            return
+        self.pinged[connection] = now
+        self.schedule(connection, self.ping_timeout)
+        connection.ping()
+
+
+_reaper = None  # Shared by the threaded connections in this process
+_reaper_lock = threading.Lock()
+
+
+def threaded_reaper(idle_timeout=IDLE_TIMEOUT, ping_timeout=PING_TIMEOUT):
+    # The process's IdleReaper for blocking-socket connections, advanced by
+    # one daemon thread however many connections it watches
+    global _reaper
+    with _reaper_lock:
+        if _reaper is None:
+            _reaper = IdleReaper(idle_timeout, ping_timeout, time.monotonic())
+            threading.Thread(target=_run_reaper, args=(_reaper,),
+                             daemon=True).start()
+        _reaper.idle_timeout = idle_timeout
+        _reaper.ping_timeout = ping_timeout
+        return _reaper
+
+
+def _run_reaper(reaper):
+    while True:
+        time.sleep(reaper.wheel.tick)
+        reaper.advance(time.monotonic())
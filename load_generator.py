@@ -0,0 +1,329 @@
+# Plays many simultaneous matches against an async_server instance and
+# reports connection, throughput, latency and error figures.
+# Usage: python load_generator.py --matches 5000 --concurrency 2000
+#        python load_generator.py --local --seed 1 --max-p99-ms 50  (CI)
+#        for seed in 1 2 3 4 5; do
+#            python load_generator.py --local --seed $seed --matches 50 \
+#                --concurrency 10 --timeout 3 --max-errors 0 || exit 1
+#        done  (stability check: a bot left unpaired shows up as a timeout)
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+from collections import Counter
+from packets import PacketType
+from codec import JSON, FrameDecoder, encode_packet, hello_packet
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+
+# Error kinds
+CONNECT = "connect"  # Refused or failed to connect
+DROPPED = "dropped"  # Server closed the connection before the match ended
+TIMEOUT = "timeout"  # Match took longer than --timeout
+
+
+class Bot(asyncio.Protocol):
+    # Speaks the Client protocol and plays random legal moves
+    def __init__(self, stats, done, codec=JSON, delta=False, rating=None,
+                 think_time=0.0):
+        self.stats = stats
+        self.done = done
+        self.offer_codec = codec
+        self.offer_delta = delta
+        self.rating = rating
+        self.think_time = think_time  # Mean seconds to wait before moving
+        self.codec = JSON
+        self.transport = None
+        self.decoder = FrameDecoder()
+        self.id = None
+        self.board = [" "] * 9
+        self.move_sent = None
+        self.thinking = None
+
+    def connection_made(self, transport):
+        self.transport = transport
+        self.stats.connected()
+        # Always say HELLO: the lobby otherwise waits a moment in case the
+        # first packet is a RESUME
+        self.send(hello_packet([self.offer_codec, JSON],
+                               ["delta"] if self.offer_delta else [],
+                               self.rating))
+
+    def data_received(self, data):
+        for packet in self.decoder.feed(data):
+            self.process_packet(packet)
+
+    def send(self, packet):
+        self.transport.write(encode_packet(packet, self.codec))
+
+    def process_packet(self, packet):
+        packet_type = packet.get("type")
+
+        if packet_type == PacketType.HELLO.value:
+            self.codec = packet.get("codec", JSON)
+
+        elif packet_type == PacketType.WELCOME.value:
+            self.id = packet.get("player")
+
+        elif packet_type == PacketType.CONFIG.value:
+            self.board = [" "] * (packet.get("size") ** 2)
+
+        elif packet_type == PacketType.GAME_STATE.value:
+            self.board = packet.get("board")
+            self.move_acknowledged()
+
+        elif packet_type == PacketType.DELTA.value:
+            self.board[packet.get("cell")] = packet.get("player")
+            self.move_acknowledged()
+            if packet.get("result"):
+                self.finish()
+            elif packet.get("next") == self.id:
+                self.play_turn()
+
+        elif packet_type == PacketType.PLAYER_TURN.value:
+            if packet.get("player") == self.id:
+                self.play_turn()
+
+        elif packet_type == PacketType.GAME_WIN.value:
+            self.finish()
+
+        elif packet_type == PacketType.PING.value:
+            self.send({"type": PacketType.PONG.value})
+
+    def move_acknowledged(self):
+        if self.move_sent is not None:
+            self.stats.latencies.append(time.perf_counter() - self.move_sent)
+            self.move_sent = None
+
+    def play_turn(self):
+        if self.think_time:
+            # Spread around the mean so bots don't move in lockstep
+            delay = random.uniform(0.5, 1.5) * self.think_time
+            self.thinking = asyncio.get_running_loop().call_later(
+                delay, self.send_move)
+        else:
+            self.send_move()
+
+    def send_move(self):
+        self.thinking = None
+        if self.transport.is_closing():
+            return
+        free = [i for i, cell in enumerate(self.board) if cell == " "]
+        move = random.choice(free)
+        self.move_sent = time.perf_counter()
+        self.stats.moves += 1
+        self.send({"type": PacketType.MOVE.value, "player": self.id,
+                   "move": move})
+
+    def finish(self):
+        if not self.done.done():
+            self.done.set_result(True)
+            self.transport.close()
+
+    def abort(self):
+        if self.thinking:
+            self.thinking.cancel()
+        if self.transport:
+            self.transport.abort()
+
+    def connection_lost(self, exc):
+        self.stats.disconnected()
+        if self.thinking:
+            self.thinking.cancel()
+        if not self.done.done():
+            self.stats.errors[DROPPED] += 1
+            self.done.set_result(False)
+
+
+class Stats:
+    def __init__(self):
+        self.latencies = []
+        self.moves = 0
+        self.errors = Counter()
+        self.matches = 0
+        self.connections = 0  # Established over the whole run
+        self.open = 0
+        self.peak_open = 0
+
+    def connected(self):
+        self.connections += 1
+        self.open += 1
+        self.peak_open = max(self.peak_open, self.open)
+
+    def disconnected(self):
+        self.open -= 1
+
+    def report(self, matches, elapsed):
+        return {"matches": self.matches, "matches_requested": matches,
+                "elapsed": elapsed,
+                "matches_per_sec": self.matches / elapsed,
+                "connections": self.connections,
+                "peak_connections": self.peak_open,
+                "moves": self.moves, "moves_per_sec": self.moves / elapsed,
+                "latency_p50_ms": percentile(self.latencies, 0.5) * 1e3,
+                "latency_p95_ms": percentile(self.latencies, 0.95) * 1e3,
+                "latency_p99_ms": percentile(self.latencies, 0.99) * 1e3,
+                "latency_max_ms": max(self.latencies, default=0.0) * 1e3,
+                "errors": sum(self.errors.values()),
+                "errors_by_kind": dict(self.errors)}
+
+
+async def play_match(host, port, stats, codec, delta, rated, think_time,
+                     timeout):
+    loop = asyncio.get_running_loop()
+    finished = []
+    bots = []
+    for _ in range(2):
+        done = loop.create_future()
+        rating = round(random.gauss(1500, 300)) if rated else None
+        bot = Bot(stats, done, codec, delta, rating, think_time)
+        try:
+            await loop.create_connection(lambda: bot, host, port)
+        except OSError:
+            stats.errors[CONNECT] += 1
+            done.set_result(False)
+        finished.append(done)
+        bots.append(bot)
+    try:
+        results = await asyncio.wait_for(asyncio.gather(*finished), timeout)
+    except asyncio.TimeoutError:
+        stats.errors[TIMEOUT] += 1
+        for bot in bots:
+            bot.abort()
+        return
+    if all(results):
+        stats.matches += 1
+
+
+async def run(host, port, matches, concurrency, codec=JSON, delta=False,
+              rated=False, think_time=0.0, timeout=None):
+    stats = Stats()
+    limit = asyncio.Semaphore(concurrency)
+
+    async def limited():
+        async with limit:
+            await play_match(host, port, stats, codec, delta, rated,
+                             think_time, timeout)
+
+    start = time.perf_counter()
+    await asyncio.gather(*(limited() for _ in range(matches)))
+    return stats, time.perf_counter() - start
+
+
+def percentile(values, fraction):
+    if not values:
+        return 0.0
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * fraction))]
+
+
+def free_port(host):
+    with socket.socket() as sock:
+        sock.bind((host, 0))
+        return sock.getsockname()[1]
+
+
+def start_local_server(host, args):
+    # A fresh async_server on loopback, so a CI run needs nothing else
+    port = free_port(host)
+    # Readiness is probed on the spectator port: a probe on the player port
+    # would sit in the lobby and get paired with a bot. The spectator
+    # listener only opens once the player one is up
+    probe_port = free_port(host)
+    command = [sys.executable, os.path.join(HERE, "async_server.py"),
+               "--host", host, "--port", str(port), "--log-level", "WARNING",
+               "--spectator-port", str(probe_port)]
+    if args.rated:
+        command += ["--match", "rating"]
+    server = subprocess.Popen(command, stdout=subprocess.DEVNULL)
+    deadline = time.monotonic() + 10
+    while time.monotonic() < deadline:
+        try:
+            socket.create_connection((host, probe_port), timeout=0.1).close()
+            return server, port
+        except OSError:
+            if server.poll() is not None:
+                break
+            time.sleep(0.05)
+    server.kill()
+    raise RuntimeError("Local server did not start")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Match load generator")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--matches", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=500,
+                        help="Matches in flight at the same time")
+    parser.add_argument("--codec", default=JSON,
+                        help="Wire format to negotiate (json or binary/1)")
+    parser.add_argument("--delta", action="store_true",
+                        help="Ask for DELTA updates instead of full boards")
+    parser.add_argument("--rated", action="store_true",
+                        help="Send random ratings for a --match rating server")
+    parser.add_argument("--think-time", type=float, default=0.0,
+                        help="Mean seconds a bot waits before each move")
+    parser.add_argument("--timeout", type=float, default=60.0,
+                        help="Give up on a match after N seconds")
+    parser.add_argument("--seed", type=int, default=None,
+                        help="Seed the bots' moves and ratings")
+    parser.add_argument("--local", action="store_true",
+                        help="Start a server on a free 127.0.0.1 port and "
+                             "stop it afterwards")
+    parser.add_argument("--json", action="store_true",
+                        help="Print the report as one JSON object")
+    parser.add_argument("--max-p99-ms", type=float, default=None,
+                        help="Exit non-zero if p99 latency is above this")
+    parser.add_argument("--max-errors", type=int, default=None,
+                        help="Exit non-zero if there are more errors")
+    args = parser.parse_args()
+
+    if args.seed is not None:
+        random.seed(args.seed)
+    host, port, server = args.host, args.port, None
+    if args.local:
+        host = "127.0.0.1"
+        server, port = start_local_server(host, args)
+    try:
+        stats, elapsed = asyncio.run(run(
+            host, port, args.matches, args.concurrency, args.codec,
+            args.delta, args.rated, args.think_time, args.timeout))
+    finally:
+        if server:
+            server.terminate()
+            server.wait()
+    report = stats.report(args.matches, elapsed)
+
+    if args.json:
+        print(json.dumps(report))
+    else:
+        print(f"Matches completed: {stats.matches}/{args.matches} "
+              f"in {elapsed:.2f}s ({report['matches_per_sec']:.1f} "
+              f"matches/sec)")
+        print(f"Connections: {stats.connections} established, "
+              f"{stats.peak_open} peak open")
+        print(f"Moves: {stats.moves} ({report['moves_per_sec']:.1f}/sec)  "
+              f"errors: {report['errors']}"
+              + "".join(f" {kind}={n}" for kind, n in stats.errors.items()))
+        print(f"Move round-trip p50 {report['latency_p50_ms']:.2f}ms"
+              f"  p95 {report['latency_p95_ms']:.2f}ms"
+              f"  p99 {report['latency_p99_ms']:.2f}ms")
+
+    failed = []
+    if args.max_p99_ms is not None and report["latency_p99_ms"] > args.max_p99_ms:
+        failed.append(f"p99 {report['latency_p99_ms']:.2f}ms over "
+                      f"{args.max_p99_ms}ms")
+    if args.max_errors is not None and report["errors"] > args.max_errors:
+        failed.append(f"{report['errors']} errors over {args.max_errors}")
+    if failed:
+        sys.exit("Load test failed: " + "; ".join(failed))
+
+
+if __name__ == "__main__":
+    main()
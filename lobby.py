@@ -0,0 +1,143 @@
+import time
+from bisect import bisect_left, insort
+from collections import OrderedDict, deque
+
+FIFO = "fifo"
+RATING = "rating"
+MATCH_MODES = [FIFO, RATING]
+
+DEFAULT_RATING = 1500
+RATING_WINDOW = 200  # Largest rating gap paired straight away
+BUCKET_WIDTH = 50  # Ratings per index bucket
+MAX_WAIT = 5.0  # Seconds before a player takes the nearest rating on offer
+WAIT_SAMPLES = 10000  # Recent time-to-match samples kept for stats
+
+
+class Lobby:
+    # Players waiting for an opponent. Every operation touches a constant
+    # number of entries (plus a bisect over the non-empty rating buckets),
+    # so pairing stays flat however many players are queued
+    def __init__(self, mode=FIFO, rating_window=RATING_WINDOW,
+                 bucket_width=BUCKET_WIDTH, max_wait=MAX_WAIT,
+                 clock=time.monotonic):
+        if mode not in MATCH_MODES:
+            raise ValueError(f"Unknown match mode {mode!r}")
+        self.mode = mode
+        self.rating_window = rating_window
+        self.bucket_width = bucket_width
+        self.max_wait = max_wait
+        self.clock = clock
+        self.queue = OrderedDict()  # Player -> (rating, enqueued), oldest first
+        self.buckets = {}  # Rating bucket -> OrderedDict of its players
+        self.keys = []  # Sorted non-empty bucket numbers
+        self.waits = deque(maxlen=WAIT_SAMPLES)
+        self.matches = 0
+
+    def __len__(self):
+        return len(self.queue)
+
+    def __contains__(self, player):
+        return player in self.queue
+
+    def enqueue(self, player, rating=None, now=None):
+        # Returns (first, second) if the player was paired right away,
+        # the longer waiting player first
+        now = self.clock() if now is None else now
+        rating = DEFAULT_RATING if rating is None else rating
+        if self.mode == FIFO:
+            if self.queue:
+                opponent, (_, enqueued) = self.queue.popitem(last=False)
+                return self.pair(opponent, enqueued, player, now, now)
+            self.queue[player] = (rating, now)
+            return None
+
+        limit = max(0, self.rating_window // self.bucket_width - 1)
+        opponent = self.nearest(rating, limit)
+        if opponent is not None:
+            _, enqueued = self.remove(opponent)
+            return self.pair(opponent, enqueued, player, now, now)
+        self.queue[player] = (rating, now)
+        bucket = self.bucket(rating)
+        if bucket not in self.buckets:
+            self.buckets[bucket] = OrderedDict()
+            insort(self.keys, bucket)
+        self.buckets[bucket][player] = now
+        return None
+
+    def remove(self, player):
+        # Returns the player's (rating, enqueued), or None if not waiting
+        entry = self.queue.pop(player, None)
+        if entry is None:
+            return None
+        if self.mode == RATING:
+            bucket = self.bucket(entry[0])
+            players = self.buckets[bucket]
+            del players[player]
+            if not players:
+                del self.buckets[bucket]
+                del self.keys[bisect_left(self.keys, bucket)]
+        return entry
+
+    def expire(self, now=None):
+        # Players who waited too long get the closest rating there is
+        now = self.clock() if now is None else now
+        pairs = []
+        while self.mode == RATING and len(self.queue) > 1:
+            player, (rating, enqueued) = next(iter(self.queue.items()))
+            if now - enqueued < self.max_wait:
+                break
+            self.remove(player)
+            opponent = self.nearest(rating)
+            _, opponent_enqueued = self.remove(opponent)
+            pairs.append(self.pair(player, enqueued, opponent,
+                                   opponent_enqueued, now))
+        return pairs
+
+    def stale(self, age, now=None):
+        # Players that have waited at least age seconds, oldest first
+        now = self.clock() if now is None else now
+        players = []
+        for player, (_, enqueued) in self.queue.items():
+            if now - enqueued < age:
+                break
+            players.append(player)
+        return players
+
+    def bucket(self, rating):
+        return int(rating) // self.bucket_width
+
+    def nearest(self, rating, limit=None):
+        # Oldest player of the closest non-empty bucket, within limit buckets
+        bucket = self.bucket(rating)
+        index = bisect_left(self.keys, bucket)
+        best = None
+        for i in (index, index - 1):
+            if 0 <= i < len(self.keys):
+                distance = abs(self.keys[i] - bucket)
+                if limit is not None and distance > limit:
+                    continue
+                players = self.buckets[self.keys[i]]
+                player, enqueued = next(iter(players.items()))
+                if best is None or (distance, enqueued) < best[:2]:
+                    best = (distance, enqueued, player)
+        return best[2] if best else None
+
+    def pair(self, first, first_enqueued, second, second_enqueued, now):
+        self.waits.append(now - first_enqueued)
+        self.waits.append(now - second_enqueued)
+        self.matches += 1
+        return first, second
+
+    def stats(self):
+        waits = sorted(self.waits)
+        return {"queue_depth": len(self.queue),
+                "matches_made": self.matches,
+                "match_wait_p50": _percentile(waits, 0.5),
+                "match_wait_p99": _percentile(waits, 0.99),
+                "match_wait_max": waits[-1] if waits else 0.0}
+
+
+def _percentile(ordered, fraction):
+    if not ordered:
+        return 0.0
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
@@ -0,0 +1,13 @@
+import logging
+import os
+import sys
+
+LEVEL_ENV = "TTT_LOG_LEVEL"  # Overrides the default level, e.g. DEBUG
+
+
+def setup(level=None):
+    # Plain messages on stdout, like the prints they replaced. Per-move
+    # chatter is DEBUG, so servers under load skip formatting it
+    level = level or os.environ.get(LEVEL_ENV) or "INFO"
+    logging.basicConfig(stream=sys.stdout, format="%(message)s",
+                        level=level.upper())
@@ -1,27 +1,103 @@
+# Headless entry point. Each role imports only the modules it runs on, so
+# short-lived processes don't pay for the others (or for tkinter).
+# Usage: python main.py server --port 12345 --size 4 --win-length 3
+#        python main.py client --host example.com --port 12345
+#        python main.py computer --difficulty heuristic
+#        python main.py multi --port 12345
+#        python main.py gui
+import argparse
 from threading import Thread
-from server import Server
-from client import Client
-from ComputerPlayer import ComputerPlayer
-from EventHandler import EventHandler
+import log
+import metrics
+from heartbeat import IDLE_TIMEOUT
 
+ROLES = ["server", "client", "computer", "multi", "gui"]
+# solver.DIFFICULTIES, spelled out: importing the solver costs ~30ms
+DIFFICULTIES = ["random", "heuristic", "perfect"]
+LOGGED_ROLES = ["server", "multi"]  # The roles that can keep a move log
 
-def main():
-    try:
-        role = input("Enter role (server/client/computer): ").strip().lower()
-        game_instance = None
-        event_handler = None
-        game_thread = None
-        event_handler_thread = None
 
+def load(role):
+    # What runs the role: a class taking the instance's arguments, or the
+    # function that serves it
+    if role == "server":
+        from server import Server
+        return Server
+    if role == "client":
+        from client import Client
+        return Client
+    if role == "computer":
+        from ComputerPlayer import ComputerPlayer
+        return ComputerPlayer
+    if role == "multi":
+        # Host many matches on one asyncio loop instead of one peer
+        from async_server import run
+        return run
+    if role == "gui":
+        from gui import main
+        return main
+    raise ValueError(f"Unknown role: {role}")
+
+
+def parse_args(argv=None):
+    parser = argparse.ArgumentParser(description="Tic Tac Toe")
+    parser.add_argument("role", choices=ROLES)
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=None,
+                        help="Stones in a row to win (default: the size)")
+    parser.add_argument("--difficulty", choices=DIFFICULTIES,
+                        default="perfect", help="Computer player strength")
+    parser.add_argument("--log", metavar="FILE", default=None,
+                        help="Server and multi: move log file to resume "
+                             "from")
+    parser.add_argument("--idle-timeout", type=float, default=IDLE_TIMEOUT,
+                        help="PING a peer silent for this many seconds, "
+                             "drop it if it doesn't answer (0 never does)")
+    parser.add_argument("--log-level", default=None,
+                        help="DEBUG, INFO, WARNING or ERROR (default INFO)")
+    args = parser.parse_args(argv)
+    if args.log and args.role not in LOGGED_ROLES:
+        parser.error(f"--log doesn't apply to the {args.role} role")
+    if args.win_length is None:
+        args.win_length = args.size
+    return args
+
+
+def main(argv=None):
+    args = parse_args(argv)
+    log.setup(args.log_level)
+    metrics.serve_from_env()
+    role = args.role
+    run = load(role)
+    if role == "multi":
+        run(args.host, args.port, args.size, args.win_length,
+            log_path=args.log, idle_timeout=args.idle_timeout)
+        return
+    if role == "gui":
+        run()
+        return
+
+    game_instance = None
+    event_handler = None
+    game_thread = None
+    event_handler_thread = None
+    try:
         if role == "server":
-            game_instance = Server()
+            game_instance = run(args.host, args.port, args.size,
+                                args.win_length, log_path=args.log)
         elif role == "client":
-            game_instance = Client()
-        elif role == "computer":
-            game_instance = ComputerPlayer()
+            game_instance = run(args.host, args.port)
         else:
-            print("Invalid role.")
-            return
+            try:
+                game_instance = run(args.difficulty, args.size,
+                                    args.win_length)
+            except ValueError as e:
+                print(e)
+                return
+
+        game_instance.idle_timeout = args.idle_timeout
 
         # Initialize and start the game instance
         game_instance.initialize()
@@ -30,6 +106,7 @@ def main():
 
         if role != "computer":
             # Create and start the event handler for server or client mode
+            from EventHandler import EventHandler
             event_handler = EventHandler(
                 game_instance.connection, game_instance)
             event_handler_thread = Thread(target=event_handler.receive_packets)
@@ -37,19 +114,19 @@ def main():
 
         print("Game started. Main thread can later initialize GUI.")
 
-        while True:
-            pass
+        # Sleep until the game loop exits instead of spinning
+        game_thread.join()
 
     except KeyboardInterrupt:
         print("\nCtrl-C detected! Stopping all threads...")
 
         # Stop the game instance
         if game_instance:
-            game_instance.running = False
+            game_instance.stop()
 
         # Stop the event handler if it's running
         if event_handler:
-            event_handler.running = False
+            event_handler.stop()
 
         # Wait for threads to finish
         if game_thread:
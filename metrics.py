@@ -0,0 +1,198 @@
+# Process-wide counters, gauges and histograms, exported in the Prometheus
+# text format over HTTP or to a file.
+# Usage: metrics.serve(9100), then curl localhost:9100/metrics
+import os
+import threading
+import time
+from bisect import bisect_left
+
+PORT_ENV = "TTT_METRICS_PORT"  # Serve metrics from main.py/gui.py when set
+
+# Seconds; covers a cached move lookup up to a slow network write
+LATENCY_BUCKETS = (0.00001, 0.00005, 0.0001, 0.0005, 0.001, 0.005, 0.01,
+                   0.05, 0.1, 0.5, 1.0, 5.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+
+def escape(value):
+    # Label values are quoted in the exposition format
+    return (str(value).replace("\\", "\\\\").replace('"', '\\"')
+            .replace("\n", "\\n"))
+
+
+class Metric:
+    kind = None
+
+    def __init__(self, name, help, label=None):
+        self.name = name
+        self.help = help
+        self.label = label  # Name of the one optional label, e.g. "type"
+        self.lock = threading.Lock()
+
+    def header(self):
+        return [f"# HELP {self.name} {self.help}",
+                f"# TYPE {self.name} {self.kind}"]
+
+    def labels(self, value, extra=""):
+        pairs = []
+        if self.label and value is not None:
+            pairs.append(f'{self.label}="{escape(value)}"')
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def __init__(self, name, help, label=None):
+        super().__init__(name, help, label)
+        self.values = {}
+
+    def inc(self, label=None, amount=1):
+        with self.lock:
+            self.values[label] = self.values.get(label, 0) + amount
+
+    def render(self):
+        with self.lock:
+            values = sorted(self.values.items(), key=lambda item: str(item[0]))
+        return self.header() + [f"{self.name}{self.labels(label)} {value}"
+                                for label, value in values]
+
+
+class Gauge(Counter):
+    kind = "gauge"
+
+    def set(self, value, label=None):
+        with self.lock:  # render() may be iterating the values
+            self.values[label] = value
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help, label=None, buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, label)
+        self.buckets = buckets
+        self.series = {}  # Label -> [bucket counts..., +Inf count, sum]
+
+    def observe(self, value, label=None):
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            series = self.series.get(label)
+            if series is None:
+                series = self.series[label] = [0] * (len(self.buckets) + 2)
+            series[index] += 1
+            series[-1] += value
+
+    def time(self, label=None):
+        return Timer(self, label)
+
+    def render(self):
+        lines = self.header()
+        with self.lock:
+            series = sorted(((label, list(values)) for label, values
+                             in self.series.items()),
+                            key=lambda item: str(item[0]))
+        for label, values in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + ("+Inf",), values):
+                cumulative += count
+                le = f'le="{bound}"'
+                lines.append(f"{self.name}_bucket{self.labels(label, le)} "
+                             f"{cumulative}")
+            lines.append(f"{self.name}_sum{self.labels(label)} {values[-1]}")
+            lines.append(f"{self.name}_count{self.labels(label)} {cumulative}")
+        return lines
+
+
+class Timer:
+    # with HISTOGRAM.time(label): ... observes the block's duration
+    __slots__ = ("histogram", "label", "start")
+
+    def __init__(self, histogram, label):
+        self.histogram = histogram
+        self.label = label
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.histogram.observe(time.perf_counter() - self.start, self.label)
+
+
+REGISTRY = []
+
+
+def register(metric):
+    REGISTRY.append(metric)
+    return metric
+
+
+PACKETS_RECEIVED = register(Counter(
+    "ttt_packets_received_total", "Packets decoded from peers", "type"))
+PACKETS_REJECTED = register(Counter(
+    "ttt_packets_rejected_total",
+    "Packets dropped before reaching the game logic", "reason"))
+PACKETS_SENT = register(Counter(
+    "ttt_packets_sent_total", "Packets encoded for peers", "type"))
+CONNECTIONS_REAPED = register(Counter(
+    "ttt_connections_reaped_total",
+    "Connections dropped for not answering a PING"))
+QUEUE_DEPTH = register(Gauge(
+    "ttt_packet_queue_depth", "Packets waiting for the dispatch thread"))
+PROCESS_SECONDS = register(Histogram(
+    "ttt_process_packet_seconds", "Time spent in process_packet", "type"))
+SEND_SECONDS = register(Histogram(
+    "ttt_send_seconds", "Time from queueing a write until the socket took it"))
+AI_MOVE_SECONDS = register(Histogram(
+    "ttt_ai_move_seconds", "Time the computer player spent choosing a move",
+    "difficulty"))
+
+
+def render():
+    lines = []
+    for metric in REGISTRY:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+def dump(path):
+    # Write then rename, so a scraper never reads half a file
+    temporary = f"{path}.tmp"
+    with open(temporary, "w") as f:
+        f.write(render())
+    os.replace(temporary, path)
+
+
+def serve(port, host="127.0.0.1"):
+    # Serves /metrics from a daemon thread; returns the HTTP server.
+    # http.server is imported here: it costs more than the rest of startup
+    from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+    class MetricsHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            if self.path not in ("/", "/metrics"):
+                self.send_error(404)
+                return
+            body = render().encode()
+            self.send_response(200)
+            self.send_header("Content-Type", CONTENT_TYPE)
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass  # Scrapes would flood the game log
+
+    server = ThreadingHTTPServer((host, port), MetricsHandler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def serve_from_env():
+    port = os.environ.get(PORT_ENV)
+    return serve(int(port)) if port else None
@@ -0,0 +1,192 @@
+# Append-only log of accepted moves so a restarted server can rebuild the
+# matches that were in flight. Fixed-size little-endian records after a
+# small header; recovery maps the file and walks it with struct.iter_unpack.
+import mmap
+import os
+import struct
+import sys
+import threading
+from array import array
+from itertools import compress
+from bitboard import BitBoard
+
+MAGIC = b"TTTL"
+VERSION = 1
+HEADER = struct.Struct("<4sBBB")  # Magic, version, size, win length
+RECORD = struct.Struct("<IHBB")  # Room, cell, kind, player
+
+# Record kinds
+TURN = 0  # Player to move first
+MOVE = 1
+RESET = 2
+END = 3  # Match over; nothing left to recover
+
+SYNC_INTERVAL = 0.05  # Longest time an accepted move waits for fsync
+SYNC_RECORDS = 4096  # Sync early once this many records are pending
+
+NOBODY = ord("-")
+
+
+class MatchState:
+    __slots__ = ("x", "o", "current_player", "moves")
+
+    def __init__(self):
+        self.x = 0
+        self.o = 0
+        self.current_player = None
+        self.moves = 0
+
+    def board(self, size, win_length):
+        return BitBoard(size, win_length, self.x, self.o)
+
+
+class MoveLog:
+    # Appends are buffered in memory; a writer thread writes and fsyncs them
+    # in groups, so the game loop never waits on the disk
+    def __init__(self, path, size=3, win_length=3, sync_interval=SYNC_INTERVAL,
+                 sync_records=SYNC_RECORDS):
+        self.path = path
+        self.size = size
+        self.win_length = win_length
+        self.sync_interval = sync_interval
+        self.sync_records = sync_records
+        self.pending = bytearray()
+        self.condition = threading.Condition()
+        self.running = True
+        self.fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_APPEND, 0o644)
+        length = os.fstat(self.fd).st_size
+        if length == 0:
+            os.write(self.fd, HEADER.pack(MAGIC, VERSION, size, win_length))
+            os.fsync(self.fd)
+        else:
+            check_header(path, size, win_length)
+            torn = (length - HEADER.size) % RECORD.size
+            if torn:
+                # A crash cut the last record short; drop the fragment
+                os.truncate(path, length - torn)
+        self.thread = threading.Thread(target=self.sync_loop, daemon=True)
+        self.thread.start()
+
+    def append(self, kind, room, cell=0, player=None):
+        with self.condition:
+            if not self.running:
+                return
+            self.pending += RECORD.pack(room, cell, kind,
+                                        ord(player) if player else NOBODY)
+            if len(self.pending) >= self.sync_records * RECORD.size:
+                self.condition.notify()
+
+    def sync_loop(self):
+        while True:
+            with self.condition:
+                self.condition.wait_for(
+                    lambda: not self.running
+                    or len(self.pending) >= self.sync_records * RECORD.size,
+                    timeout=self.sync_interval)
+                data, self.pending = self.pending, bytearray()
+                running = self.running
+            if data:
+                os.write(self.fd, data)
+                os.fsync(self.fd)
+            if not running:
+                return
+
+    def close(self):
+        with self.condition:
+            if not self.running:
+                return
+            self.running = False
+            self.condition.notify()
+        self.thread.join()
+        os.close(self.fd)
+
+
+def check_header(path, size, win_length):
+    with open(path, "rb") as f:
+        magic, version, log_size, log_win_length = HEADER.unpack(
+            f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} move log")
+    if (log_size, log_win_length) != (size, win_length):
+        raise ValueError(f"{path} holds {log_size}x{log_size} games with "
+                         f"{log_win_length} in a row, not {size}x{size} "
+                         f"with {win_length}")
+
+
+def recover(path):
+    # Returns (size, win_length, {room: MatchState}) for unfinished matches
+    with open(path, "rb") as f:
+        length = os.fstat(f.fileno()).st_size
+        if length < HEADER.size:
+            return None, None, {}
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            magic, version, size, win_length = HEADER.unpack_from(mapped)
+            if magic != MAGIC or version != VERSION:
+                raise ValueError(f"{path} is not a version {VERSION} move log")
+            end = length - (length - HEADER.size) % RECORD.size
+            view = memoryview(mapped)[HEADER.size:end]
+            try:
+                rooms = replay(view)
+            finally:
+                view.release()
+    return size, win_length, rooms
+
+
+def next_room(path):
+    # First room id the log hasn't used, so ids never repeat across restarts
+    with open(path, "rb") as f:
+        length = os.fstat(f.fileno()).st_size
+        end = length - (length - HEADER.size) % RECORD.size
+        if end <= HEADER.size:
+            return 0
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            words = array("I")
+            words.frombytes(mapped[HEADER.size:end])
+    if sys.byteorder == "big":
+        words.byteswap()
+    return max(words[0::2]) + 1
+
+
+def replay(view):
+    # Most of a long log belongs to matches that have since ended. Find each
+    # room's last record with C-level slicing and dict building, then walk
+    # only the tail that holds the matches still in flight
+    words = array("I")
+    words.frombytes(view)
+    if sys.byteorder == "big":
+        words.byteswap()
+    rooms = words[0::2]
+    kinds = bytes(view[6::RECORD.size])
+    last_kind = dict(zip(rooms, kinds))
+    live = {room for room, kind in last_kind.items() if kind != END}
+
+    # Back up to the oldest TURN/RESET that started a live match
+    waiting = set(live)
+    start = len(rooms)
+    while waiting and start > 0:
+        start -= 1
+        if kinds[start] != MOVE and rooms[start] in waiting:
+            waiting.discard(rooms[start])
+
+    states = {}
+    x = ord("X")
+    tail = view[start * RECORD.size:]
+    for room, cell, kind, player in compress(RECORD.iter_unpack(tail),
+                                             map(live.__contains__,
+                                                 rooms[start:])):
+        if kind == MOVE:
+            state = states[room]
+            if player == x:
+                state.x |= 1 << cell
+                state.current_player = "O"
+            else:
+                state.o |= 1 << cell
+                state.current_player = "X"
+            state.moves += 1
+        elif kind == TURN:
+            state = states.setdefault(room, MatchState())
+            state.current_player = chr(player)
+        else:  # RESET, or an END the room has since moved past
+            states[room] = MatchState()
+    tail.release()
+    return states
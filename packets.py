@@ -0,0 +1,20 @@
+from enum import Enum
+
+
+class PacketType(Enum):
+    PLAYER_TURN = "PLAYER_TURN"
+    GAME_STATE = "GAME_STATE"
+    GAME_WIN = "GAME_WIN"
+    ACKNOWLEDGE = "ACKNOWLEDGE"
+    MOVE = "MOVE"
+    RESET = "RESET"  # New reset packet type
+    WELCOME = "WELCOME"  # Room assignment from a multi-match server
+    CONFIG = "CONFIG"  # Board size and win length chosen by the server
+    HELLO = "HELLO"  # Codec negotiation at connect time
+    DELTA = "DELTA"  # One changed cell, next player and optional result
+    SNAPSHOT = "SNAPSHOT"  # Full board with sequence number for resync
+    SYNC = "SYNC"  # Request for a SNAPSHOT after a missed DELTA
+    RESUME = "RESUME"  # Session token and last packet seen, on (re)connect
+    WATCH = "WATCH"  # Spectator asks for a room; the reply names the room
+    PING = "PING"  # Are you still there? Sent to an idle peer
+    PONG = "PONG"  # Answer to a PING
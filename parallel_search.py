@@ -0,0 +1,167 @@
+# Runs TimedSearch in a process pool, so the AI can use every core and the
+# game thread never waits on it. The root moves are dealt out between the
+# workers; each searches its share with iterative deepening, and the best
+# move at the deepest depth all of them finished is played.
+import logging
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from search import WIN, TimedSearch
+
+logger = logging.getLogger(__name__)
+
+_search = None  # This worker's TimedSearch; its table lives between moves
+_current = None  # Shared search generation; bumping it cancels a search
+
+
+def _start_worker(current, size, win_length):
+    global _search, _current
+    _current = current
+    _search = TimedSearch(size, win_length)
+
+
+def _warm_up():
+    return os.getpid()
+
+
+def _search_share(me, opp, moves, budget, generation):
+    _search.stop = lambda: _current.value != generation
+    _search.search(me, opp, budget, moves)
+    return _search.iterations, _search.nodes
+
+
+def combine(shares, cells):
+    # (value, move, depth) at the deepest depth every share completed. A share
+    # that stopped early on a forced result keeps it at every greater depth
+    finished = [iterations for iterations in shares if iterations]
+    if not finished:
+        return None
+    longest = max(len(iterations) for iterations in finished)
+    depth = min(longest if abs(iterations[-1][0]) >= WIN - cells
+                else len(iterations) for iterations in finished)
+    value, move = max((iterations[min(depth, len(iterations)) - 1]
+                       for iterations in finished),
+                      key=lambda entry: entry[0])
+    return value, move, depth
+
+
+class SearchPool:
+    def __init__(self, size, win_length, workers=None):
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        self.workers = workers or os.cpu_count()
+        # Forked children of a threaded GUI can inherit held locks
+        methods = multiprocessing.get_all_start_methods()
+        self.context = multiprocessing.get_context(
+            "forkserver" if "forkserver" in methods else "spawn")
+        self.current = self.context.Value("q", 0)
+        self.executor = None
+        self.spawn()
+        self.planner = TimedSearch(size, win_length, tt_slots=1)
+        self.lock = threading.Lock()
+        self.stats = {}  # Depth and nodes of the last finished search
+
+    def spawn(self):
+        # Starts the workers, or replaces a pool that broke when one of them
+        # was killed (OOM, a signal)
+        if self.executor is not None:
+            self.executor.shutdown(wait=False, cancel_futures=True)
+        self.executor = ProcessPoolExecutor(
+            self.workers, mp_context=self.context,
+            initializer=_start_worker,
+            initargs=(self.current, self.size, self.win_length))
+        for _ in range(self.workers):
+            self.executor.submit(_warm_up)  # Start the workers now
+
+    def submit(self, me, opp, shares, budget, generation):
+        # Future -> its share of the root moves, or None without workers.
+        # A broken pool is replaced once
+        for _ in range(2):
+            try:
+                return {self.executor.submit(_search_share, me, opp, share,
+                                             budget, generation): share
+                        for share in shares}
+            except BrokenProcessPool as e:
+                logger.error("Search workers died (%s), restarting them", e)
+                self.spawn()
+        return None
+
+    def start(self, me, opp, budget, callback):
+        # Searches in the background. callback(move) runs on a pool thread,
+        # unless start() or cancel() is called again first
+        generation = self.cancel()
+        move, moves = self.planner.root(me, opp)
+        if moves is None:
+            self.stats = {"depth": 0, "nodes": 0, "workers": 0}
+            callback(move)
+            return
+        count = min(self.workers, len(moves))
+        shares = self.submit(me, opp, [moves[i::count] for i in range(count)],
+                             budget, generation)
+        if shares is None:
+            self.search_lost([], moves, me, opp, budget, generation, callback)
+            return
+        results = []
+        failed = []  # Root moves of the shares whose worker failed
+
+        def finished(future):
+            with self.lock:
+                if generation != self.current.value:
+                    return  # Cancelled; a newer search owns the callback
+                try:
+                    results.append(future.result())
+                except Exception as e:
+                    logger.error("Search worker failed: %s", e)
+                    failed.extend(shares[future])
+                    results.append(None)
+                if len(results) < count:
+                    return
+            results[:] = [result for result in results if result]
+            if failed:
+                self.search_lost(results, failed, me, opp, budget,
+                                 generation, callback)
+                return
+            self.report(results, moves, count, callback)
+
+        for future in shares:
+            future.add_done_callback(finished)
+
+    def search_lost(self, results, moves, me, opp, budget, generation,
+                    callback):
+        # Moves no worker searched get an in-process TimedSearch on a thread
+        # of their own, rather than a blind guess or a stalled game thread
+        def run():
+            search = TimedSearch(self.size, self.win_length)
+            search.stop = lambda: self.current.value != generation
+            search.search(me, opp, budget, moves)
+            if generation != self.current.value:
+                return
+            results.append((search.iterations, search.nodes))
+            self.report(results, moves, len(results), callback)
+
+        threading.Thread(target=run, daemon=True).start()
+
+    def report(self, results, moves, count, callback):
+        best = combine([iterations for iterations, _ in results], self.cells)
+        # Nothing finished even one ply: play the first candidate
+        _, move, depth = best or (0, moves[0], 0)
+        self.stats = {"depth": depth, "workers": count,
+                      "nodes": sum(nodes for _, nodes in results)}
+        logger.debug("Searched to depth %d, %d nodes on %d workers",
+                     depth, self.stats["nodes"], count)
+        callback(move)
+
+    def cancel(self):
+        # Tells running searches to stop; returns the new generation
+        with self.lock:
+            with self.current.get_lock():
+                self.current.value += 1
+                return self.current.value
+
+    def close(self):
+        self.cancel()
+        # Cancelled searches stop at their next clock check
+        self.executor.shutdown(cancel_futures=True)
@@ -0,0 +1,352 @@
+# Runs one AsyncGameServer per core behind a single port. Every worker owns
+# its own SO_REUSEPORT listener so the kernel spreads connections across
+# processes; without SO_REUSEPORT the workers share one inherited socket.
+# Pairing stays local to a worker, except that with several workers a
+# player left waiting alone is handed (socket and all) to the supervisor,
+# which pairs it with a lone player from another worker.
+# Usage: python prefork.py --workers 4 --port 12345 --stats-interval 5
+import argparse
+import asyncio
+import json
+import logging
+import multiprocessing
+import os
+import socket
+import time
+from itertools import count
+from multiprocessing.connection import wait
+from queue import Empty
+import log
+import metrics
+from async_server import AsyncGameServer, PlayerProtocol
+from lobby import FIFO, MATCH_MODES, Lobby
+
+logger = logging.getLogger(__name__)
+
+RESTART_DELAY = 1.0  # Seconds between restarts of a crash-looping worker
+HANDOFF_AFTER = 0.5  # Seconds alone in a worker before going global
+CONTROL_SIZE = 4096  # Largest control message
+
+
+class WorkerServer(AsyncGameServer):
+    def __init__(self, control, workers, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.control = control  # Datagram socket to the supervisor
+        self.workers = workers  # A lone worker has nobody to hand off to
+        self.adopting = set()  # Players handed over by the supervisor
+        self.handed_off = 0
+        self.adopted = 0
+
+    def join(self, player):
+        if player in self.adopting:
+            # Already paired by the supervisor
+            self.adopting.discard(player)
+            self.connections.add(player)
+            return
+        super().join(player)
+
+    async def start(self):
+        await super().start()
+        loop = asyncio.get_running_loop()
+        loop.add_reader(self.control.fileno(), self.receive_players)
+        if self.workers > 1:
+            loop.create_task(self.hand_off_waiting())
+
+    async def hand_off_waiting(self):
+        while True:
+            await asyncio.sleep(HANDOFF_AFTER)
+            for player in self.lobby.stale(HANDOFF_AFTER):
+                self.hand_off(player)
+
+    def hand_off(self, player):
+        # Only a quiet connection can move: nothing unsent, nothing half read
+        transport = player.transport
+        if (player.pending or transport.get_write_buffer_size()
+                or player.decoder.start != player.decoder.end):
+            return
+        state = json.dumps({"codec": player.codec, "delta": player.delta,
+                            "rating": player.rating}).encode()
+        fd = transport.get_extra_info("socket").fileno()
+        try:
+            socket.send_fds(self.control, [state], [fd])
+        except OSError:
+            return  # Supervisor busy; try again next round
+        self.lobby.remove(player)
+        self.handed_off += 1
+        transport.abort()  # The supervisor holds its own copy of the socket
+
+    def receive_players(self):
+        while True:
+            try:
+                message, fds, _, _ = socket.recv_fds(
+                    self.control, CONTROL_SIZE, 2)
+            except BlockingIOError:
+                return
+            states = json.loads(message)
+            socks = [socket.socket(fileno=fd) for fd in fds]
+            asyncio.get_running_loop().create_task(self.adopt(states, socks))
+
+    async def adopt(self, states, socks):
+        loop = asyncio.get_running_loop()
+        players = []
+        for state, sock in zip(states, socks):
+            player = PlayerProtocol(self)
+            player.codec = state["codec"]
+            player.delta = state["delta"]
+            player.rating = state["rating"]
+            self.adopting.add(player)
+            await loop.connect_accepted_socket(lambda: player, sock)
+            players.append(player)
+        self.adopted += len(players)
+        self.start_match(*players)
+
+    def stats(self):
+        return dict(super().stats(), handed_off=self.handed_off,
+                    adopted=self.adopted)
+
+
+def worker_main(index, workers, host, port, size, win_length, match_mode,
+                sock, control, stats_queue, stats_interval,
+                metrics_port=None):
+    control.setblocking(False)
+    if metrics_port:
+        # One endpoint per worker; scrape them all and sum in the query
+        metrics.serve(metrics_port + index, host)
+    game_server = WorkerServer(control, workers, host, port, size,
+                               win_length, match_mode,
+                               reuse_port=sock is None, sock=sock)
+    try:
+        asyncio.run(game_server.serve_forever(
+            stats_interval, lambda stats: stats_queue.put((index, stats))))
+    except KeyboardInterrupt:
+        pass  # The supervisor shuts us down
+
+
+def connected(sock):
+    # False once a parked player's peer has hung up
+    try:
+        return bool(sock.recv(1, socket.MSG_PEEK | socket.MSG_DONTWAIT))
+    except BlockingIOError:
+        return True  # Quiet, but still there
+    except OSError:
+        return False
+
+
+def aggregate(stats):
+    # Counters add up; peaks, percentiles and per-batch averages don't
+    total = {}
+    for key in {key for worker_stats in stats for key in worker_stats}:
+        values = [s[key] for s in stats if key in s]
+        if "max" in key or "peak" in key or "_p50" in key or "_p99" in key:
+            total[key] = max(values)
+        elif "_per_" in key:
+            total[key] = sum(values) / len(values)
+        else:
+            total[key] = sum(values)
+    return dict(sorted(total.items()))
+
+
+class Supervisor:
+    # Forks the workers, restarts any that die, pairs the players they hand
+    # over and merges their stats
+    def __init__(self, host="localhost", port=12345, workers=None, size=3,
+                 win_length=3, match_mode=FIFO, stats_interval=0,
+                 metrics_port=None):
+        self.host = host
+        self.port = port
+        self.workers = workers or os.cpu_count()
+        self.size = size
+        self.win_length = win_length
+        self.match_mode = match_mode
+        self.stats_interval = stats_interval
+        self.metrics_port = metrics_port
+        self.sock = None
+        self.context = multiprocessing.get_context()
+        self.stats_queue = None
+        self.processes = {}  # Worker index -> Process
+        self.controls = {}  # Worker index -> our end of its control socket
+        self.started = {}  # Worker index -> last start time
+        self.worker_stats = {}  # Worker index -> latest stats
+        self.lobby = Lobby(match_mode)  # (socket, state) handed over
+        self.unsent = []  # Pairs no worker would take yet
+        self.next_worker = count()
+        self.cross_worker_matches = 0
+        self.restarts = 0
+        self.running = False
+
+    def listen(self):
+        if hasattr(socket, "SO_REUSEPORT"):
+            return  # Each worker binds its own listener
+        # Fall back to one listening socket inherited across fork()
+        self.context = multiprocessing.get_context("fork")
+        self.sock = socket.create_server((self.host, self.port), backlog=4096)
+        self.sock.setblocking(False)
+
+    def start_worker(self, index):
+        if index in self.controls:
+            self.controls[index].close()
+        ours, theirs = socket.socketpair(socket.AF_UNIX, socket.SOCK_DGRAM)
+        ours.setblocking(False)
+        process = self.context.Process(
+            target=worker_main, daemon=True,
+            args=(index, self.workers, self.host, self.port, self.size,
+                  self.win_length,
+                  self.match_mode, self.sock, theirs, self.stats_queue,
+                  self.stats_interval, self.metrics_port))
+        process.start()
+        theirs.close()
+        self.processes[index] = process
+        self.controls[index] = ours
+        self.started[index] = time.monotonic()
+
+    def start(self):
+        self.listen()
+        self.stats_queue = self.context.Queue()
+        self.running = True
+        for index in range(self.workers):
+            self.start_worker(index)
+        logger.info("Supervisor started %d workers on %s:%s",
+                    self.workers, self.host, self.port)
+
+    def check_workers(self):
+        for index, process in list(self.processes.items()):
+            if process.is_alive() or not self.running:
+                continue
+            logger.warning("Worker %d (pid %s) exited with %s, restarting.",
+                           index, process.pid, process.exitcode)
+            self.worker_stats.pop(index, None)
+            delay = self.started[index] + RESTART_DELAY - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+            self.restarts += 1
+            self.start_worker(index)
+
+    def receive_players(self, control):
+        while True:
+            try:
+                message, fds, _, _ = socket.recv_fds(control, CONTROL_SIZE, 1)
+            except BlockingIOError:
+                return
+            if not fds:
+                continue
+            self.park((socket.socket(fileno=fds[0]), message))
+
+    def park(self, player):
+        pair = self.lobby.enqueue(player, json.loads(player[1])["rating"])
+        if pair:
+            self.pair_up(pair)
+
+    def pair_up(self, pair):
+        # A player may have left while parked here; pair only the live ones
+        live = [player for player in pair if connected(player[0])]
+        if len(live) == 2:
+            if not self.send_pair(*pair):
+                logger.warning("No worker took a handed-off pair, retrying.")
+                self.unsent.append(pair)
+            return
+        for player in pair:
+            if player not in live:
+                player[0].close()
+        for player in live:
+            self.park(player)
+
+    def send_pair(self, first, second):
+        fds = [first[0].fileno(), second[0].fileno()]
+        message = json.dumps([json.loads(first[1]), json.loads(second[1])])
+        # Round-robin over the live workers
+        for _ in range(len(self.controls)):
+            index = next(self.next_worker) % self.workers
+            if not self.processes[index].is_alive():
+                continue
+            try:
+                socket.send_fds(self.controls[index], [message.encode()], fds)
+            except OSError:
+                continue
+            self.cross_worker_matches += 1
+            first[0].close()  # The worker holds its own copies now
+            second[0].close()
+            return True
+        return False
+
+    def collect_stats(self):
+        while True:
+            try:
+                index, stats = self.stats_queue.get_nowait()
+            except Empty:
+                return
+            self.worker_stats[index] = stats
+
+    def stats(self):
+        self.collect_stats()
+        return dict(aggregate(list(self.worker_stats.values())),
+                    workers=len(self.processes), worker_restarts=self.restarts,
+                    cross_worker_matches=self.cross_worker_matches,
+                    supervisor_queue_depth=len(self.lobby))
+
+    def serve_forever(self):
+        self.start()
+        next_report = time.monotonic() + (self.stats_interval or 0)
+        try:
+            while self.running:
+                sentinels = [p.sentinel for p in self.processes.values()]
+                ready = wait(sentinels + list(self.controls.values()),
+                             timeout=0.5)
+                for control in self.controls.values():
+                    if control in ready:
+                        self.receive_players(control)
+                for pair in self.lobby.expire():
+                    self.pair_up(pair)
+                unsent, self.unsent = self.unsent, []
+                for pair in unsent:
+                    self.pair_up(pair)
+                self.check_workers()
+                self.collect_stats()
+                if self.stats_interval and time.monotonic() >= next_report:
+                    logger.info("Stats: %s", self.stats())
+                    next_report += self.stats_interval
+        except KeyboardInterrupt:
+            logger.info("Server stopped.")
+        finally:
+            self.stop()
+
+    def stop(self):
+        self.running = False
+        for process in self.processes.values():
+            process.terminate()
+        for process in self.processes.values():
+            process.join()
+        for control in self.controls.values():
+            control.close()
+        for sock, _ in list(self.lobby.queue):
+            sock.close()
+        for pair in self.unsent:
+            for sock, _ in pair:
+                sock.close()
+        if self.sock:
+            self.sock.close()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Pre-forked game server")
+    parser.add_argument("--host", default="localhost")
+    parser.add_argument("--port", type=int, default=12345)
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=3)
+    parser.add_argument("--match", choices=MATCH_MODES, default=FIFO)
+    parser.add_argument("--stats-interval", type=float, default=0,
+                        help="Print combined worker stats every N seconds")
+    parser.add_argument("--log-level", default=None,
+                        help="DEBUG, INFO, WARNING or ERROR (default INFO)")
+    parser.add_argument("--metrics-port", type=int, default=None,
+                        help="Worker N serves Prometheus metrics on this "
+                             "port + N")
+    args = parser.parse_args()
+    log.setup(args.log_level)
+    Supervisor(args.host, args.port, args.workers, args.size, args.win_length,
+               args.match, args.stats_interval,
+               args.metrics_port).serve_forever()
+
+
+if __name__ == "__main__":
+    main()
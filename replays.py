@@ -0,0 +1,548 @@
+# Finished matches, kept for analytics and for checking the rules after the
+# fact. A store is a directory of column files holding one fixed-width
+# value per match (or per move), so a query maps and reads only the columns
+# it filters on and never loads the store. Sorted indexes on player, result
+# and opening are built offline; matches added since the last build are
+# scanned from the columns.
+# Usage: python replays.py DIR index
+#        python replays.py DIR query --player bob --result x --opening 4,0
+#        python replays.py DIR show 17
+#        python replays.py DIR replay  (re-check every match)
+import argparse
+import heapq
+import logging
+import mmap
+import os
+import struct
+import sys
+import time
+from array import array
+from bisect import bisect_left
+from collections import Counter
+from packets import PacketType
+from server import Server
+
+logger = logging.getLogger(__name__)
+
+MAGIC = b"TTTR"
+INDEX_MAGIC = b"TTTI"
+VERSION = 1
+HEADER = struct.Struct("<4sBcBB")  # Magic, version, byte order, size, win
+INDEX_HEADER = struct.Struct("<4sBxxxQ")  # Magic, version, matches covered
+BYTE_ORDER = b"<" if sys.byteorder == "little" else b">"
+
+# Column -> array typecode, one value per match
+COLUMNS = {
+    "start": "d",  # Unix time the match began
+    "duration": "I",  # Milliseconds from the start to the last move
+    "x": "I",  # Player ids, lines of players.txt
+    "o": "I",
+    "first": "B",  # Symbol that was given the first move
+    "result": "B",
+    "moves": "Q",  # Position of the match's first move in the move columns
+    "plies": "H",
+    "opening": "I",  # First OPENING_PLIES cells, for the opening index
+}
+# ...and one value per move
+MOVE_COLUMNS = {
+    "cell": "H",
+    "player": "B",
+    "think": "I",  # Milliseconds since the previous move (or the start)
+}
+INDEXES = ("player", "result", "opening")
+
+# Results
+X_WON, O_WON, DRAW, X_LEFT, O_LEFT = range(5)
+RESULTS = ("x", "o", "draw", "x-left", "o-left")
+
+OPENING_PLIES = 3
+CELL_BITS = 10  # Boards up to 31x31
+NO_CELL = (1 << CELL_BITS) - 1  # Pads the openings of shorter matches
+
+FLUSH_MATCHES = 256  # Matches buffered before they are written out
+FLUSH_INTERVAL = 1.0  # ...or seconds, whichever comes first
+RUN_ENTRIES = 1 << 22  # Index entries sorted in memory at a time
+
+
+def column_path(path, name):
+    return os.path.join(path, f"{name}.col")
+
+
+def index_path(path, name):
+    return os.path.join(path, f"{name}.idx")
+
+
+def read_meta(path):
+    with open(os.path.join(path, "meta"), "rb") as f:
+        magic, version, order, size, win_length = HEADER.unpack(
+            f.read(HEADER.size))
+    if magic != MAGIC or version != VERSION:
+        raise ValueError(f"{path} is not a version {VERSION} replay store")
+    if order != BYTE_ORDER:
+        raise ValueError(f"{path} was written on a host of the other "
+                         f"byte order")
+    return size, win_length
+
+
+def load_players(path):
+    try:
+        with open(os.path.join(path, "players.txt"), encoding="utf-8") as f:
+            return f.read().split("\n")[:-1]
+    except FileNotFoundError:
+        return []
+
+
+def column_length(path, name, code):
+    try:
+        return os.path.getsize(column_path(path, name)) // array(code).itemsize
+    except FileNotFoundError:
+        return 0
+
+
+def opening_key(cells):
+    key = 0
+    for ply in range(OPENING_PLIES):
+        key = key << CELL_BITS | (cells[ply] if ply < len(cells) else NO_CELL)
+    return key
+
+
+def opening_range(prefix):
+    # Keys of every match whose indexed opening starts with prefix
+    prefix = prefix[:OPENING_PLIES]
+    rest = (OPENING_PLIES - len(prefix)) * CELL_BITS
+    low = 0
+    for cell in prefix:
+        low = low << CELL_BITS | cell
+    low <<= rest
+    return low, low | (1 << rest) - 1
+
+
+class ReplayWriter:
+    # Buffers finished matches and appends them to the column files in
+    # groups. Moves are written before the matches that point at them, and
+    # opening the store trims whatever a crash left half written
+    def __init__(self, path, size=3, win_length=3):
+        self.path = path
+        os.makedirs(path, exist_ok=True)
+        meta = os.path.join(path, "meta")
+        if os.path.exists(meta):
+            if read_meta(path) != (size, win_length):
+                raise ValueError(f"{path} holds matches on another board")
+        else:
+            with open(meta, "wb") as f:
+                f.write(HEADER.pack(MAGIC, VERSION, BYTE_ORDER, size,
+                                    win_length))
+        self.count, self.move_count = self.repair()
+        self.players = {name: i for i, name in enumerate(load_players(path))}
+        self.new_players = []
+        self.pending = {name: array(code) for name, code
+                        in {**COLUMNS, **MOVE_COLUMNS}.items()}
+        self.last_flush = time.monotonic()
+
+    def repair(self):
+        # Cut every column back to the last match written in full
+        count = min(column_length(self.path, name, code)
+                    for name, code in COLUMNS.items())
+        move_count = 0
+        if count:
+            moves = array("Q")
+            plies = array("H")
+            with open(column_path(self.path, "moves"), "rb") as f:
+                f.seek((count - 1) * moves.itemsize)
+                moves.fromfile(f, 1)
+            with open(column_path(self.path, "plies"), "rb") as f:
+                f.seek((count - 1) * plies.itemsize)
+                plies.fromfile(f, 1)
+            move_count = moves[0] + plies[0]
+        for columns, length in ((COLUMNS, count), (MOVE_COLUMNS, move_count)):
+            for name, code in columns.items():
+                file = column_path(self.path, name)
+                with open(file, "ab") as f:
+                    f.truncate(length * array(code).itemsize)
+        players = os.path.join(self.path, "players.txt")
+        with open(players, "ab+") as f:
+            f.seek(0)
+            data = f.read()
+            f.truncate(data.rfind(b"\n") + 1)  # Drop a torn last name
+        return count, move_count
+
+    def player_id(self, name):
+        # One line of players.txt that always encodes, whatever the peer
+        # called itself
+        name = str(name).replace("\n", " ").replace("\r", " ")
+        name = name.encode("utf-8", "backslashreplace").decode("utf-8")
+        player = self.players.get(name)
+        if player is None:
+            player = self.players[name] = len(self.players)
+            self.new_players.append(name)
+        return player
+
+    def append(self, x, o, first, result, cells, players, times, start):
+        # times are time.time() of each move in cells, made by players
+        pending = self.pending
+        pending["start"].append(start)
+        pending["duration"].append(round(((times[-1] if times else start)
+                                          - start) * 1000))
+        pending["x"].append(self.player_id(x))
+        pending["o"].append(self.player_id(o))
+        pending["first"].append(ord(first))
+        pending["result"].append(result)
+        pending["moves"].append(self.move_count)
+        pending["plies"].append(len(cells))
+        pending["opening"].append(opening_key(cells))
+        pending["cell"].extend(cells)
+        pending["player"].extend(ord(player) for player in players)
+        previous = start
+        for at in times:
+            pending["think"].append(max(0, round((at - previous) * 1000)))
+            previous = at
+        self.count += 1
+        self.move_count += len(cells)
+        if (len(pending["start"]) >= FLUSH_MATCHES
+                or time.monotonic() - self.last_flush >= FLUSH_INTERVAL):
+            self.flush()
+
+    def flush(self):
+        # A few small appends into the page cache; no fsync, a crash only
+        # costs the analytics the last group of matches
+        self.last_flush = time.monotonic()
+        if not self.pending["start"]:
+            return
+        # Nothing pending is dropped until it is on disk; a failed flush
+        # cuts the columns back and the next one writes the group again
+        if self.new_players:
+            with open(os.path.join(self.path, "players.txt"), "a",
+                      encoding="utf-8") as f:
+                f.write("".join(name + "\n" for name in self.new_players))
+            self.new_players = []
+        try:
+            for columns in (MOVE_COLUMNS, COLUMNS):
+                for name in columns:
+                    with open(column_path(self.path, name), "ab") as f:
+                        self.pending[name].tofile(f)
+        except OSError:
+            self.repair()
+            raise
+        for name, code in {**COLUMNS, **MOVE_COLUMNS}.items():
+            self.pending[name] = array(code)
+
+    def close(self):
+        self.flush()
+
+
+class Replays:
+    # Read-only view of a store as it was when opened
+    def __init__(self, path):
+        self.path = path
+        self.size, self.win_length = read_meta(path)
+        self.maps = []
+        self.views = []
+        self.columns = {name: self.map(column_path(path, name), code)
+                        for name, code in {**COLUMNS, **MOVE_COLUMNS}.items()}
+        self.count = min(len(self.columns[name]) for name in COLUMNS)
+        self.players = load_players(path)
+        self.player_ids = {name: i for i, name in enumerate(self.players)}
+        self.indexes = {}  # Name -> (matches covered, sorted entries)
+        for name in INDEXES:
+            try:
+                self.indexes[name] = self.map_index(index_path(path, name))
+            except (OSError, ValueError):
+                pass  # Not built yet; scanned instead
+
+    def map(self, file, code, offset=0):
+        itemsize = array(code).itemsize
+        with open(file, "rb") as f:
+            length = os.fstat(f.fileno()).st_size
+            usable = (length - offset) // itemsize * itemsize
+            if usable <= 0:
+                return memoryview(b"").cast(code)
+            mapped = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self.maps.append(mapped)
+        view = memoryview(mapped)[offset:offset + usable].cast(code)
+        self.views.append(view)
+        return view
+
+    def map_index(self, file):
+        with open(file, "rb") as f:
+            magic, version, covered = INDEX_HEADER.unpack(
+                f.read(INDEX_HEADER.size))
+        if magic != INDEX_MAGIC or version != VERSION:
+            raise ValueError(f"{file} is not a version {VERSION} index")
+        return min(covered, self.count), self.map(file, "Q",
+                                                  INDEX_HEADER.size)
+
+    def close(self):
+        for view in self.views:
+            view.release()
+        for mapped in self.maps:
+            mapped.close()
+
+    def moves(self, match):
+        start = self.columns["moves"][match]
+        return start, start + self.columns["plies"][match]
+
+    def game(self, match):
+        columns = self.columns
+        start, end = self.moves(match)
+        return {"id": match,
+                "start": columns["start"][match],
+                "duration": columns["duration"][match] / 1000,
+                "x": self.players[columns["x"][match]],
+                "o": self.players[columns["o"][match]],
+                "first": chr(columns["first"][match]),
+                "result": RESULTS[columns["result"][match]],
+                "cells": columns["cell"][start:end].tolist(),
+                "players": [chr(p) for p in columns["player"][start:end]],
+                "think": [ms / 1000 for ms in columns["think"][start:end]]}
+
+    def filters(self, player=None, result=None, opening=None):
+        # [(index, low key, high key, test(match))], or None if nothing
+        # can match
+        filters = []
+        columns = self.columns
+        if player is not None:
+            player_id = self.player_ids.get(player)
+            if player_id is None:
+                return None
+            x, o = columns["x"], columns["o"]
+            filters.append(("player", player_id, player_id,
+                            lambda m: x[m] == player_id or o[m] == player_id))
+        if result is not None:
+            code = RESULTS.index(result)
+            results = columns["result"]
+            filters.append(("result", code, code,
+                            lambda m: results[m] == code))
+        if opening:
+            low, high = opening_range(opening)
+            keys, cells = columns["opening"], columns["cell"]
+            length = len(opening)
+
+            def test(m):
+                if not low <= keys[m] <= high:
+                    return False
+                if length <= OPENING_PLIES:
+                    return True
+                start, end = self.moves(m)
+                return (end - start >= length
+                        and cells[start:start + length].tolist() == opening)
+            filters.append(("opening", low, high, test))
+        return filters
+
+    def select(self, player=None, result=None, opening=None):
+        # Ids of the matching matches, in order
+        filters = self.filters(player, result, opening)
+        if filters is None:
+            return []
+        if not filters:
+            return list(range(self.count))
+        tests = [test for _, _, _, test in filters]
+        covered = min((self.indexes[name][0] if name in self.indexes else 0)
+                      for name, _, _, _ in filters)
+        candidates = []
+        if covered:
+            # Walk the narrowest index range and test the rest per match
+            entries = min((self.entries(name, low, high)
+                           for name, low, high, _ in filters), key=len)
+            candidates = sorted({entry & 0xFFFFFFFF for entry in entries})
+            candidates = candidates[:bisect_left(candidates, covered)]
+        found = [m for m in candidates if all(test(m) for test in tests)]
+        # Matches added since the indexes were built
+        found += [m for m in range(covered, self.count)
+                  if all(test(m) for test in tests)]
+        return found
+
+    def entries(self, name, low, high):
+        # Index entries are key << 32 | match, sorted
+        entries = self.indexes[name][1]
+        return entries[bisect_left(entries, low << 32):
+                       bisect_left(entries, high + 1 << 32)]
+
+    def outcomes(self, matches):
+        results = self.columns["result"]
+        if len(matches) == self.count:
+            # Everything: count the byte column directly
+            data = results.tobytes()
+            return Counter({RESULTS[code]: data.count(code)
+                            for code in range(len(RESULTS))
+                            if data.count(code)})
+        return Counter(RESULTS[results[m]] for m in matches)
+
+    def replay(self, match):
+        # Feeds the stored moves through Server.process_packet; returns what
+        # went wrong, or None if the rules agree with the record
+        game = self.game(match)
+        server = Server(size=self.size, win_length=self.win_length)
+        ended = []
+        server.set_gui_callback(
+            lambda update: update["type"] == "END"
+            and ended.append(update["result"]))
+        server.current_player = game["first"]
+        for ply, (cell, player) in enumerate(zip(game["cells"],
+                                                 game["players"])):
+            if server.isOver:
+                return f"ply {ply}: move after the match ended"
+            if player != server.current_player:
+                return f"ply {ply}: {player} moved out of turn"
+            if not 0 <= cell < self.size * self.size:
+                return f"ply {ply}: cell {cell} is off the board"
+            if not server.board.is_free(cell):
+                return f"ply {ply}: cell {cell} is taken"
+            server.process_packet({"type": PacketType.MOVE.value,
+                                   "player": player, "move": cell})
+            if server.board.is_free(cell):
+                return f"ply {ply}: move to {cell} was rejected"
+        expected = {X_WON: "Player X wins!", O_WON: "Player O wins!",
+                    DRAW: "The game is a draw!"}.get(
+            RESULTS.index(game["result"]))
+        actual = ended[0] if ended else None
+        if actual != expected:
+            return (f"recorded {game['result']}, replay ended with "
+                    f"{actual or 'no result'}")
+        return None
+
+
+def build_indexes(path):
+    # Rebuilds every index over the whole store. Entries are sorted in runs
+    # of RUN_ENTRIES and merged, so memory stays bounded however big the
+    # store gets. Returns the number of matches covered
+    replays = Replays(path)
+    try:
+        columns = replays.columns
+        count = replays.count
+        keys = {
+            "result": lambda m: [columns["result"][m]],
+            "opening": lambda m: [columns["opening"][m]],
+            # Self-play (one name on both sides) is indexed once
+            "player": lambda m: {columns["x"][m], columns["o"][m]},
+        }
+        for name in INDEXES:
+            key = keys[name]
+            runs = []
+            run = []
+            for m in range(count):
+                run.extend(k << 32 | m for k in key(m))
+                if len(run) >= RUN_ENTRIES:
+                    runs.append(write_run(path, run))
+                    run = []
+            runs.append(write_run(path, run))
+            write_index(index_path(path, name), count, runs)
+    finally:
+        replays.close()
+    return count
+
+
+def write_run(path, entries):
+    import tempfile  # Only index builds need it
+    entries.sort()
+    run = tempfile.TemporaryFile(dir=path)
+    array("Q", entries).tofile(run)
+    run.seek(0)
+    return run
+
+
+def read_run(run, chunk=1 << 16):
+    while True:
+        entries = array("Q")
+        try:
+            entries.fromfile(run, chunk)
+        except EOFError:
+            pass  # Short last chunk; what was read is kept
+        if not entries:
+            return
+        yield from entries
+
+
+def write_index(file, covered, runs):
+    temporary = f"{file}.tmp"
+    with open(temporary, "wb") as f:
+        f.write(INDEX_HEADER.pack(INDEX_MAGIC, VERSION, covered))
+        if len(runs) == 1:
+            f.write(runs[0].read())
+        else:
+            out = array("Q")
+            for entry in heapq.merge(*(read_run(run) for run in runs)):
+                out.append(entry)
+                if len(out) >= 1 << 16:
+                    out.tofile(f)
+                    out = array("Q")
+            out.tofile(f)
+    for run in runs:
+        run.close()
+    os.replace(temporary, file)
+
+
+def describe(game):
+    started = time.strftime("%Y-%m-%d %H:%M:%S", time.localtime(game["start"]))
+    return (f"{game['id']:>9} {started} {game['x']} (X) vs {game['o']} (O): "
+            f"{game['result']:<6} {len(game['cells']):3} plies "
+            f"{game['duration']:7.1f}s  {','.join(map(str, game['cells']))}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Query stored matches")
+    parser.add_argument("store", help="Replay store directory")
+    commands = parser.add_subparsers(dest="command", required=True)
+    commands.add_parser("index", help="Rebuild the indexes")
+    query = commands.add_parser("query", help="List matching matches")
+    query.add_argument("--player", default=None)
+    query.add_argument("--result", choices=RESULTS, default=None)
+    query.add_argument("--opening", default=None,
+                       help="Comma separated first cells, e.g. 4,0")
+    query.add_argument("--limit", type=int, default=20,
+                       help="Matches to list (0 for none)")
+    show = commands.add_parser("show", help="Print matches move by move")
+    show.add_argument("ids", type=int, nargs="+")
+    replay = commands.add_parser(
+        "replay", help="Re-run matches through the server rules")
+    replay.add_argument("ids", type=int, nargs="*",
+                        help="Matches to check (default all)")
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.ERROR)  # Replays log every move
+
+    if args.command == "index":
+        start = time.perf_counter()
+        count = build_indexes(args.store)
+        print(f"Indexed {count:,} matches in "
+              f"{time.perf_counter() - start:.1f}s")
+        return
+
+    replays = Replays(args.store)
+    try:
+        if args.command == "query":
+            opening = ([int(cell) for cell in args.opening.split(",")]
+                       if args.opening else None)
+            start = time.perf_counter()
+            matches = replays.select(args.player, args.result, opening)
+            outcomes = replays.outcomes(matches)
+            elapsed = time.perf_counter() - start
+            for match in matches[:args.limit]:
+                print(describe(replays.game(match)))
+            print(f"{len(matches):,} of {replays.count:,} matches "
+                  f"({elapsed * 1e3:.0f}ms): " + ", ".join(
+                      f"{result} {outcomes[result]:,}" for result in RESULTS
+                      if outcomes[result]))
+        elif args.command == "show":
+            for match in args.ids:
+                game = replays.game(match)
+                print(describe(game))
+                for ply, (cell, player, think) in enumerate(zip(
+                        game["cells"], game["players"], game["think"])):
+                    print(f"    {ply + 1:3}. {player} -> {cell:<4} "
+                          f"{think:6.2f}s")
+        else:
+            matches = args.ids or range(replays.count)
+            bad = 0
+            for match in matches:
+                problem = replays.replay(match)
+                if problem:
+                    bad += 1
+                    print(f"Match {match}: {problem}")
+            print(f"Replayed {len(matches):,} matches, {bad:,} disagree "
+                  f"with the rules")
+            sys.exit(1 if bad else 0)
+    finally:
+        replays.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+# Time-limited search for boards too big to solve: iterative-deepening
+# negamax with alpha-beta, a fixed-size transposition table kept between
+# moves, killer and history move ordering, and K-in-a-row threat pruning
+# (take a win at once, otherwise block the opponent's).
+import time
+from bitboard import line_masks, lines_through
+from solver import heuristic_move
+
+THINK_TIME = 1.0  # Default seconds per move
+TT_SLOTS = 1 << 20
+CHECK_EVERY = 1024  # Nodes between clock checks
+WIN = 10 ** 9
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+
+class TimeUp(Exception):
+    pass
+
+
+class TranspositionTable:
+    # One entry per slot. A new entry replaces one left by an earlier search
+    # or one searched no deeper, so deep results survive from move to move
+    def __init__(self, slots=TT_SLOTS):
+        self.slots = [None] * slots
+        self.size = slots
+        self.generation = 0
+
+    def new_search(self):
+        self.generation += 1
+
+    def probe(self, me, opp):
+        entry = self.slots[hash((me, opp)) % self.size]
+        if entry is not None and entry[0] == me and entry[1] == opp:
+            return entry
+        return None
+
+    def store(self, me, opp, depth, flag, value, move):
+        index = hash((me, opp)) % self.size
+        entry = self.slots[index]
+        if (entry is None or entry[6] != self.generation or depth >= entry[2]
+                or (entry[0] == me and entry[1] == opp)):
+            self.slots[index] = (me, opp, depth, flag, value, move,
+                                 self.generation)
+
+
+class TimedSearch:
+    # Positions are (me, opp) masks relative to the player to move
+    def __init__(self, size, win_length, tt_slots=TT_SLOTS):
+        self.size = size
+        self.win_length = win_length
+        self.cells = size * size
+        self.full = (1 << self.cells) - 1
+        self.lines = lines_through(size, win_length)
+        self.all_lines = line_masks(size, win_length)
+        # Worth of a line holding n stones of one player and none of the other
+        self.weights = [0] + [10 ** (n - 1) for n in range(1, win_length + 1)]
+        self.not_left = sum(1 << cell for cell in range(self.cells)
+                            if cell % size)
+        self.not_right = sum(1 << cell for cell in range(self.cells)
+                             if cell % size != size - 1)
+        self.center = (size // 2) * size + size // 2
+        self.tt = TranspositionTable(tt_slots)
+        self.history = [0] * self.cells
+        self.killers = []
+        self.nodes = 0
+        self.deadline = 0.0
+        self.stop = None  # Optional callable; True abandons the search
+        self.root_moves = None  # Restricts the moves tried at the root
+        self.iterations = []  # (value, move) per completed depth
+        self.stats = {}
+
+    def choose(self, board, player, budget=THINK_TIME):
+        opponent = "O" if player == "X" else "X"
+        move = self.search(board.mask(player), board.mask(opponent), budget)
+        return move if move != -1 else heuristic_move(board, player)
+
+    def evaluate(self, me, opp):
+        score = 0
+        weights = self.weights
+        for line in self.all_lines:
+            mine, theirs = me & line, opp & line
+            if not theirs:
+                score += weights[mine.bit_count()]
+            elif not mine:
+                score -= weights[theirs.bit_count()]
+        return score
+
+    def threats(self, me, opp):
+        # Free cells where me would complete a line
+        found = 0
+        needed = self.win_length - 1
+        for line in self.all_lines:
+            if not opp & line and (me & line).bit_count() == needed:
+                found |= line & ~me
+        return found
+
+    def gain(self, cell, me, opp):
+        # Score change and new winning cells when the mover takes cell
+        delta = 0
+        threats = 0
+        weights = self.weights
+        needed = self.win_length - 1
+        me |= 1 << cell
+        for line in self.lines[cell]:
+            if opp & line:
+                if (me & line).bit_count() == 1:
+                    delta += weights[(opp & line).bit_count()]  # Line blocked
+                continue
+            mine = (me & line).bit_count()
+            delta += weights[mine] - weights[mine - 1]
+            if mine == needed:
+                threats |= line & ~me
+        return delta, threats
+
+    def around(self, mask):
+        # mask plus every cell touching it, diagonals included
+        row = (mask | (mask & self.not_left) >> 1
+               | (mask & self.not_right) << 1)
+        return (row | row << self.size | row >> self.size) & self.full
+
+    def root(self, me, opp):
+        # (move, None) when a win or a block can be played without searching,
+        # else (-1, the candidate moves to split between searchers)
+        my_threats = self.threats(me, opp)
+        if my_threats:
+            return (my_threats & -my_threats).bit_length() - 1, None
+        opp_threats = self.threats(opp, me)
+        if opp_threats:
+            return (opp_threats & -opp_threats).bit_length() - 1, None
+        occupied = me | opp
+        if occupied == self.full:
+            return -1, None
+        return -1, self.order_moves(occupied, -1, (-1, -1))
+
+    def search(self, me, opp, budget=THINK_TIME, root_moves=None):
+        # Best move found within budget seconds, or -1 with no legal move.
+        # root_moves limits the root to a share of the moves for a worker
+        start = time.perf_counter()
+        self.deadline = start + budget
+        self.nodes = 0
+        self.tt.new_search()
+        self.history = [value // 2 for value in self.history]  # Age them
+        self.killers = [[-1, -1] for _ in range(self.cells + 1)]
+        self.root_moves = root_moves
+        self.iterations = []
+        my_threats = self.threats(me, opp)
+        opp_threats = self.threats(opp, me)
+        score = self.evaluate(me, opp)
+        empty = self.cells - (me | opp).bit_count()
+
+        best_move, best_value, depth_reached = -1, 0, 0
+        for depth in range(1, empty + 1):
+            try:
+                value, move = self.negamax(me, opp, my_threats, opp_threats,
+                                           score, depth, -WIN - 1, WIN + 1, 0)
+            except TimeUp:
+                break
+            best_move, best_value, depth_reached = move, value, depth
+            self.iterations.append((value, move))
+            if abs(value) >= WIN - self.cells:
+                break  # Won or lost by force; deeper won't change it
+            if time.perf_counter() - start > budget / 2:
+                break  # The next iteration would not finish in time
+        elapsed = time.perf_counter() - start
+        self.stats = {"depth": depth_reached, "nodes": self.nodes,
+                      "seconds": elapsed, "value": best_value,
+                      "nodes_per_sec": self.nodes / elapsed if elapsed else 0}
+        return best_move
+
+    def negamax(self, me, opp, my_threats, opp_threats, score, depth,
+                alpha, beta, ply):
+        # me is to move; opp's last stone did not win
+        self.nodes += 1
+        if not self.nodes % CHECK_EVERY and (
+                time.perf_counter() > self.deadline
+                or self.stop is not None and self.stop()):
+            raise TimeUp
+        if my_threats:
+            low = my_threats & -my_threats
+            return WIN - ply, low.bit_length() - 1
+        occupied = me | opp
+        if occupied == self.full:
+            return 0, -1
+
+        if opp_threats:
+            # Threat pruning: only a block avoids losing next move, and
+            # two open threats can't both be blocked
+            low = opp_threats & -opp_threats
+            cell = low.bit_length() - 1
+            if opp_threats != low:
+                return -(WIN - ply - 1), cell
+            delta, threats = self.gain(cell, me, opp)
+            # Forced moves don't use up depth
+            value = -self.negamax(opp, me | low, 0, threats,
+                                  -(score + delta), depth, -beta, -alpha,
+                                  ply + 1)[0]
+            return value, cell
+        if depth == 0:
+            return score, -1
+
+        original_alpha = alpha
+        tt_move = -1
+        # A restricted root's result covers only its share of the moves
+        restricted = ply == 0 and self.root_moves is not None
+        entry = None if restricted else self.tt.probe(me, opp)
+        if entry is not None:
+            _, _, entry_depth, flag, value, tt_move, _ = entry
+            if entry_depth >= depth:
+                value = self.from_tt(value, ply)
+                if flag == EXACT:
+                    return value, tt_move
+                if flag == LOWER:
+                    alpha = max(alpha, value)
+                else:
+                    beta = min(beta, value)
+                if alpha >= beta:
+                    return value, tt_move
+
+        if restricted:
+            moves = self.root_moves
+        else:
+            moves = self.order_moves(occupied, tt_move, self.killers[ply])
+        best_value, best_move = -WIN - 1, moves[0]
+        for cell in moves:
+            delta, threats = self.gain(cell, me, opp)
+            value = -self.negamax(opp, me | 1 << cell, 0, threats,
+                                  -(score + delta), depth - 1, -beta, -alpha,
+                                  ply + 1)[0]
+            if value > best_value:
+                best_value, best_move = value, cell
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                killers = self.killers[ply]
+                if killers[0] != cell:
+                    killers[1], killers[0] = killers[0], cell
+                self.history[cell] += depth * depth
+                break
+
+        if best_value <= original_alpha:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        if not restricted:
+            self.tt.store(me, opp, depth, flag, self.to_tt(best_value, ply),
+                          best_move)
+        return best_value, best_move
+
+    def order_moves(self, occupied, tt_move, killers):
+        # Cells next to a stone: the table's move, killers, then by history
+        if not occupied:
+            return [self.center]
+        free = self.around(occupied) & ~occupied
+        moves = []
+        while free:
+            low = free & -free
+            moves.append(low.bit_length() - 1)
+            free ^= low
+        history = self.history
+        moves.sort(key=history.__getitem__, reverse=True)
+        for cell in (killers[1], killers[0], tt_move):
+            if cell >= 0 and not occupied >> cell & 1 and cell in moves:
+                moves.remove(cell)
+                moves.insert(0, cell)
+        return moves
+
+    def to_tt(self, value, ply):
+        # Wins are stored relative to the node, not the root
+        if value >= WIN - self.cells:
+            return value + ply
+        if value <= -(WIN - self.cells):
+            return value - ply
+        return value
+
+    def from_tt(self, value, ply):
+        if value >= WIN - self.cells:
+            return value - ply
+        if value <= -(WIN - self.cells):
+            return value + ply
+        return value
@@ -0,0 +1,204 @@
+# Headless self-play: plays ComputerPlayer strategies against each other on
+# every core and streams the games to a compact binary file.
+# Usage: python selfplay.py --games 1000000 --x perfect --o random --out games.bin
+#        python selfplay.py --read games.bin
+import argparse
+import importlib
+import os
+import random
+import struct
+import time
+from multiprocessing import Pool
+from bitboard import BitBoard
+from book import Book
+from search import TimedSearch
+from solver import Solver, random_move, heuristic_move
+
+MAGIC = b"TTTS"
+VERSION = 1
+HEADER = struct.Struct("<4sBBB")  # Magic, version, size, win length
+RECORD = struct.Struct("<BH")  # Outcome, move count; moves follow
+THINK_TIME = 0.05  # Seconds per searched move; self-play wants many games
+
+DRAW, X_WINS, O_WINS = 0, 1, 2
+OUTCOMES = {DRAW: "draw", X_WINS: "X", O_WINS: "O"}
+
+_strategies = {}  # Per worker process: name -> strategy(board, player)
+
+
+def perfect_strategy(size, win_length, think_time):
+    # Plays like ComputerPlayer: the solver table on 3x3, elsewhere the
+    # opening book where it covers the position and a timed search after
+    if size == 3 and win_length == 3:
+        return Solver.load_or_build().choose
+    book = Book.open(size, win_length)
+    search = TimedSearch(size, win_length)
+
+    def choose(board, player):
+        if book:
+            move = book.choose(board, player)
+            if move != -1:
+                return move
+        return search.choose(board, player, think_time)
+    return choose
+
+
+def load_strategy(name, size=3, win_length=3, think_time=THINK_TIME):
+    # Difficulty names from ComputerPlayer, or "module:function"
+    if name not in _strategies:
+        if name == "random":
+            _strategies[name] = random_move
+        elif name == "heuristic":
+            _strategies[name] = heuristic_move
+        elif name == "perfect":
+            _strategies[name] = perfect_strategy(size, win_length, think_time)
+        else:
+            module, _, function = name.partition(":")
+            _strategies[name] = getattr(importlib.import_module(module), function)
+    return _strategies[name]
+
+
+def play_game(size, win_length, strategies, first):
+    # Same rules as ComputerPlayer.process_packet, without the packet queue
+    board = BitBoard(size, win_length)
+    player = first
+    moves = []
+    while True:
+        move = strategies[player](board, player)
+        if not board.is_free(move):
+            raise ValueError(f"Strategy for {player} played illegal move {move}")
+        board.play(move, player)
+        moves.append(move)
+        if board.has_won(player, move):
+            return (X_WINS if player == "X" else O_WINS), moves
+        if board.is_full():
+            return DRAW, moves
+        player = "O" if player == "X" else "X"
+
+
+def encode_game(outcome, moves, move_format):
+    return RECORD.pack(outcome, len(moves)) + struct.pack(
+        f"<{len(moves)}{move_format}", *moves)
+
+
+def move_format(size):
+    return "B" if size * size <= 256 else "H"
+
+
+def play_chunk(task):
+    # Runs in a worker process; returns packed games plus counters
+    size, win_length, x_name, o_name, games, seed, think_time = task
+    random.seed(seed)
+    strategies = {"X": load_strategy(x_name, size, win_length, think_time),
+                  "O": load_strategy(o_name, size, win_length, think_time)}
+    fmt = move_format(size)
+    counts = [0, 0, 0]
+    records = []
+    start = time.perf_counter()
+    for _ in range(games):
+        outcome, moves = play_game(size, win_length, strategies,
+                                   random.choice("XO"))
+        counts[outcome] += 1
+        records.append(encode_game(outcome, moves, fmt))
+    return os.getpid(), games, time.perf_counter() - start, counts, b"".join(records)
+
+
+def read_games(path):
+    # Yields (outcome, moves) for every game in a self-play file
+    with open(path, "rb") as f:
+        magic, version, size, win_length = HEADER.unpack(f.read(HEADER.size))
+        if magic != MAGIC or version != VERSION:
+            raise ValueError(f"{path} is not a version {VERSION} self-play file")
+        fmt = move_format(size)
+        width = struct.calcsize(fmt)
+        while True:
+            header = f.read(RECORD.size)
+            if len(header) < RECORD.size:
+                return
+            outcome, count = RECORD.unpack(header)
+            yield outcome, list(struct.unpack(f"<{count}{fmt}",
+                                              f.read(count * width)))
+
+
+def run(games, size, win_length, x_name, o_name, out, workers, chunk, seed,
+        think_time=THINK_TIME):
+    tasks = []
+    remaining = games
+    while remaining > 0:
+        tasks.append((size, win_length, x_name, o_name, min(chunk, remaining),
+                      seed + len(tasks), think_time))
+        remaining -= chunk
+
+    counts = [0, 0, 0]
+    per_worker = {}
+    start = time.perf_counter()
+    with open(out, "wb") as f, Pool(workers) as pool:
+        f.write(HEADER.pack(MAGIC, VERSION, size, win_length))
+        for pid, played, elapsed, chunk_counts, data in pool.imap_unordered(
+                play_chunk, tasks):
+            f.write(data)  # Stream results as chunks finish
+            done, busy = per_worker.get(pid, (0, 0.0))
+            per_worker[pid] = (done + played, busy + elapsed)
+            for outcome, count in enumerate(chunk_counts):
+                counts[outcome] += count
+    elapsed = time.perf_counter() - start
+
+    for pid, (done, busy) in sorted(per_worker.items()):
+        print(f"Worker {pid}: {done} games, {done / busy:,.0f} games/sec")
+    print(f"Total: {games} games in {elapsed:.2f}s "
+          f"({games / elapsed:,.0f} games/sec) -> {out} "
+          f"({os.path.getsize(out):,} bytes)")
+    print_summary(counts)
+
+
+def print_summary(counts):
+    total = sum(counts) or 1
+    for outcome in (X_WINS, O_WINS, DRAW):
+        label = "Draws" if outcome == DRAW else f"{OUTCOMES[outcome]} wins"
+        print(f"{label:>7}: {counts[outcome]:>10} ({counts[outcome] / total:.2%})")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Headless self-play")
+    parser.add_argument("--games", type=int, default=100000)
+    parser.add_argument("--size", type=int, default=3)
+    parser.add_argument("--win-length", type=int, default=None)
+    parser.add_argument("--x", default="perfect",
+                        help="random, heuristic, perfect or module:function; "
+                             "perfect is exact on 3x3 and on larger boards "
+                             "plays from the opening book, then searches "
+                             "for --think-time")
+    parser.add_argument("--o", default="random")
+    parser.add_argument("--think-time", type=float, default=THINK_TIME,
+                        help="Seconds per move for perfect players "
+                             "searching beyond the book")
+    parser.add_argument("--out", default="selfplay.bin")
+    parser.add_argument("--workers", type=int, default=os.cpu_count())
+    parser.add_argument("--chunk", type=int, default=10000,
+                        help="Games per worker task")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--read", metavar="FILE",
+                        help="Summarise an existing self-play file instead")
+    args = parser.parse_args()
+    if args.games < 0:
+        parser.error("--games can't be negative")
+    if args.chunk < 1:
+        parser.error("--chunk must be at least 1")  # Else run() never ends
+    if args.workers < 1:
+        parser.error("--workers must be at least 1")
+    if args.think_time <= 0:
+        parser.error("--think-time must be positive")
+
+    if args.read:
+        counts = [0, 0, 0]
+        for outcome, _ in read_games(args.read):
+            counts[outcome] += 1
+        print_summary(counts)
+        return
+
+    run(args.games, args.size, args.win_length or args.size, args.x, args.o,
+        args.out, args.workers, args.chunk, args.seed, args.think_time)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,43 +1,157 @@
+import logging
+import os
 import socket
 import random
 import json
 from threading import Thread
 from IGameInstance import *
-from copy import deepcopy
 from json_utils import *
+from codec import choose_codec, choose_features
+from heartbeat import PONG
+from movelog import END, MOVE, RESET, TURN, MoveLog, recover
+from metrics import PACKETS_REJECTED
+from session import RESUME_TIMEOUT, UNNUMBERED, Session, resume_packet
+from validate import move_error
+
+logger = logging.getLogger(__name__)
 
 
 class Server(IGameInstance):
-    def __init__(self, host="localhost", port="12345"):
-        super().__init__("server", host, port)
+    limit_peer = True  # Rate limit and check what the client sends
+
+    def __init__(self, host="localhost", port="12345", size=3, win_length=3,
+                 snapshot_interval=0, log_path=None):
+        super().__init__("server", host, port, size, win_length)
         self.id = "O"
+        self.delta = False  # Peer accepts DELTA updates instead of GAME_STATE
+        self.seq = 0  # Sequence number of the last state update
+        self.snapshot_interval = snapshot_interval  # Moves between snapshots
+        self.room_id = 0  # Match id in the move log
+        self.log_path = log_path
+        self.log = None
+        self.session = None  # Numbers and keeps packets for a resuming client
+        self.resuming = False  # Holding packets until the client says RESUME
 
     def initialize(self):
-        print("Starting server...")
+        logger.info("Starting server...")
+        resumed = self.open_log()
+        self.socket = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
+        # Rebind straight away after a crash, despite TIME_WAIT
+        self.socket.setsockopt(socket.SOL_SOCKET, socket.SO_REUSEADDR, 1)
         self.socket.bind((self.host, self.port))
         self.socket.listen(1)
-        self.connection, _ = self.socket.accept()
-        print("Client connected.")
-        self.decide_first_player()
+        connection, _ = self.socket.accept()
+        self.set_connection(connection)
+        logger.info("Client connected.")
+        self.session = Session()
+        super().send_packet(resume_packet(self.session.token, 0))
+        self.send_packet(self.config_packet())
+        if resumed:
+            logger.info("Resuming match, %s to move.", self.current_player)
+            self.send_packet({"type": PacketType.GAME_STATE.value,
+                              "board": self.board.to_list()})
+            self.broadcast(createPlayerTurnPacket(self.current_player))
+        else:
+            self.decide_first_player()
+
+    def open_log(self):
+        # Returns True if the log held an unfinished match to pick up
+        if not self.log_path:
+            return False
+        state = None
+        if os.path.exists(self.log_path):
+            _, _, matches = recover(self.log_path)
+            state = matches.get(self.room_id)
+        self.log = MoveLog(self.log_path, self.size, self.win_length)
+        if state is None or state.current_player is None:
+            return False
+        self.board = state.board(self.size, self.win_length)
+        self.current_player = state.current_player
+        return True
+
+    def send_packet(self, packet):
+        if self.session and packet.get("type") not in UNNUMBERED:
+            self.session.record(packet)
+        if self.connection is None or self.resuming:
+            return  # Replayed from the session once the client is back
+        super().send_packet(packet)
+
+    def connection_lost(self):
+        self.packet_queue.put(ConnectionEvent())
+
+    def put_packets(self, packets):
+        # From the network: the client may only move for itself
+        for packet in packets:
+            if packet.get("type") == PacketType.MOVE.value:
+                packet["player"] = "X" if self.id == "O" else "O"
+        super().put_packets(packets)
+
+    def connection_changed(self, connection):
+        if connection is None:
+            self.drop_connection()
+            logger.warning(
+                "Connection lost, waiting for the client to reconnect...")
+            self.notify({"type": "RECONNECTING"})
+            Thread(target=self.accept_reconnect, daemon=True).start()
+            return
+        logger.info("Client reconnected.")
+        self.set_connection(connection)
+        self.resuming = True
+        self.watch_connection(connection)
+
+    def accept_reconnect(self):
+        self.socket.settimeout(RESUME_TIMEOUT)
+        try:
+            connection, _ = self.socket.accept()
+        except socket.timeout:
+            logger.warning("Client did not come back.")
+            self.notify({"type": "DISCONNECTED"})
+            return
+        except OSError:
+            return  # Listening socket closed by stop()
+        self.packet_queue.put(ConnectionEvent(connection))
+
+    def resume(self, token, seen):
+        # Replay what the client missed, or start it over from the full
+        # state if it's a new client or has fallen out of the ring
+        self.resuming = False
+        missed = None
+        if self.session and token == self.session.token:
+            missed = self.session.missed(seen)
+        if missed is None:
+            self.session = Session()
+            super().send_packet(resume_packet(self.session.token, 0))
+            self.send_packet(self.config_packet())
+            self.send_packet(self.snapshot_packet())
+            logger.info("Client resynced from the full game state.")
+        else:
+            super().send_packet(resume_packet(token, seen))
+            for packet in missed:
+                super().send_packet(packet)
+            logger.info("Client resumed, replayed %d packets.", len(missed))
+        self.notify({"type": "TURN", "player": self.current_player})
+
+    def log_event(self, kind, cell=0, player=None):
+        if self.log:
+            self.log.append(kind, self.room_id, cell, player)
 
     def decide_first_player(self):
         self.current_player = random.choice(
             ["X", "O"])  # Decide the first player
-        print(f"{self.current_player} starts!")
-
-        # Notify the client about the starting player
-        self.send_packet(createPlayerTurnPacket(self.current_player))
+        logger.info("%s starts!", self.current_player)
+        self.log_event(TURN, player=self.current_player)
 
-        # Update the server's own queue for GUI sync
-        self.packet_queue.put(
-            createPlayerTurnPacket(self.current_player))
+        # Notify the client and our own queue (for GUI sync)
+        self.broadcast(createPlayerTurnPacket(self.current_player))
 
     def reset_game(self):
-        self.board = [" "] * 9  # Clear the board
+        self.board = self.new_board()  # Clear the board
         self.current_player = None  # Reset the current player
-        self.packet_queue.queue.clear()  # Clear any pending packets
+        self.clear_packets()  # Clear any pending packets
         self.send_packet({"type": PacketType.RESET.value})
         self.isOver = False  # Reset game over flag
+        self.log_event(RESET)
+        self.notify({"type": "RESET"})
         self.decide_first_player()
 
     def process_packet(self, packet):
@@ -48,68 +162,115 @@ class Server(IGameInstance):
             move = packet.get("move")
 
             # Only process valid moves
-            if self.board[move] == " ":
-                self.board[move] = player
-                print(f"Move processed: Player {player} to position {move}")
-
-                # Send updated game state to the client
-                self.send_game_state()
-
-                # Check for win
-                if self.check_win(player):
-                    result = {"type": PacketType.GAME_WIN.value,
-                              "result": f"Player {player} wins!"}
-                    self.send_packet(result)
-                    self.packet_queue.put(result)
-                    self.isOver = True
-                elif " " not in self.board:
-                    # If no spaces left, it's a draw
-                    result = {"type": PacketType.GAME_WIN.value,
-                              "result": "The game is a draw!"}
-                    self.send_packet(result)
-                    self.packet_queue.put(result)
-                    self.isOver = True
-                else:
-                    # Alternate turn
-                    self.current_player = "O" if player == "X" else "X"
-                    self.send_packet(
-                        {"type": PacketType.PLAYER_TURN.value,
-                            "player": self.current_player}
-                    )
-                    self.packet_queue.put(
-                        {"type": PacketType.PLAYER_TURN.value,
-                            "player": self.current_player}
-                    )
+            reason = move_error(packet, self.board, self.current_player,
+                                self.isOver)
+            if reason:
+                PACKETS_REJECTED.inc(reason)
+                logger.debug("Move by %s at %r rejected: %s", player, move,
+                             reason)
+                return
+
+            self.board.play(move, player)
+            logger.debug("Move processed: Player %s to position %s",
+                         player, move)
+            self.log_event(MOVE, move, player)
+            self.notify({"type": "CELL", "index": move, "player": player})
+
+            # Check for win
+            result = None
+            if self.check_win(player, move):
+                result = f"Player {player} wins!"
+            elif self.board.is_full():
+                # If no spaces left, it's a draw
+                result = "The game is a draw!"
+            else:
+                # Alternate turn
+                self.current_player = "O" if player == "X" else "X"
+
+            self.seq += 1
+            self.publish_move(move, player, result)
+            if result:
+                self.isOver = True
+                self.log_event(END)
+                self.notify({"type": "END", "result": result})
             else:
-                print(f"Invalid move by {player} at position {move} ignored.")
+                self.notify({"type": "TURN", "player": self.current_player})
+
+        elif packet_type == PacketType.PING.value:
+            self.send_packet(PONG)
+
+        elif packet_type == PacketType.SYNC.value:
+            # The peer lost track of the state; send a full snapshot
+            self.send_packet(self.snapshot_packet())
+
+        elif packet_type == PacketType.RESUME.value:
+            self.resume(packet.get("token"), packet.get("seq", 0))
+
+        elif packet_type == PacketType.HELLO.value:
+            if self.resuming:
+                self.resume(None, 0)  # A fresh client, not a returning one
+            # Answer in the current format, then switch to the agreed one
+            codec = choose_codec(packet.get("codecs"))
+            features = choose_features(packet.get("features"))
+            self.send_packet({"type": PacketType.HELLO.value, "codec": codec,
+                              "features": features})
+            self.codec = codec
+            self.delta = "delta" in features
+            logger.info("Using %s wire format, features: %s", codec, features)
 
         elif packet_type == PacketType.PLAYER_TURN.value:
             self.current_player = packet.get("player")
-            print(f"It's {self.current_player}'s turn!")
+            logger.debug("It's %s's turn!", self.current_player)
+            self.notify({"type": "TURN", "player": self.current_player})
 
-        elif packet_type == PacketType.GAME_STATE.value:
-            self.board = packet.get("board")
-            print("Updated board:", self.board)
+    def broadcast(self, packet):
+        # Send to the peer and mirror into our own queue for GUI sync
+        self.send_packet(packet)
+        self.packet_queue.put(packet)
 
-        elif packet_type == PacketType.GAME_WIN.value:
-            result = packet.get("result")
-            self.gui_callback(
-                {"type": "END", "result": result})
+    def move_packets(self, move, player, result, delta):
+        # Packets that tell a peer about an accepted move
+        if delta:
+            packets = [{"type": PacketType.DELTA.value, "seq": self.seq,
+                        "cell": move, "player": player,
+                        "next": None if result else self.current_player,
+                        "result": result}]
+            if self.snapshot_interval and self.seq % self.snapshot_interval == 0:
+                # isOver isn't set yet when the winning move goes out
+                packets.append(self.snapshot_packet(over=bool(result)))
+            return packets
 
-    def send_game_state(self):
-        packet = {"type": PacketType.GAME_STATE.value, "board": self.board}
-        self.send_packet(packet)
-        self.packet_queue.put(deepcopy(packet))
+        packets = [{"type": PacketType.GAME_STATE.value,
+                    "board": self.board.to_list()}]
+        if result:
+            packets.append({"type": PacketType.GAME_WIN.value,
+                            "result": result})
+        else:
+            packets.append(createPlayerTurnPacket(self.current_player))
+        return packets
+
+    def publish_move(self, move, player, result):
+        # Our own board and turn are already up to date, only the peer
+        # needs to hear about the move
+        for packet in self.move_packets(move, player, result, self.delta):
+            self.send_packet(packet)
+
+    def snapshot_packet(self, over=False):
+        return {"type": PacketType.SNAPSHOT.value, "seq": self.seq,
+                "player": None if over or self.isOver
+                else self.current_player,
+                "board": self.board.to_list()}
+
+    def stop(self):
+        super().stop()
+        if self.socket:
+            self.socket.close()  # Ends a pending reconnect wait
+        if self.log:
+            self.log.close()
 
     def play_turn(self, index=None):
-        if index is not None and self.board[index] == " ":
+        if index is not None and self.board.is_free(index):
             self.packet_queue.put(
                 {"type": "MOVE", "player": self.id, "move": index})
         else:
-            print("Invalid move.")
-
-    def run_game(self):
-        while self.running:
-            if not self.packet_queue.empty():
-                packet = self.packet_queue.get()
-                self.process_packet(packet)
+            logger.warning("Invalid move.")
@@ -0,0 +1,77 @@
+import hashlib
+import hmac
+import os
+import random
+import secrets
+from collections import deque
+from packets import PacketType
+
+RING_SIZE = 256  # Packets kept for replay after a reconnect
+RESUME_TIMEOUT = 60.0  # Seconds a session waits for its peer to come back
+BACKOFF_INITIAL = 0.1
+BACKOFF_MAX = 5.0
+
+# Handshake packets live outside the numbered stream; every other packet
+# is numbered by its position, so the numbers never go on the wire and
+# binary frames keep their layouts
+UNNUMBERED = {PacketType.HELLO.value, PacketType.RESUME.value,
+              PacketType.PING.value, PacketType.PONG.value}
+
+
+class Session:
+    # The server side of a resumable connection: numbers outgoing packets
+    # and keeps the newest RING_SIZE of them for replay
+    def __init__(self, capacity=RING_SIZE, token=None):
+        self.token = token or secrets.token_hex(16)
+        self.seq = 0  # Number of the last packet sent
+        self.ring = deque(maxlen=capacity)
+
+    def record(self, packet):
+        self.seq += 1
+        self.ring.append(packet)
+
+    def missed(self, seen):
+        # Packets after number `seen`, or None if they're no longer kept
+        behind = self.seq - seen
+        if behind < 0 or behind > len(self.ring):
+            return None
+        return list(self.ring)[len(self.ring) - behind:]
+
+
+def load_key(path):
+    # Secret the seat tokens are derived from, kept next to the move log so
+    # players can come back to recovered matches after a restart
+    try:
+        with open(path, "rb") as f:
+            return f.read()
+    except FileNotFoundError:
+        pass
+    key = secrets.token_bytes(32)
+    try:
+        fd = os.open(path, os.O_WRONLY | os.O_CREAT | os.O_EXCL, 0o600)
+    except FileExistsError:
+        with open(path, "rb") as f:  # Another process got there first
+            return f.read()
+    with os.fdopen(fd, "wb") as f:
+        f.write(key)
+    return key
+
+
+def seat_token(key, room_id, symbol):
+    return hmac.new(key, f"{room_id}:{symbol}".encode(),
+                    hashlib.sha256).hexdigest()[:32]
+
+
+def resume_packet(token, seq):
+    return {"type": PacketType.RESUME.value, "token": token, "seq": seq}
+
+
+def backoff_delays(initial=BACKOFF_INITIAL, maximum=BACKOFF_MAX,
+                   total=RESUME_TIMEOUT):
+    # Exponential backoff with full jitter, until `total` seconds are used up
+    delay = initial
+    while total > 0:
+        wait = min(total, random.uniform(0, delay))
+        total -= wait
+        yield wait
+        delay = min(maximum, delay * 2)
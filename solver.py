@@ -0,0 +1,199 @@
+import logging
+import os
+import random
+import struct
+from bitboard import SIZE, FULL_MASK, WINNING
+
+logger = logging.getLogger(__name__)
+
+TABLE_PATH = os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                          "solver_table.bin")
+RECORD = struct.Struct("<IbB")  # Canonical key, value, best move
+
+EXACT, LOWER, UPPER = 0, 1, 2
+
+DIFFICULTIES = ["random", "heuristic", "perfect"]  # Computer player levels
+
+
+def _transforms():
+    # Cell permutations for the 8 symmetries of the 3x3 square
+    coords = [(i // 3, i % 3) for i in range(SIZE)]
+    maps = [
+        lambda r, c: (r, c), lambda r, c: (c, 2 - r),
+        lambda r, c: (2 - r, 2 - c), lambda r, c: (2 - c, r),
+        lambda r, c: (r, 2 - c), lambda r, c: (2 - r, c),
+        lambda r, c: (c, r), lambda r, c: (2 - c, 2 - r),
+    ]
+    return [[row * 3 + col for row, col in (m(r, c) for r, c in coords)]
+            for m in maps]
+
+
+PERMUTATIONS = _transforms()
+INVERSE = [[perm.index(i) for i in range(SIZE)] for perm in PERMUTATIONS]
+
+# SYMMETRY[t][mask] is mask with every cell moved by transform t
+SYMMETRY = [
+    [sum(1 << perm[i] for i in range(SIZE) if mask >> i & 1)
+     for mask in range(1 << SIZE)]
+    for perm in PERMUTATIONS
+]
+
+
+def canonical(me, opp):
+    # Smallest key among the 8 symmetric images, plus the transform used
+    best_key, best_t = None, 0
+    for t, table in enumerate(SYMMETRY):
+        key = table[me] | table[opp] << SIZE
+        if best_key is None or key < best_key:
+            best_key, best_t = key, t
+    return best_key, best_t
+
+
+def legal_moves(me, opp):
+    moves = []
+    free = FULL_MASK & ~(me | opp)
+    while free:
+        low = free & -free
+        moves.append(low.bit_length() - 1)
+        free ^= low
+    return moves
+
+
+class Solver:
+    # Negamax with alpha-beta over canonical positions, relative to the
+    # player to move: me is the mover's mask, opp the opponent's
+    def __init__(self):
+        self.table = {}  # Canonical key -> (value, best move)
+        self.tt = {}  # Canonical key -> (flag, value, move) during search
+
+    def negamax(self, me, opp, alpha, beta):
+        key, t = canonical(me, opp)
+        me, opp = SYMMETRY[t][me], SYMMETRY[t][opp]
+
+        if WINNING[opp]:
+            # The previous move won; faster wins score higher
+            return -(SIZE + 1 - bin(me | opp).count("1")), -1
+        if me | opp == FULL_MASK:
+            return 0, -1
+
+        original_alpha = alpha
+        entry = self.tt.get(key)
+        if entry is not None:
+            flag, value, move = entry
+            if flag == EXACT:
+                return value, move
+            if flag == LOWER:
+                alpha = max(alpha, value)
+            else:
+                beta = min(beta, value)
+            if alpha >= beta:
+                return value, move
+
+        best_value, best_move = -SIZE - 2, -1
+        for move in legal_moves(me, opp):
+            value = -self.negamax(opp, me | 1 << move, -beta, -alpha)[0]
+            if value > best_value:
+                best_value, best_move = value, move
+            alpha = max(alpha, value)
+            if alpha >= beta:
+                break
+
+        if best_value <= original_alpha:
+            flag = UPPER
+        elif best_value >= beta:
+            flag = LOWER
+        else:
+            flag = EXACT
+        self.tt[key] = (flag, best_value, best_move)
+        return best_value, best_move
+
+    def solve(self, me, opp):
+        # Exact value and best move in canonical coordinates
+        key, t = canonical(me, opp)
+        entry = self.table.get(key)
+        if entry is None:
+            entry = self.negamax(SYMMETRY[t][me], SYMMETRY[t][opp],
+                                 -SIZE - 2, SIZE + 2)
+            self.table[key] = entry
+        return entry, t
+
+    def best_move(self, me, opp):
+        (_, move), t = self.solve(me, opp)
+        return INVERSE[t][move] if move >= 0 else -1
+
+    def choose(self, board, player):
+        # Only the classic 3x3 board is small enough to solve exactly
+        if not board.is_classic():
+            return heuristic_move(board, player)
+        return self.best_move(board.mask(player),
+                              board.mask("O" if player == "X" else "X"))
+
+    def build(self):
+        # Solve every reachable, unfinished position once
+        seen = set()
+        stack = [(0, 0)]
+        while stack:
+            me, opp = stack.pop()
+            key, _ = canonical(me, opp)
+            if key in seen or WINNING[opp] or me | opp == FULL_MASK:
+                continue
+            seen.add(key)
+            self.solve(me, opp)
+            for move in legal_moves(me, opp):
+                stack.append((opp, me | 1 << move))
+        self.tt = {}
+
+    def save(self, path=TABLE_PATH):
+        with open(path, "wb") as f:
+            for key, (value, move) in self.table.items():
+                f.write(RECORD.pack(key, value, move))
+
+    def load(self, path=TABLE_PATH):
+        with open(path, "rb") as f:
+            data = f.read()
+        self.table = {key: (value, move)
+                      for key, value, move in RECORD.iter_unpack(data)}
+
+    @classmethod
+    def load_or_build(cls, path=TABLE_PATH):
+        solver = cls()
+        try:
+            solver.load(path)
+        except (OSError, struct.error):
+            logger.info("Building solver table...")
+            solver.build()
+            try:
+                solver.save(path)
+            except OSError as e:
+                logger.warning("Could not save solver table: %s", e)
+        return solver
+
+
+def random_move(board, player):
+    moves = board.legal_moves()
+    return random.choice(moves) if moves else -1
+
+
+def heuristic_move(board, player):
+    # Win, block, then prefer central cells (corners before edges)
+    moves = board.legal_moves()
+    if not moves:
+        return -1
+    me = board.mask(player)
+    opp = board.mask("O" if player == "X" else "X")
+    for move in moves:
+        if board.wins_at(move, me | 1 << move):
+            return move
+    for move in moves:
+        if board.wins_at(move, opp | 1 << move):
+            return move
+
+    center = (board.size - 1) / 2
+
+    def centrality(move):
+        row, col = divmod(move, board.size)
+        dr, dc = abs(row - center), abs(col - center)
+        return (max(dr, dc), -(dr + dc))
+
+    best = min(centrality(move) for move in moves)
+    return random.choice([move for move in moves if centrality(move) == best])
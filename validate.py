@@ -0,0 +1,84 @@
+# Cheap checks on what peers send, run before the game logic sees it: a
+# token bucket per connection, a shape check as packets come off the wire,
+# and the rules a MOVE must pass before it touches the board.
+from packets import PacketType
+
+RATE = 20.0  # Packets per second a peer may keep sending
+BURST = 40  # ...and how many it may send at once
+FLOOD_LIMIT = 200  # Packets dropped in one flood before the peer is cut off
+MAX_RATING = 10000  # Highest HELLO rating taken for matchmaking
+
+# Rejection reasons, the label of PACKETS_REJECTED
+RATE_LIMITED = "rate_limited"
+MALFORMED = "malformed"
+OFF_BOARD = "off_board"
+GAME_OVER = "game_over"
+OUT_OF_TURN = "out_of_turn"
+TAKEN = "taken"
+
+MOVE = PacketType.MOVE.value
+TYPES = frozenset(packet_type.value for packet_type in PacketType)
+
+
+class TokenBucket:
+    __slots__ = ("rate", "burst", "tokens", "updated", "dropped")
+
+    def __init__(self, rate=RATE, burst=BURST, now=0.0):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = now
+        self.dropped = 0  # Packets refused since the bucket was last full
+
+    def allow(self, now):
+        tokens = self.tokens + (now - self.updated) * self.rate
+        if tokens >= self.burst:
+            # Quiet long enough to refill: earlier bursts are forgiven, so
+            # only a peer that never lets up reaches FLOOD_LIMIT
+            tokens = self.burst
+            self.dropped = 0
+        self.updated = now
+        if tokens < 1:
+            self.tokens = tokens
+            self.dropped += 1
+            return False
+        self.tokens = tokens - 1
+        return True
+
+
+def admit(packet, bucket, now):
+    # Reason to drop a packet straight off the wire, or None. bucket may be
+    # None for an unlimited connection
+    if bucket is not None and not bucket.allow(now):
+        return RATE_LIMITED
+    if type(packet) is not dict or type(packet.get("type")) is not str:
+        return MALFORMED
+    if packet["type"] not in TYPES:
+        return MALFORMED  # Unknown types would also become metric labels
+    if packet["type"] == MOVE and type(packet.get("move")) is not int:
+        return MALFORMED
+    return None
+
+
+def move_error(packet, board, current_player, over):
+    # Reason a MOVE can't be played on board, or None
+    move = packet.get("move")
+    if type(move) is not int:
+        return MALFORMED
+    if not 0 <= move < board.size * board.size:
+        return OFF_BOARD
+    if over:
+        return GAME_OVER
+    if packet.get("player") != current_player:
+        return OUT_OF_TURN
+    if not board.is_free(move):
+        return TAKEN
+    return None
+
+
+def rating_error(rating):
+    # Reason a HELLO rating can't be matched on, or None. NaN fails the
+    # range check too
+    if type(rating) not in (int, float) or not 0 <= rating <= MAX_RATING:
+        return MALFORMED
+    return None
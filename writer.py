@@ -0,0 +1,139 @@
+import logging
+import socket
+import threading
+import time
+from collections import deque
+from metrics import SEND_SECONDS
+
+logger = logging.getLogger(__name__)
+
+MAX_QUEUED_BYTES = 1 << 20  # Peers further behind than this get dropped
+DRAIN_TIMEOUT = 1.0  # Seconds close() gives queued packets to go out
+
+
+class WriteStats:
+    # Counters for outbound batching, shared by any number of connections
+    def __init__(self):
+        self.batches = 0
+        self.packets = 0
+        self.bytes = 0
+        self.max_batch_bytes = 0
+        self.queued_bytes = 0
+        self.peak_queued_bytes = 0
+        self.dropped_peers = 0
+
+    def record_batch(self, packets, size):
+        self.batches += 1
+        self.packets += packets
+        self.bytes += size
+        self.max_batch_bytes = max(self.max_batch_bytes, size)
+
+    def record_queued(self, delta):
+        self.set_queued(self.queued_bytes + delta)
+
+    def set_queued(self, total):
+        # For owners that measure their backlog instead of tracking it
+        self.queued_bytes = total
+        self.peak_queued_bytes = max(self.peak_queued_bytes, total)
+
+    def as_dict(self):
+        batches = self.batches or 1
+        return {"write_batches": self.batches,
+                "packets_per_batch": self.packets / batches,
+                "bytes_per_batch": self.bytes / batches,
+                "max_batch_bytes": self.max_batch_bytes,
+                "queued_bytes": self.queued_bytes,
+                "peak_queued_bytes": self.peak_queued_bytes,
+                "dropped_peers": self.dropped_peers}
+
+
+class OutboundWriter:
+    # Collects the packets of one dispatch cycle and hands them to a writer
+    # thread as a single write, so a slow peer never blocks game logic
+    def __init__(self, connection, max_queued_bytes=MAX_QUEUED_BYTES, stats=None):
+        self.connection = connection
+        self.max_queued_bytes = max_queued_bytes
+        self.stats = stats or WriteStats()
+        self.pending = []  # Encoded packets of the current cycle
+        self.queue = deque()  # (packet count, bytes, queued at) for the socket
+        self.queued_bytes = 0
+        self.condition = threading.Condition()
+        self.running = True
+        self.thread = threading.Thread(target=self.write_loop, daemon=True)
+        self.thread.start()
+
+    def enqueue(self, data):
+        with self.condition:
+            if self.running:
+                self.pending.append(data)
+
+    def flush(self):
+        with self.condition:
+            if not self.pending or not self.running:
+                return
+            batch = b"".join(self.pending)
+            count = len(self.pending)
+            self.pending = []
+            if self.queued_bytes + len(batch) > self.max_queued_bytes:
+                logger.warning("Peer is too far behind, disconnecting.")
+                self.stats.dropped_peers += 1
+                self.disconnect()
+                return
+            self.queued_bytes += len(batch)
+            self.stats.record_queued(len(batch))
+            self.queue.append((count, batch, time.perf_counter()))
+            self.condition.notify()
+
+    def write_loop(self):
+        while True:
+            with self.condition:
+                while self.running and not self.queue:
+                    self.condition.wait()
+                if not self.running:
+                    return
+                # Whatever piled up while the last write was running goes
+                # out together
+                batches = list(self.queue)
+                self.queue.clear()
+            data = b"".join(batch for _, batch, _ in batches)
+            try:
+                self.connection.sendall(data)
+            except OSError as e:
+                logger.error("Error sending packet: %s", e)
+                with self.condition:
+                    self.disconnect()
+                return
+            sent = time.perf_counter()
+            for _, _, queued in batches:
+                SEND_SECONDS.observe(sent - queued)
+            with self.condition:
+                self.queued_bytes -= len(data)
+                self.stats.record_queued(-len(data))
+                self.stats.record_batch(
+                    sum(count for count, _, _ in batches), len(data))
+                self.condition.notify_all()  # A draining close() waits on it
+
+    def disconnect(self):
+        # Called with the condition held; the receive side notices the
+        # shutdown and reports the lost connection
+        self.close(timeout=0)
+        try:
+            self.connection.shutdown(socket.SHUT_RDWR)
+        except OSError:
+            pass
+
+    def close(self, timeout=DRAIN_TIMEOUT):
+        # Sends what was already written (the END of a match, say), giving
+        # the peer up to timeout seconds to take it, then drops the rest
+        self.flush()
+        with self.condition:
+            if timeout > 0 and threading.current_thread() is not self.thread:
+                self.condition.wait_for(
+                    lambda: not self.running or not self.queued_bytes,
+                    timeout)
+            self.running = False
+            self.stats.record_queued(-self.queued_bytes)
+            self.queued_bytes = 0
+            self.queue.clear()
+            self.pending = []
+            self.condition.notify()